@@ -0,0 +1,479 @@
+"""
+Cache disque des artefacts dérivés d'un template .xlsm.
+
+Chaque template est identifié par le SHA-256 de son contenu : l'index des
+communes et le modèle compilé (cellules, formules, graphe de dépendances,
+bytecode) sont écrits dans ``<cache>/<sha256>/`` dans un format binaire
+simple, lisible par mmap sans copie. Un redémarrage ou un nouveau worker
+uvicorn recharge ces fichiers en quelques millisecondes ; si le template
+change, son hash change et les artefacts sont reconstruits.
+
+L'index des communes est utilisé directement depuis les pages mappées
+(codes, libellés, taux, index de recherche) : les workers partagent une seule
+copie via le cache de pages du système. Un seul thread/worker construit un
+artefact manquant (fichier verrou), les autres attendent puis le mappent.
+"""
+import hashlib
+import json
+import logging
+import marshal
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from communes import CommuneIndex, LABEL_COLUMNS, RATE_COLUMNS, CodeLookup, SortedKeys, load_commune_index
+from formula_engine import (
+    EMPTY, ENGINE_VERSION, ERRORS, CellRange, ExcelError, WorkbookModel, is_empty, load_workbook_model,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get("PORTALIA_CACHE_DIR", ".portalia_cache")
+
+# Âge (secondes) au-delà duquel le verrou de construction d'un artefact est
+# considéré comme abandonné par un worker arrêté en cours de route
+BUILD_LOCK_TIMEOUT = float(os.environ.get("PORTALIA_BUILD_LOCK_TIMEOUT", "300"))
+
+MAGIC = b"PORTALIA"
+FORMAT_VERSION = 2
+_ALIGNMENT = 8
+
+# Types de valeurs des cellules dans la section "value_kind"
+_NUMBER, _TEXT, _BOOL, _ERROR, _EMPTY = range(5)
+
+
+def template_hash(path: str) -> str:
+    """SHA-256 of the template file content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Conteneur binaire : en-tête JSON + sections alignées sur 8 octets
+# ---------------------------------------------------------------------------
+
+def write_sections(path: str, meta: Dict[str, Any], sections: Dict[str, Any]) -> None:
+    """Write ``sections`` (array or bytes) atomically to ``path``."""
+    layout = {}
+    offset = 0
+    for name, data in sections.items():
+        raw = data.tobytes() if isinstance(data, array) else bytes(data)
+        typecode = data.typecode if isinstance(data, array) else "B"
+        layout[name] = {"offset": offset, "length": len(raw), "typecode": typecode}
+        offset += len(raw) + (-len(raw) % _ALIGNMENT)
+    header = json.dumps({"version": FORMAT_VERSION, "meta": meta, "sections": layout}).encode("utf-8")
+    data_start = len(MAGIC) + 8 + len(header)
+    data_start += -data_start % _ALIGNMENT
+
+    directory = os.path.dirname(path) or "."
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as stream:
+            stream.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            stream.write(b"\0" * (data_start - stream.tell()))
+            for name, data in sections.items():
+                raw = data.tobytes() if isinstance(data, array) else bytes(data)
+                stream.write(raw + b"\0" * (-len(raw) % _ALIGNMENT))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_sections(path: str) -> Tuple[Dict[str, Any], Dict[str, memoryview]]:
+    """Map ``path`` in memory; sections are zero-copy, typed memoryviews."""
+    with open(path, "rb") as stream:
+        mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a Portalia artifact")
+    header_length = struct.unpack_from("<Q", mapped, len(MAGIC))[0]
+    header_start = len(MAGIC) + 8
+    header = json.loads(mapped[header_start:header_start + header_length].decode("utf-8"))
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact version {header['version']}")
+    data_start = header_start + header_length
+    data_start += -data_start % _ALIGNMENT
+    view = memoryview(mapped)
+    sections = {}
+    for name, section in header["sections"].items():
+        start = data_start + section["offset"]
+        sections[name] = view[start:start + section["length"]].cast(section["typecode"])
+    return header["meta"], sections
+
+
+def pack_strings(strings: Sequence[str]) -> Tuple[bytes, array]:
+    """
+    NUL-separated UTF-8 blob plus the start offset of each string (and one
+    past the end), so strings can be decoded one at a time or all at once.
+    """
+    offsets = array("q", [0])
+    chunks = []
+    position = 0
+    for string in strings:
+        encoded = string.encode("utf-8")
+        chunks.append(encoded)
+        position += len(encoded) + 1
+        offsets.append(position)
+    return b"\0".join(chunks), offsets
+
+
+class StringColumn:
+    """Read-only sequence of strings decoded lazily from a packed blob."""
+
+    def __init__(self, blob: memoryview, offsets: memoryview):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1] - 1]).decode("utf-8")
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self) -> List[str]:
+        """Decode every string with a single decode/split."""
+        if len(self) == 0:
+            return []
+        return bytes(self.blob).decode("utf-8").split("\0")
+
+
+class PackedMapping(Mapping):
+    """Mapping cell id -> string backed by a StringColumn (decoded on access)."""
+
+    def __init__(self, keys: List[int], column: StringColumn):
+        self._positions = {key: position for position, key in enumerate(keys)}
+        self._column = column
+
+    def __getitem__(self, key: int) -> str:
+        return self._column[self._positions[key]]
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+
+# ---------------------------------------------------------------------------
+# Sérialisation de l'index des communes
+# ---------------------------------------------------------------------------
+
+# Tableaux triés de CommuneIndex.search, dans l'ordre de _search_keys()
+_SEARCH_SECTIONS = ("search_code", "search_name", "search_word")
+
+
+def commune_index_to_sections(index: CommuneIndex) -> Dict[str, Any]:
+    sections = {}
+    for name, strings in [("code", index.codes)] + list(index.labels.items()):
+        sections[f"{name}_blob"], sections[f"{name}_offsets"] = pack_strings(list(strings))
+    for name, column in index.rates.items():
+        sections[f"rate_{name}"] = array("d", column)
+    # Index code -> ligne et index de recherche précalculés : rien à
+    # reconstruire dans chaque worker, tout reste dans les pages mappées
+    sections["code_table"] = CodeLookup.build(list(index.codes)).table
+    for name, keys in zip(_SEARCH_SECTIONS, index._search_keys()):
+        sections[f"{name}_blob"], sections[f"{name}_offsets"] = pack_strings(keys.keys)
+        sections[f"{name}_positions"] = array("q", keys.positions)
+    return sections
+
+
+def commune_index_from_sections(sections: Dict[str, memoryview]) -> CommuneIndex:
+    index = CommuneIndex()
+    index.codes = StringColumn(sections["code_blob"], sections["code_offsets"])
+    index._positions = CodeLookup(index.codes, sections["code_table"])
+    index.labels = {name: StringColumn(sections[f"{name}_blob"], sections[f"{name}_offsets"])
+                    for name in LABEL_COLUMNS.values()}
+    index.rates = {name: sections[f"rate_{name}"] for name in RATE_COLUMNS.values()}
+    index._search = tuple(SortedKeys(StringColumn(sections[f"{name}_blob"], sections[f"{name}_offsets"]),
+                                      sections[f"{name}_positions"]) for name in _SEARCH_SECTIONS)
+    return index
+
+
+# ---------------------------------------------------------------------------
+# Sérialisation du modèle compilé
+# ---------------------------------------------------------------------------
+
+def model_to_sections(model: WorkbookModel, code) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    sheet_index = {name: position for position, name in enumerate(model.sheet_names)}
+    kinds, numbers, texts = array("b"), array("d"), []
+    for value in model._values:
+        if isinstance(value, bool):
+            kinds.append(_BOOL), numbers.append(float(value)), texts.append("")
+        elif is_empty(value):
+            kinds.append(_EMPTY), numbers.append(0.0), texts.append("")
+        elif isinstance(value, (int, float)):
+            kinds.append(_NUMBER), numbers.append(float(value)), texts.append("")
+        elif isinstance(value, ExcelError):
+            kinds.append(_ERROR), numbers.append(0.0), texts.append(value.code)
+        else:
+            kinds.append(_TEXT), numbers.append(0.0), texts.append(str(value))
+
+    formula_ids = sorted(model._functions)
+    dependency_offsets, dependencies = array("q", [0]), array("i")
+    for cell_id in formula_ids:
+        dependencies.extend(model._dependencies[cell_id])
+        dependency_offsets.append(len(dependencies))
+
+    sheet_rows, sheet_row_offsets = array("i"), array("q", [0])
+    for name in model.sheet_names:
+        sheet_rows.extend(model._sheet_rows.get(name, []))
+        sheet_row_offsets.append(len(sheet_rows))
+
+    ranges = array("i")
+    for cell_range in model._ranges:
+        ranges.extend((sheet_index[cell_range.sheet], cell_range.r1, cell_range.c1, cell_range.r2, cell_range.c2))
+
+    sections: Dict[str, Any] = {
+        "cell_sheet": array("i", (sheet_index[sheet] for sheet, _, _ in model._addresses)),
+        "cell_row": array("i", (row for _, row, _ in model._addresses)),
+        "cell_col": array("i", (col for _, _, col in model._addresses)),
+        "value_kind": kinds,
+        "value_number": numbers,
+        "formula_ids": array("i", formula_ids),
+        "dependency_offsets": dependency_offsets,
+        "dependencies": dependencies,
+        "order": array("i", model._order),
+        "calc_chain": array("i", model._calc_chain),
+        "sheet_rows": sheet_rows,
+        "sheet_row_offsets": sheet_row_offsets,
+        "ranges": ranges,
+        "offset_ids": array("i", model._formula_offsets),
+        "offset_rows": array("i", (row for row, _ in model._formula_offsets.values())),
+        "offset_cols": array("i", (col for _, col in model._formula_offsets.values())),
+        "code": marshal.dumps(code),
+    }
+    sections["value_text_blob"], sections["value_text_offsets"] = pack_strings(texts)
+    sections["formula_text_blob"], sections["formula_text_offsets"] = pack_strings(
+        [model._formulas[cell_id] for cell_id in formula_ids])
+    sections["formula_source_blob"], sections["formula_source_offsets"] = pack_strings(
+        [model._sources[cell_id] for cell_id in formula_ids])
+    meta = {
+        "path": model.path,
+        "sheet_names": model.sheet_names,
+        "tables": model._tables,
+        "names": model._names,
+        "cache_tag": sys.implementation.cache_tag,
+        "engine_version": ENGINE_VERSION,
+    }
+    return meta, sections
+
+
+def model_from_sections(meta: Dict[str, Any], sections: Dict[str, memoryview]) -> WorkbookModel:
+    if meta.get("engine_version") != ENGINE_VERSION:
+        raise ValueError(f"compiled by formula engine version {meta.get('engine_version')}")
+    model = WorkbookModel(meta["path"])
+    model.sheet_names = meta["sheet_names"]
+    model._tables = {name: tuple(table) for name, table in meta["tables"].items()}
+    model._names = meta["names"]
+    sheet_names = model.sheet_names
+
+    # Construction en C (zip/map) : ~130 000 cellules en quelques millisecondes
+    model._addresses = list(zip(map(sheet_names.__getitem__, sections["cell_sheet"]),
+                                sections["cell_row"], sections["cell_col"]))
+    model._cells = dict(zip(model._addresses, range(len(model._addresses))))
+
+    kinds = bytes(sections["value_kind"])
+    texts = StringColumn(sections["value_text_blob"], sections["value_text_offsets"]).tolist()
+    values: List[Any] = [text if kind == _TEXT else number for kind, number, text
+                         in zip(kinds, sections["value_number"].tolist(), texts)]
+    for match in re.finditer(b"[\x02\x03\x04]", kinds):
+        cell_id = match.start()
+        if kinds[cell_id] == _BOOL:
+            values[cell_id] = bool(values[cell_id])
+        elif kinds[cell_id] == _EMPTY:
+            values[cell_id] = EMPTY
+        else:
+            values[cell_id] = ERRORS.get(texts[cell_id], ExcelError(texts[cell_id]))
+    model._values = values
+
+    offsets = sections["sheet_row_offsets"]
+    model._sheet_rows = {name: sections["sheet_rows"][offsets[i]:offsets[i + 1]].tolist()
+                         for i, name in enumerate(sheet_names)}
+
+    ranges = sections["ranges"]
+    for start in range(0, len(ranges), 5):
+        sheet, r1, c1, r2, c2 = ranges[start:start + 5].tolist()
+        model._range_keys[(sheet_names[sheet], r1, c1, r2, c2)] = len(model._ranges)
+        model._ranges.append(CellRange(model, sheet_names[sheet], r1, c1, r2, c2))
+
+    formula_ids = sections["formula_ids"].tolist()
+    model._formulas = PackedMapping(formula_ids, StringColumn(sections["formula_text_blob"],
+                                                              sections["formula_text_offsets"]))
+    model._sources = PackedMapping(formula_ids, StringColumn(sections["formula_source_blob"],
+                                                             sections["formula_source_offsets"]))
+    dependency_offsets, dependencies = sections["dependency_offsets"].tolist(), sections["dependencies"].tolist()
+    model._dependencies = {cell_id: tuple(dependencies[dependency_offsets[position]:dependency_offsets[position + 1]])
+                           for position, cell_id in enumerate(formula_ids)}
+    model._formula_offsets = dict(zip(sections["offset_ids"].tolist(),
+                                      zip(sections["offset_rows"].tolist(), sections["offset_cols"].tolist())))
+    model._order = sections["order"].tolist()
+    model._calc_chain = sections["calc_chain"].tolist()
+
+    # Le bytecode n'est réutilisable qu'avec la même version de Python
+    code = marshal.loads(sections["code"]) if meta["cache_tag"] == sys.implementation.cache_tag else None
+    model._compile(code)
+    return model
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", text).strip("_").lower()
+
+
+class ArtifactCache:
+    """Persistent cache of template artifacts keyed by the template SHA-256."""
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR):
+        self.root = root
+        self._hashes: Dict[Tuple[str, float, int], str] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def template_key(self, template_path: str) -> str:
+        """SHA-256 of the template, memoised on (path, mtime, size)."""
+        stat = os.stat(template_path)
+        key = (os.path.abspath(template_path), stat.st_mtime, stat.st_size)
+        if key not in self._hashes:
+            self._hashes[key] = template_hash(template_path)
+        return self._hashes[key]
+
+    def directory(self, template_path: str) -> str:
+        return os.path.join(self.root, self.template_key(template_path))
+
+    def _read(self, path: str, restore: Callable[[Dict, Dict], Any], start_time: float):
+        """Artifact mapped from ``path``, or None if it is missing or unreadable."""
+        if not os.path.exists(path):
+            return None
+        try:
+            meta, sections = read_sections(path)
+            artifact = restore(meta, sections)
+        except Exception as e:
+            logger.warning("Ignoring unreadable artifact %s: %s", path, e)
+            return None
+        logger.info("Loaded %s from artifact cache in %.1f ms", os.path.basename(path),
+                    (time.time() - start_time) * 1000)
+        return artifact
+
+    @contextmanager
+    def _single_flight(self, path: str):
+        """
+        Only one builder per artifact: a lock per path between the threads of
+        this process, and a lock file between uvicorn workers. A lock file
+        older than BUILD_LOCK_TIMEOUT is considered abandoned (crashed worker).
+        """
+        with self._locks_guard:
+            lock = self._locks.setdefault(path, threading.Lock())
+        with lock:
+            lock_path = path + ".lock"
+            handle = None
+            while handle is None:
+                try:
+                    handle = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(lock_path) > BUILD_LOCK_TIMEOUT:
+                            logger.warning("Removing abandoned artifact lock %s", lock_path)
+                            os.remove(lock_path)
+                    except OSError:
+                        pass
+                    time.sleep(0.05)
+                except OSError as e:
+                    # Cache en lecture seule : pas de verrou entre processus
+                    logger.warning("Cannot lock %s: %s", lock_path, e)
+                    break
+            try:
+                yield
+            finally:
+                if handle is not None:
+                    os.close(handle)
+                    try:
+                        os.remove(lock_path)
+                    except OSError:
+                        pass
+
+    def _load(self, template_path: str, filename: str, build: Callable[[], Any],
+              dump: Callable[[Any], Tuple[Dict, Dict]], restore: Callable[[Dict, Dict], Any]):
+        start_time = time.time()
+        directory = self.directory(template_path)
+        path = os.path.join(directory, filename)
+        artifact = self._read(path, restore, start_time)
+        if artifact is not None:
+            return artifact
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            logger.warning("Cannot create artifact cache %s: %s", directory, e)
+        with self._single_flight(path):
+            # Un autre thread ou worker a pu le construire pendant l'attente
+            artifact = self._read(path, restore, start_time)
+            if artifact is not None:
+                return artifact
+            artifact = build()
+            try:
+                self._forget_previous_versions(template_path, os.path.basename(directory))
+                write_sections(path, *dump(artifact))
+                logger.info("Stored %s in artifact cache %s", filename, directory)
+            except OSError as e:
+                logger.warning("Cannot write artifact cache %s: %s", directory, e)
+        return artifact
+
+    def _forget_previous_versions(self, template_path: str, current_hash: str) -> None:
+        """
+        Remove the artifacts of older versions of the same template file. The
+        manifest is shared by every template: it is read and rewritten under
+        its own lock, and replaced atomically so readers never see it half written.
+        """
+        manifest_path = os.path.join(self.root, "templates.json")
+        with self._single_flight(manifest_path):
+            try:
+                with open(manifest_path, encoding="utf-8") as stream:
+                    manifest = json.load(stream)
+            except (OSError, ValueError):
+                manifest = {}
+            template = os.path.abspath(template_path)
+            previous_hash = manifest.get(template)
+            if previous_hash and previous_hash != current_hash and previous_hash not in (
+                    value for key, value in manifest.items() if key != template):
+                logger.info("Template %s changed, removing stale artifacts %s", template_path, previous_hash)
+                shutil.rmtree(os.path.join(self.root, previous_hash), ignore_errors=True)
+            manifest[template] = current_hash
+            handle, temp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            try:
+                with os.fdopen(handle, "w", encoding="utf-8") as stream:
+                    json.dump(manifest, stream, indent=2)
+                os.replace(temp_path, manifest_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+    def workbook_model(self, template_path: str) -> WorkbookModel:
+        return self._load(template_path, "model.bin", lambda: load_workbook_model(template_path),
+                          lambda model: model_to_sections(model, model._code), model_from_sections)
+
+    def commune_index(self, template_path: str, sheet_name: str) -> CommuneIndex:
+        return self._load(template_path, f"communes_{_slug(sheet_name)}.bin",
+                          lambda: load_commune_index(template_path, sheet_name),
+                          lambda index: ({"sheet": sheet_name}, commune_index_to_sections(index)),
+                          lambda meta, sections: commune_index_from_sections(sections))
@@ -0,0 +1,519 @@
+"""
+Backends de calcul interchangeables.
+
+Un backend reçoit les valeurs d'entrée de la feuille de calcul
+(``{(feuille, cellule): valeur}``, cf. ``cell_mapping.build_inputs``) et renvoie les
+résultats du "3. Template" indexés comme ``Template.output_cells``
+(brut_mensuel, net_mensuel...). Trois implémentations :
+
+- ``NativeBackend`` : moteur de formules Python, sans Excel ;
+- ``ExcelBackend`` : classeur ouvert avec xlwings (copie du template, macros) ;
+- ``FakeBackend`` : formules simples et déterministes, pour les tests.
+
+``PooledBackend`` enveloppe n'importe lequel de ces backends avec un pool
+d'instances préchauffées (``instance_pool.InstancePool``) : pour Excel, les
+classeurs restent ouverts et seules les cellules d'entrée sont restaurées
+entre deux requêtes, au lieu de copier/ouvrir/quitter à chaque fois.
+"""
+import contextvars
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Protocol, Tuple
+
+from cell_mapping import (DAYS_CELL, DEBUG_CELLS, DEBUG_CELLS_ENABLED, FALLBACK_CELLS, GOAL_SEEK_ANNUAL,
+                          GOAL_SEEK_CHANGING, GOAL_SEEK_TARGET, TJM_CELL, CellBlock, cell_blocks, output_cells,
+                          read_cells, write_blocks)
+from instance_pool import InstancePool
+from metrics import count, span
+from solver import goal_seek
+from templates import CALCULATION_SHEET, GOAL_SEEK_CELLS, INPUT_CELLS, TEMPLATE_SHEET, Template
+
+logger = logging.getLogger(__name__)
+
+Inputs = Dict[Tuple[str, str], Any]
+Outputs = Dict[str, Any]
+
+
+class BackendUnavailable(Exception):
+    """The backend cannot run on this host (e.g. xlwings not installed)."""
+
+
+class BackendError(Exception):
+    """A calculation failed inside the backend."""
+
+
+class BackendSession(Protocol):
+    """One reusable calculation instance (e.g. an open workbook)."""
+
+    def evaluate(self, inputs: Inputs) -> Outputs: ...
+
+    def reset(self) -> None: ...
+
+    def healthy(self) -> bool: ...
+
+    def close(self) -> None: ...
+
+
+class CalculationBackend(Protocol):
+    name: str
+
+    def evaluate(self, template: Template, inputs: Inputs) -> Outputs: ...
+
+    def open_session(self, template: Template) -> BackendSession: ...
+
+
+class StatelessSession:
+    """Session of a backend without per-instance state (native, fake)."""
+
+    def __init__(self, backend: CalculationBackend, template: Template):
+        self.backend, self.template = backend, template
+
+    def evaluate(self, inputs: Inputs) -> Outputs:
+        return self.backend.evaluate(self.template, inputs)
+
+    def reset(self) -> None:
+        pass
+
+    def healthy(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+# -- moteur natif ------------------------------------------------------------
+
+class NativeBackend:
+    """Formula engine: the TJM macro becomes a goal seek of B12 on J4 by varying B4."""
+
+    name = "native"
+
+    def evaluate(self, template: Template, inputs: Inputs) -> Outputs:
+        model = template.model
+        with span("calculate"):
+            template_cells = [(TEMPLATE_SHEET, cell) for cell in template.output_cells.values()]
+            scenario = model.scenario(inputs, [GOAL_SEEK_TARGET] + template_cells)
+        with span("goal_seek"):
+            seek = goal_seek(scenario, model.cell_id(*GOAL_SEEK_TARGET), inputs[TJM_CELL], model.cell_id(*GOAL_SEEK_CHANGING))
+        logger.debug("TJM goal seek: %d iterations, residual %.2e, %.2f ms, %d cells recomputed",
+                     seek.iterations, seek.residual, seek.elapsed_seconds * 1000, scenario.recomputed)
+        count("cells_recomputed", scenario.recomputed)
+        with span("result_read"):
+            values = {output: scenario.get(model.cell_id(TEMPLATE_SHEET, cell))
+                      for output, cell in template.output_cells.items()}
+        logger.debug("Native engine values (%s): %s", template.name, values)
+        return values
+
+    def open_session(self, template: Template) -> BackendSession:
+        return StatelessSession(self, template)
+
+
+# -- Excel (xlwings) ---------------------------------------------------------
+
+def _com_initialize() -> None:
+    """Initialise COM in the current thread (Windows; nothing to do where pythoncom is absent)."""
+    try:
+        import pythoncom
+    except ImportError:
+        return
+    pythoncom.CoInitialize()
+
+
+def _com_uninitialize() -> None:
+    try:
+        import pythoncom
+    except ImportError:
+        return
+    pythoncom.CoUninitialize()
+
+
+class ExcelSession:
+    """
+    A private copy of the template opened in its own Excel instance.
+
+    COM objects may only be used from the thread that created them: each
+    session owns a thread (COM initialised there) that runs every Excel call,
+    whichever worker thread leases the session.
+    """
+
+    def __init__(self, template: Template):
+        # Import xlwings here to avoid startup errors if Excel is not available
+        try:
+            import xlwings as xw
+        except ImportError:
+            raise BackendUnavailable("xlwings module not installed. Please install it with: pip install xlwings")
+
+        self.template = template
+        self.app = self.workbook = None
+        self._thread: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="excel-session", initializer=_com_initialize)
+        try:
+            self._call(self._open, xw)
+        except BaseException:
+            self._stop_thread()
+            raise
+
+    def _call(self, function: Callable, *args) -> Any:
+        """Run ``function`` on the session thread, in the caller's context (trace, request id)."""
+        if self._thread is None:
+            raise BackendError("Excel session is closed")
+        return self._thread.submit(contextvars.copy_context().run, function, *args).result()
+
+    def _stop_thread(self) -> None:
+        if self._thread is not None:
+            self._thread.submit(_com_uninitialize)
+            self._thread.shutdown(wait=True)
+            self._thread = None
+
+    def _open(self, xw) -> None:
+        # Create a temporary copy of the template
+        with span("template_copy"):
+            self.temp_dir = tempfile.mkdtemp()
+            self.path = os.path.join(self.temp_dir, "temp_calculation.xlsm")
+            shutil.copy2(self.template.path, self.path)
+        logger.debug("Copied template to %s", self.path)
+
+        try:
+            # Open the Excel file with xlwings - with events enabled
+            with span("excel_start"):
+                self.app = xw.App(visible=False, enable_events=True)
+                self.app.display_alerts = False
+                self.app.screen_updating = False
+
+            logger.debug("Attempting to open Excel file: %s", self.path)
+            with span("workbook_open"):
+                self.workbook = self.app.books.open(self.path)
+            logger.debug("Excel file opened successfully")
+
+            sheet_names = [sheet.name for sheet in self.workbook.sheets]
+            logger.debug("Excel sheets: %s", sheet_names)
+            self.calculation_sheet = self.workbook.sheets[self._calculation_sheet_name(sheet_names)]
+            self.template_sheet = self.workbook.sheets[self._template_sheet_name(sheet_names)]
+
+            # État initial (formules comprises) des cellules écrites par une simulation
+            self._initial = {}
+            for block in cell_blocks((CALCULATION_SHEET, cell) for cell in INPUT_CELLS + GOAL_SEEK_CELLS):
+                formulas = self.calculation_sheet.range(block.address).options(ndim=2).formula
+                self._initial.update(((block.sheet, cell), row[0]) for cell, row in zip(block.cells, formulas))
+        except Exception:
+            self._close()
+            raise
+
+    @staticmethod
+    def _calculation_sheet_name(sheet_names) -> str:
+        # Look for the calculation sheet - try multiple possible names
+        if CALCULATION_SHEET in sheet_names:
+            return CALCULATION_SHEET
+        for sheet_name in sheet_names:
+            if "calcul" in sheet_name.lower():
+                logger.info("Using alternative calculation sheet: %s", sheet_name)
+                return sheet_name
+        return CALCULATION_SHEET
+
+    def _template_sheet_name(self, sheet_names) -> str:
+        # Look for template sheet for results
+        if TEMPLATE_SHEET in sheet_names:
+            return TEMPLATE_SHEET
+        for possible_name in ["Template", "Résultats", "Results"]:
+            if possible_name in sheet_names:
+                logger.info("Using alternative template sheet: %s", possible_name)
+                return possible_name
+        logger.warning("Using calculation sheet as template: %s", self.calculation_sheet.name)
+        return self.calculation_sheet.name
+
+    def _sheet(self, name: str):
+        if name == CALCULATION_SHEET:
+            return self.calculation_sheet
+        if name == TEMPLATE_SHEET:
+            return self.template_sheet
+        return self.workbook.sheets[name]
+
+    def _write(self, values: Inputs, attribute: str = "value") -> None:
+        """Write ``values`` with one COM call per contiguous block of cells."""
+        for block, block_values in write_blocks(values):
+            setattr(self._sheet(block.sheet).range(block.address), attribute, [[value] for value in block_values])
+
+    def _read_block(self, block: CellBlock) -> List[Any]:
+        rows = self._sheet(block.sheet).range(block.address).options(ndim=2).value
+        return [row[0] for row in rows]
+
+    def _read(self, cells) -> Dict[Tuple[str, str], Any]:
+        return read_cells(cells, self._read_block)
+
+    def _calculate(self) -> None:
+        with span("calculate"):
+            self.app.calculate()
+
+    def _run_macro(self, macro_name: str) -> None:
+        with span(f"macro_{macro_name}"):
+            self.workbook.macro(macro_name)()
+        logger.debug("Successfully ran %s macro", macro_name)
+
+    def evaluate(self, inputs: Inputs) -> Outputs:
+        return self._call(self._evaluate, inputs)
+
+    def reset(self) -> None:
+        self._call(self._reset)
+
+    def healthy(self) -> bool:
+        try:
+            return self._call(self._healthy)
+        except Exception:
+            return False
+
+    def close(self) -> None:
+        try:
+            if self._thread is not None:
+                self._call(self._close)
+        finally:
+            self._stop_thread()
+
+    def _evaluate(self, inputs: Inputs) -> Outputs:
+        with span("input_write"):
+            # Initialiser la cellule B4 avec une valeur appropriée pour que GoalSeek fonctionne
+            self._write({GOAL_SEEK_CHANGING: "BRUT", **inputs})
+            logger.debug("Set %d input cells", len(inputs))
+
+        # Force calculation
+        logger.debug("Forcing Excel calculation...")
+        self._calculate()
+
+        tjm = inputs[TJM_CELL]
+        jours_travailles = inputs[DAYS_CELL]
+        try:
+            logger.debug("Attempting to run macro...")
+
+            # Implement TJM macro functionality directly to avoid errors
+            self._write({
+                GOAL_SEEK_TARGET: tjm,  # Valeur journalière = TJM
+                GOAL_SEEK_ANNUAL: tjm * jours_travailles,  # Brut annuel = TJM * jours
+            })
+
+            # Then try to run the actual macro - with error handling
+            try:
+                self._run_macro("TJM")
+            except Exception as e:
+                logger.warning("Error running TJM macro, but values were set directly: %s", e)
+
+            # Force calculation again to make sure all formulas are updated
+            self._calculate()
+
+            # Try to run the UpdateTemplate macro if it exists, then other common macro names
+            for macro_name in ["UpdateTemplate", "MAJ", "Calculate"]:
+                try:
+                    self._run_macro(macro_name)
+                    break
+                except Exception as e:
+                    logger.warning("Error running %s macro: %s", macro_name, e)
+
+            # Force calculation again
+            self._calculate()
+        except Exception as e:
+            logger.warning("Error in macro execution section: %s", e)
+
+        with span("result_read"):
+            cells = output_cells(self.template.output_cells)
+            wanted = set(cells.values())
+            if DEBUG_CELLS_ENABLED:
+                wanted.update(DEBUG_CELLS)
+            read = self._read(wanted)
+            if DEBUG_CELLS_ENABLED:
+                logger.info("Debug cell values: %s", {f"{sheet}!{cell}": read[(sheet, cell)] for sheet, cell in DEBUG_CELLS})
+
+            values = {output: read[cell] for output, cell in cells.items()}
+            # If template values not available, try calculation sheet
+            missing = [output for output in FALLBACK_CELLS if values[output] is None]
+            if missing:
+                read.update(self._read(FALLBACK_CELLS[output] for output in missing if FALLBACK_CELLS[output] not in read))
+                for output in missing:
+                    values[output] = read[FALLBACK_CELLS[output]]
+                    logger.info("Using %s from calculation for %s: %s", FALLBACK_CELLS[output][1], output, values[output])
+        return values
+
+    def _reset(self) -> None:
+        """Restore the input cells (values and formulas) captured when the workbook was opened."""
+        with span("reset"):
+            self._write(self._initial, "formula")
+            self.app.calculate()
+
+    def _healthy(self) -> bool:
+        try:
+            return self.workbook is not None and self.workbook.name in [book.name for book in self.app.books]
+        except Exception:
+            return False
+
+    def _close(self) -> None:
+        # Ensure proper cleanup
+        with span("cleanup"):
+            try:
+                logger.debug("Cleaning up Excel resources...")
+                if self.workbook is not None:
+                    self.workbook.save()
+                    self.workbook.close()
+                if self.app is not None:
+                    self.app.quit()
+                shutil.rmtree(self.temp_dir)
+                logger.debug("Excel cleanup completed")
+            except Exception as e:
+                logger.error("Error during Excel cleanup: %s", e)
+
+
+class ExcelBackend:
+    """xlwings backend; without a pool every call copies, opens and closes its own workbook."""
+
+    name = "excel"
+
+    def evaluate(self, template: Template, inputs: Inputs) -> Outputs:
+        logger.debug("Starting Excel processing with TJM=%s, jours=%s", inputs.get(TJM_CELL), inputs.get(DAYS_CELL))
+        session = self.open_session(template)
+        try:
+            return session.evaluate(inputs)
+        finally:
+            session.close()
+
+    def open_session(self, template: Template) -> BackendSession:
+        return ExcelSession(template)
+
+
+# -- faux backend ------------------------------------------------------------
+
+class FakeSession(StatelessSession):
+    """Fake instance that tracks its uses, resets and closing (pool tests)."""
+
+    def __init__(self, backend: "FakeBackend", template: Template):
+        super().__init__(backend, template)
+        self.uses = 0
+        self.dirty = False
+        self.closed = False
+
+    def evaluate(self, inputs: Inputs) -> Outputs:
+        if self.dirty:
+            raise BackendError("fake session used without reset")
+        self.uses += 1
+        self.dirty = True
+        return self.backend.evaluate(self.template, inputs)
+
+    def reset(self) -> None:
+        self.dirty = False
+
+    def healthy(self) -> bool:
+        unhealthy_after = self.backend.unhealthy_after
+        return not self.closed and (unhealthy_after is None or self.uses < unhealthy_after)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeBackend:
+    """
+    Deterministic stand-in: closed-form approximations of the template, with
+    an optional delay, failure predicate and health limit to exercise callers.
+    """
+
+    name = "fake"
+
+    def __init__(self, delay: float = 0.0, fail_on: Optional[Callable[[Inputs], bool]] = None,
+                 unhealthy_after: Optional[int] = None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.unhealthy_after = unhealthy_after
+        self.calls = 0
+        self.sessions_opened = 0
+        self._lock = threading.Lock()
+
+    def evaluate(self, template: Template, inputs: Inputs) -> Outputs:
+        with self._lock:
+            self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail_on is not None and self.fail_on(inputs):
+            raise BackendError("fake backend failure")
+        value = lambda cell, default=0.0: inputs.get((CALCULATION_SHEET, cell), default)
+        chiffre_affaires = value("J4") * value("J5")
+        frais_gestion = chiffre_affaires * value("J7")
+        brut_mensuel = (chiffre_affaires - frais_gestion - value("J12")) / 1.45
+        return {
+            "brut_mensuel": brut_mensuel,
+            "net_mensuel": brut_mensuel * 0.78 + value("J21") * 0.5,
+            "frais_gestion": frais_gestion,
+            "provision_negocier": brut_mensuel * value("J11"),
+            "mutuelle": 30.4 if value("J17", "Non") == "Oui" else 0,
+            "ticket_restaurant": value("J21") * 0.5,
+        }
+
+    def open_session(self, template: Template) -> BackendSession:
+        with self._lock:
+            self.sessions_opened += 1
+        return FakeSession(self, template)
+
+
+BACKENDS = {"native": NativeBackend, "excel": ExcelBackend, "fake": FakeBackend}
+
+
+def create_backend(name: str) -> CalculationBackend:
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown calculation backend '{name}' (expected one of {', '.join(BACKENDS)})")
+
+
+# -- pool d'instances --------------------------------------------------------
+
+class PooledBackend:
+    """
+    Backend serving each template from a pool of warm sessions of ``backend``.
+    A reloaded template (new hash) gets a new pool; the old one is closed.
+    """
+
+    def __init__(self, backend: CalculationBackend, size: int = 2, max_uses: int = 200,
+                 acquire_timeout: float = 30.0, lease_timeout: float = 120.0):
+        self.backend = backend
+        self.name = backend.name
+        self.size = size
+        self.max_uses = max_uses
+        self.acquire_timeout = acquire_timeout
+        self.lease_timeout = lease_timeout
+        self._pools: Dict[str, Tuple[str, InstancePool]] = {}
+        self._lock = threading.Lock()
+
+    def pool(self, template: Template) -> InstancePool:
+        with self._lock:
+            current = self._pools.get(template.name)
+            if current is not None and current[0] == template.template_hash:
+                return current[1]
+            pool = InstancePool(lambda: self.backend.open_session(template), size=self.size,
+                                max_uses=self.max_uses, acquire_timeout=self.acquire_timeout,
+                                lease_timeout=self.lease_timeout, name=f"{self.name}:{template.name}")
+            self._pools[template.name] = (template.template_hash, pool)
+        if current is not None:
+            logger.info("Template %s changed, closing its previous instance pool", template.name)
+            current[1].close()
+        return pool
+
+    def warm(self, template: Template) -> None:
+        start_time = time.time()
+        pool = self.pool(template)
+        pool.warm()
+        logger.info("%s %s instances ready for %s in %.2f seconds", pool.size, self.name, template.name,
+                    time.time() - start_time)
+
+    def evaluate(self, template: Template, inputs: Inputs) -> Outputs:
+        with self.pool(template).lease() as session:
+            return session.evaluate(inputs)
+
+    def open_session(self, template: Template) -> BackendSession:
+        return self.backend.open_session(template)
+
+    def close(self) -> None:
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for _, pool in pools:
+            pool.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: pool.stats() for name, (_, pool) in self._pools.items()}
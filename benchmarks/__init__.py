@@ -0,0 +1,17 @@
+"""
+Benchmarks reproductibles du chemin de conversion.
+
+- ``micro`` : recherche d'un code commune, normalisation des paramètres,
+  évaluation d'un scénario avec le moteur natif ;
+- ``load`` : débit et latence de l'application FastAPI en mémoire (ASGI,
+  sans serveur ni réseau) à plusieurs niveaux de concurrence, pour /convert,
+  /convert/batch et le chemin de repli.
+
+Tout tourne sous Linux sans Excel (backend natif forcé). Les résultats sont
+écrits en JSON et comparés à une référence (``baseline.json``) avec des
+seuils de régression configurables ::
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --quick --threshold 0.3
+    python -m benchmarks --save-baseline
+"""
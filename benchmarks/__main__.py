@@ -0,0 +1,121 @@
+"""
+Point d'entrée ``python -m benchmarks`` (depuis la racine du projet).
+
+Code de sortie 1 si une mesure régresse au-delà de son seuil par rapport à
+la référence.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", choices=["all", "micro", "load"], default="all")
+    parser.add_argument("--scenario", action="append", help="load scenario to run (repeatable): "
+                        "convert, convert_cached, batch, fallback")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations (smoke run, noisier)")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="reference results to compare against")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="allowed relative regression (default: baseline 'thresholds', else 0.25)")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--verbose", action="store_true", help="keep the application logs (off by default: "
+                        "the fallback scenario logs an error per request)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    # Graine de hachage fixe : les temps des dictionnaires (index des communes)
+    # varient sinon d'un processus à l'autre
+    if os.environ.get("PYTHONHASHSEED") is None:
+        os.environ["PYTHONHASHSEED"] = "0"
+        os.execv(sys.executable, [sys.executable, "-m", "benchmarks"] + (sys.argv[1:] if argv is None else list(argv)))
+
+    # Backend natif, pas de surveillance des templates ; pool en threads pour
+    # que le scénario "fallback" puisse remplacer le moteur dans le processus
+    os.environ["PORTALIA_BACKEND"] = "native"
+    os.environ["PORTALIA_POOL_KIND"] = "thread"
+    os.environ.setdefault("PORTALIA_TEMPLATE_POLL_SECONDS", "0")
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import main as app_module
+    from benchmarks.compare import DEFAULT_THRESHOLD, compare, format_report
+    from benchmarks.load import run_load
+    from benchmarks.micro import run_micro
+    from formula_engine import ENGINE_VERSION
+
+    if not args.verbose:
+        logging.disable(logging.ERROR)
+
+    start_time = time.time()
+    selected = app_module.get_template()
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    results = {}
+    if args.suite in ("all", "micro"):
+        results.update(run_micro(app_module, quick=args.quick))
+    if args.suite in ("all", "load"):
+        results.update(run_load(app_module, levels, quick=args.quick, only=args.scenario))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "template": selected.name,
+            "template_hash": selected.template_hash,
+            "engine_version": ENGINE_VERSION,
+            "quick": args.quick,
+            "duration_seconds": time.time() - start_time,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.save_baseline:
+        # Les seuils personnalisés de l'ancienne référence sont conservés
+        report["thresholds"] = (baseline or {}).get("thresholds", {})
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+
+    thresholds = baseline.get("thresholds", {})
+    threshold = args.threshold if args.threshold is not None else thresholds.get("default", DEFAULT_THRESHOLD)
+    overrides = {pattern: value for pattern, value in thresholds.items() if pattern != "default"}
+    rows = compare(results, baseline.get("results", {}), threshold, overrides)
+    print(format_report(rows))
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond threshold")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Comparaison des résultats à une référence, avec seuils de régression."""
+import fnmatch
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_THRESHOLD = 0.25
+
+
+def primary_metrics(entry: Dict) -> Dict[str, Tuple[float, bool]]:
+    """Compared metrics of one result: name -> (value, higher is better)."""
+    if entry.get("kind") == "micro":
+        # Meilleur tour : le moins sensible au bruit de la machine (cf. timeit)
+        return {"best": (entry["best"], False)}
+    return {
+        "p95": (entry["latency"]["p95"], False),
+        "throughput_rps": (entry["throughput_rps"], True),
+    }
+
+
+def threshold_for(name: str, default: float, overrides: Optional[Dict[str, float]] = None) -> float:
+    """Relative threshold for a benchmark; the most specific matching pattern wins."""
+    matches = [(len(pattern), value) for pattern, value in (overrides or {}).items() if fnmatch.fnmatchcase(name, pattern)]
+    return max(matches)[1] if matches else default
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float = DEFAULT_THRESHOLD,
+            overrides: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """
+    One row per (benchmark, metric) present in both runs. ``change`` is
+    relative and signed so that positive always means slower/worse.
+    """
+    rows = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        limit = threshold_for(name, threshold, overrides)
+        current, reference = primary_metrics(results[name]), primary_metrics(baseline[name])
+        for metric, (value, higher_is_better) in current.items():
+            reference_value = reference.get(metric, (None, None))[0]
+            if not reference_value:
+                continue
+            change = (value - reference_value) / reference_value
+            if higher_is_better:
+                change = -change
+            rows.append({
+                "benchmark": name,
+                "metric": metric,
+                "baseline": reference_value,
+                "current": value,
+                "change": change,
+                "threshold": limit,
+                "regression": change > limit,
+            })
+    return rows
+
+
+def format_report(rows: List[Dict]) -> str:
+    if not rows:
+        return "No benchmark in common with the baseline."
+    width = max(len(row["benchmark"]) for row in rows)
+    lines = [f"{'benchmark':<{width}}  {'metric':<14}  {'baseline':>12}  {'current':>12}  {'change':>8}"]
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(f"{row['benchmark']:<{width}}  {row['metric']:<14}  {row['baseline']:>12.6g}  "
+                     f"{row['current']:>12.6g}  {row['change']:>+7.1%}{flag}")
+    return "\n".join(lines)
@@ -0,0 +1,59 @@
+"""Mesure et résumé statistique des temps."""
+import gc
+import math
+import statistics
+import time
+from typing import Callable, Dict, List, Sequence
+
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    """Percentile ``q`` (0-100) by linear interpolation between order statistics."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * q / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    """Latency summary in seconds."""
+    return {
+        "count": len(samples),
+        "mean": statistics.fmean(samples) if samples else 0.0,
+        "min": min(samples, default=0.0),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "max": max(samples, default=0.0),
+    }
+
+
+def measure(function: Callable[[], object], number: int, repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    """
+    Time ``number`` calls of ``function``, ``repeat`` times (after ``warmup``
+    untimed rounds); per-call seconds of the best and median rounds. The GC is
+    paused during each round, as in ``timeit``.
+    """
+    for _ in range(warmup):
+        for _ in range(number):
+            function()
+    rounds: List[float] = []
+    for _ in range(repeat):
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(number):
+                function()
+            rounds.append((time.perf_counter() - start) / number)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+    return {
+        "number": number,
+        "repeat": repeat,
+        "best": min(rounds),
+        "median": statistics.median(rounds),
+        "stdev": statistics.stdev(rounds) if len(rounds) > 1 else 0.0,
+    }
@@ -0,0 +1,132 @@
+"""
+Débit et latence de l'application FastAPI en mémoire.
+
+Les requêtes passent par ``httpx.ASGITransport`` (comme ``TestClient``) :
+middlewares, validation, pool de calcul et sérialisation sont mesurés, sans
+serveur ni réseau. Le cache de résultats est désactivé sauf pour le scénario
+``convert_cached``.
+"""
+import asyncio
+import itertools
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from backends import FakeBackend
+from benchmarks.harness import summarize
+from benchmarks.micro import sample_parameters
+
+BATCH_SIZE = 100
+
+Request = Tuple[str, str, Optional[object]]
+
+
+def _query(row: Dict) -> str:
+    return "&".join(f"{name}={str(value).lower() if isinstance(value, bool) else value}"
+                    for name, value in row.items() if value is not None)
+
+
+async def _drive(app, make_request: Callable[[int], Request], total: int, concurrency: int):
+    """``concurrency`` clients share ``total`` requests; returns latencies, error count, elapsed."""
+    latencies: List[float] = []
+    errors = 0
+    counter = itertools.count()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        async def client_loop():
+            nonlocal errors
+            while True:
+                index = next(counter)
+                if index >= total:
+                    return
+                method, url, body = make_request(index)
+                start = time.perf_counter()
+                response = await client.request(method, url, json=body)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - start
+
+
+@contextmanager
+def _result_cache(main, enabled: bool):
+    max_entries = main.RESULT_CACHE.max_entries
+    main.RESULT_CACHE.clear()
+    if not enabled:
+        main.RESULT_CACHE.max_entries = 0
+    try:
+        yield
+    finally:
+        main.RESULT_CACHE.max_entries = max_entries
+        main.RESULT_CACHE.clear()
+
+
+@contextmanager
+def _failing_engine(main):
+    """Deterministic stand-in for a broken calculation: a fake backend that always fails, /convert falls back."""
+    backend = main.BACKEND
+    main.BACKEND = FakeBackend(fail_on=lambda inputs: True)
+    try:
+        yield
+    finally:
+        main.BACKEND = backend
+
+
+def scenarios(main) -> Dict[str, Tuple[Callable[[int], Request], Callable]]:
+    """Scenario name -> (request factory, context manager wrapping the run)."""
+    rows = sample_parameters(1024)
+
+    def convert(index: int) -> Request:
+        row = dict(rows[index % len(rows)])
+        # TJM décalé à chaque requête : aucune réponse ne peut venir d'un cache
+        row["tjm"] += (index // len(rows)) * 0.01
+        return "GET", "/convert?" + _query(row), None
+
+    def convert_cached(index: int) -> Request:
+        return "GET", "/convert?" + _query(rows[index % 16]), None
+
+    def batch(index: int) -> Request:
+        start = (index * BATCH_SIZE) % len(rows)
+        return "POST", "/convert/batch", (rows + rows)[start:start + BATCH_SIZE]
+
+    return {
+        "convert": (convert, lambda: _result_cache(main, False)),
+        "convert_cached": (convert_cached, lambda: _result_cache(main, True)),
+        "batch": (batch, lambda: _result_cache(main, False)),
+        "fallback": (convert, lambda: _failing_engine(main)),
+    }
+
+
+def run_load(main, levels: Iterable[int] = (1, 4, 16), quick: bool = False,
+             only: Optional[Iterable[str]] = None) -> Dict[str, Dict]:
+    """Run every scenario at every concurrency level; results keyed ``load.<scenario>.c<level>``."""
+    results = {}
+    requests_per_level = {"convert": 200, "convert_cached": 400, "batch": 20, "fallback": 400}
+    for name, (make_request, context) in scenarios(main).items():
+        if only and name not in only:
+            continue
+        for level in levels:
+            total = max(level * 2, requests_per_level[name] // (10 if quick else 1))
+            with context():
+                # Premier passage non mesuré (pool démarré, chemins de code chauds)
+                asyncio.run(_drive(main.app, make_request, min(total, 2 * level), level))
+                latencies, errors, elapsed = asyncio.run(_drive(main.app, make_request, total, level))
+            entry = {
+                "kind": "load",
+                "scenario": name,
+                "concurrency": level,
+                "requests": total,
+                "errors": errors,
+                "elapsed_seconds": elapsed,
+                "throughput_rps": total / elapsed,
+                "latency": summarize(latencies),
+            }
+            if name == "batch":
+                entry["rows_per_second"] = total * BATCH_SIZE / elapsed
+            results[f"load.{name}.c{level}"] = entry
+    return results
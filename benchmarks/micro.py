@@ -0,0 +1,68 @@
+"""Micro-benchmarks : recherche commune, normalisation des paramètres, scénario unique."""
+import itertools
+import random
+from typing import Dict, List
+
+from benchmarks.harness import measure
+
+SEED = 20250101
+
+
+def sample_parameters(count: int, seed: int = SEED) -> List[Dict]:
+    """Deterministic /convert parameter sets (same draw on every run)."""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        contract_type = rng.choice(["CDI", "CDD"])
+        rows.append({
+            "tjm": float(rng.randrange(300, 1200, 5)),
+            "jours_travailles": rng.randrange(10, 23),
+            "contract_type": contract_type,
+            "frais_fonctionnement": rng.choice([None, 0.0, 150.0]),
+            "frais_gestion": float(rng.choice([5, 8, 10])),
+            "provision_negocier": float(rng.choice([0, 2, 5])) if contract_type == "CDI" else None,
+            "ticket_restaurant": rng.random() < 0.5,
+            "mutuelle": rng.random() < 0.5,
+            "code_commune": rng.choice(["92024", "75101", "69381", "2A004", "13201", "33063", None]),
+        })
+    return rows
+
+
+def run_micro(main, quick: bool = False) -> Dict[str, Dict]:
+    """Run the micro-benchmarks against the ``main`` module (native backend)."""
+    selected = main.get_template()
+    scale = 0.1 if quick else 1.0
+    results = {}
+
+    rng = random.Random(SEED)
+    # Codes existants sous différentes formes, plus des codes inconnus
+    codes = rng.sample(list(selected.communes.codes), 500)
+    codes += [code.zfill(5) for code in codes[:100]] + [f"{code}.0" for code in codes[100:150]] + ["99999", "00000"]
+    rng.shuffle(codes)
+    next_code = itertools.cycle(codes).__next__
+    results["micro.commune_lookup"] = measure(
+        lambda: main.is_commune_code_valid(next_code(), selected), number=max(1000, int(20000 * scale)))
+
+    parameters = sample_parameters(256)
+    next_parameters = itertools.cycle(parameters).__next__
+
+    def normalise():
+        row = next_parameters()
+        main.convert_cache_key(selected.template_hash, row["tjm"], row["jours_travailles"], row["contract_type"],
+                               row["frais_fonctionnement"], row["frais_gestion"], row["provision_negocier"],
+                               row["ticket_restaurant"], row["mutuelle"], row["code_commune"])
+        main.build_native_inputs(row["tjm"], row["jours_travailles"], row["contract_type"], row["frais_fonctionnement"],
+                                 row["frais_gestion"], row["provision_negocier"], row["ticket_restaurant"],
+                                 row["mutuelle"], row["code_commune"])
+    results["micro.parameter_normalisation"] = measure(normalise, number=max(500, int(10000 * scale)))
+
+    # Chaque tour évalue exactement les mêmes scénarios (le goal seek varie selon les paramètres)
+    scenarios = parameters[:16]
+    next_scenario = itertools.cycle(scenarios).__next__
+    results["micro.scenario_evaluation"] = measure(
+        lambda: main.convert_native(selected=selected, **next_scenario()),
+        number=len(scenarios) * (1 if quick else 4), repeat=3 if quick else 5)
+
+    for entry in results.values():
+        entry.update(kind="micro", unit="seconds_per_call")
+    return results
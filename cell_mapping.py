@@ -0,0 +1,221 @@
+"""
+Correspondance déclarative entre les paramètres d'une simulation et les
+cellules du classeur.
+
+``INPUT_FIELDS`` décrit chaque cellule d'entrée de "1. Calcul Avec prov" et
+la façon d'obtenir sa valeur à partir des paramètres de ``/convert``
+(pourcentage divisé par 100, booléen en "Oui"/"Non", taux selon le type de
+contrat...). Les cellules de résultat restent repérées par template
+(``Template.output_cells``), avec les replis de ``FALLBACK_CELLS``.
+
+``cell_blocks`` regroupe des cellules en plages contiguës d'une même colonne :
+un backend à appels coûteux (Excel/COM) écrit et lit alors chaque plage en
+une seule opération au lieu d'une cellule à la fois.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from communes import normalize_code
+from templates import CALCULATION_SHEET, TEMPLATE_SHEET
+
+Cell = Tuple[str, str]
+Parameters = Dict[str, Any]
+
+_ADDRESS_RE = re.compile(r"^([A-Z]+)(\d+)$")
+
+# Lecture groupée : deux cellules d'une même colonne séparées par au plus
+# MAX_READ_GAP lignes sont lues dans la même plage
+MAX_READ_GAP = int(os.environ.get("PORTALIA_MAX_READ_GAP", "32"))
+
+# Lecture et journalisation des cellules de contrôle (coûteuse avec Excel)
+DEBUG_CELLS_ENABLED = os.environ.get("PORTALIA_DEBUG_CELLS", "0").lower() in ('true', 't', 'yes', 'y', '1')
+
+
+def normalize_commune_code(code_commune: str):
+    """
+    Convertit le code commune saisi en valeur de cellule J25 : les codes INSEE
+    numériques sont stockés comme des nombres dans la feuille tauxTransport,
+    les codes corses (2A/2B) comme du texte.
+    """
+    normalized_code = normalize_code(code_commune)
+    try:
+        return float(normalized_code)
+    except ValueError:
+        return normalized_code
+
+
+# -- règles de valeur -------------------------------------------------------
+# Chaque règle reçoit les paramètres et renvoie la valeur de la cellule, ou
+# None si la cellule ne doit pas être écrite (valeur du template conservée).
+
+def parameter(name: str, transform: Optional[Callable[[Any], Any]] = None) -> Callable[[Parameters], Any]:
+    """Value of parameter ``name`` (optionally transformed); unset or empty parameters are skipped."""
+    def rule(parameters: Parameters) -> Any:
+        value = parameters.get(name)
+        if value is None or value == "":
+            return None
+        return transform(value) if transform is not None else value
+    return rule
+
+
+def percent(name: str) -> Callable[[Parameters], Any]:
+    """Percentage parameter written as a ratio (8 -> 0.08)."""
+    return parameter(name, lambda value: value / 100)
+
+
+def oui_non(name: str) -> Callable[[Parameters], Any]:
+    """Boolean parameter written as "Oui"/"Non" (always written)."""
+    return lambda parameters: "Oui" if parameters.get(name) else "Non"
+
+
+def by_contract(**values: Any) -> Callable[[Parameters], Any]:
+    """Constant depending on ``contract_type`` (CDI=..., CDD=...); other types are skipped."""
+    return lambda parameters: values.get(parameters.get("contract_type"))
+
+
+def for_contract(contract_type: str, rule: Callable[[Parameters], Any]) -> Callable[[Parameters], Any]:
+    """``rule`` applied only for one contract type."""
+    return lambda parameters: rule(parameters) if parameters.get("contract_type") == contract_type else None
+
+
+def ticket_restaurant_days(parameters: Parameters) -> Any:
+    # 11 tickets par jour travaillé déclarés dans le template, 0 sans tickets
+    return parameters["jours_travailles"] * 11 if parameters.get("ticket_restaurant") else 0
+
+
+@dataclass(frozen=True)
+class InputField:
+    cell: str
+    value: Callable[[Parameters], Any]
+    sheet: str = CALCULATION_SHEET
+    description: str = ""
+
+
+INPUT_FIELDS = (
+    InputField("J4", parameter("tjm"), description="TJM"),
+    InputField("J5", parameter("jours_travailles"), description="jours travaillés"),
+    InputField("J7", percent("frais_gestion"), description="frais de gestion (%)"),
+    InputField("J8", by_contract(CDI=0.02, CDD=0), description="taux selon le contrat"),
+    InputField("J9", by_contract(CDI=0.1, CDD=0), description="taux selon le contrat"),
+    InputField("J10", by_contract(CDI=0, CDD=0.1), description="prime de précarité (CDD)"),
+    InputField("J11", for_contract("CDI", percent("provision_negocier")), description="provision à négocier (%)"),
+    InputField("J12", parameter("frais_fonctionnement"), description="frais de fonctionnement"),
+    InputField("J17", oui_non("mutuelle"), description="mutuelle"),
+    InputField("J21", ticket_restaurant_days, description="tickets restaurant"),
+    InputField("J25", parameter("code_commune", normalize_commune_code), description="code commune"),
+)
+
+# Cellules de la macro TJM (GoalSeek de B12 sur J4 en faisant varier B4)
+GOAL_SEEK_TARGET = (CALCULATION_SHEET, "B12")
+GOAL_SEEK_CHANGING = (CALCULATION_SHEET, "B4")
+GOAL_SEEK_ANNUAL = (CALCULATION_SHEET, "B10")
+TJM_CELL = (CALCULATION_SHEET, "J4")
+DAYS_CELL = (CALCULATION_SHEET, "J5")
+
+# Résultats lus dans la feuille de calcul quand le "3. Template" ne renvoie rien
+FALLBACK_CELLS = {
+    "brut_mensuel": (CALCULATION_SHEET, "B5"),
+    "net_mensuel": (CALCULATION_SHEET, "B9"),
+}
+
+# Cellules de contrôle journalisées quand PORTALIA_DEBUG_CELLS est actif
+DEBUG_CELLS = (
+    (TEMPLATE_SHEET, "E23"),
+    (TEMPLATE_SHEET, "E26"),
+    (TEMPLATE_SHEET, "E31"),
+    (TEMPLATE_SHEET, "E8"),
+    (CALCULATION_SHEET, "B5"),
+    (CALCULATION_SHEET, "B9"),
+    (CALCULATION_SHEET, "E26"),
+)
+
+
+def build_inputs(parameters: Parameters) -> Dict[Cell, Any]:
+    """Cells written for a simulation, ``{(sheet, cell): value}``, in ``INPUT_FIELDS`` order."""
+    inputs = {}
+    for field in INPUT_FIELDS:
+        value = field.value(parameters)
+        if value is not None:
+            inputs[(field.sheet, field.cell)] = value
+    return inputs
+
+
+def output_cells(template_cells: Dict[str, str]) -> Dict[str, Cell]:
+    """``Template.output_cells`` as ``{output: (sheet, cell)}``."""
+    return {output: (TEMPLATE_SHEET, cell) for output, cell in template_cells.items()}
+
+
+# -- plages contiguës --------------------------------------------------------
+
+def split_address(address: str) -> Tuple[str, int]:
+    match = _ADDRESS_RE.match(address.replace("$", "").upper())
+    if match is None:
+        raise ValueError(f"Not a cell address: {address}")
+    return match.group(1), int(match.group(2))
+
+
+@dataclass(frozen=True)
+class CellBlock:
+    """Rows ``first_row`` to ``last_row`` of one column of one sheet."""
+    sheet: str
+    column: str
+    first_row: int
+    last_row: int
+
+    @property
+    def address(self) -> str:
+        first = f"{self.column}{self.first_row}"
+        return first if self.first_row == self.last_row else f"{first}:{self.column}{self.last_row}"
+
+    @property
+    def cells(self) -> List[str]:
+        return [f"{self.column}{row}" for row in range(self.first_row, self.last_row + 1)]
+
+    def __len__(self) -> int:
+        return self.last_row - self.first_row + 1
+
+
+def cell_blocks(cells: Iterable[Cell], max_gap: int = 0) -> List[CellBlock]:
+    """
+    Group cells into vertical blocks. With ``max_gap=0`` a block only holds the
+    given cells (safe for writes); a larger gap lets reads cover a few unused
+    cells to save round trips.
+    """
+    rows: Dict[Tuple[str, str], set] = {}
+    for sheet, address in cells:
+        column, row = split_address(address)
+        rows.setdefault((sheet, column), set()).add(row)
+    blocks = []
+    for (sheet, column), column_rows in rows.items():
+        ordered = sorted(column_rows)
+        first = previous = ordered[0]
+        for row in ordered[1:]:
+            if row - previous > max_gap + 1:
+                blocks.append(CellBlock(sheet, column, first, previous))
+                first = row
+            previous = row
+        blocks.append(CellBlock(sheet, column, first, previous))
+    return blocks
+
+
+def write_blocks(values: Dict[Cell, Any]) -> List[Tuple[CellBlock, List[Any]]]:
+    """Contiguous blocks of ``values`` with the values of each block, top to bottom."""
+    return [(block, [values[(block.sheet, cell)] for cell in block.cells]) for block in cell_blocks(values)]
+
+
+def read_cells(cells: Iterable[Cell], read_block: Callable[[CellBlock], List[Any]],
+               max_gap: Optional[int] = None) -> Dict[Cell, Any]:
+    """
+    Read ``cells`` with one ``read_block`` call per block (``read_block``
+    returns the block's values top to bottom).
+    """
+    wanted = set(cells)
+    values = {}
+    for block in cell_blocks(wanted, MAX_READ_GAP if max_gap is None else max_gap):
+        for cell, value in zip(block.cells, read_block(block)):
+            if (block.sheet, cell) in wanted:
+                values[(block.sheet, cell)] = value
+    return values
+
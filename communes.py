@@ -0,0 +1,335 @@
+"""
+Index des codes communes de la feuille "tauxTransport".
+
+La feuille (~13 000 lignes, 5 Mo de XML) est lue en streaming directement
+dans l'archive .xlsm, sans Excel : seules les colonnes A à H sont conservées,
+dans des tableaux compacts, avec un index code -> ligne en O(1).
+
+Pour l'autocomplétion, ``CommuneIndex.search`` s'appuie sur des tableaux triés
+(codes sur 5 caractères, noms et mots des noms sans accents) parcourus par
+recherche dichotomique : une requête ne lit que les entrées du préfixe.
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+import unicodedata
+import zipfile
+import zlib
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+from xml.parsers import expat
+
+from formula_engine import shared_strings_path, workbook_sheets
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRANSPORT_SHEET = "tauxTransport 2025"
+
+# Colonnes de la feuille tauxTransport (ligne d'en-tête "Code commune")
+CODE_COLUMN = "A"
+LABEL_COLUMNS = {"B": "libelle", "C": "aot"}
+RATE_COLUMNS = {"D": "taux_aot", "E": "taux_syndicat", "F": "taux_total", "G": "coef", "H": "taux_transport"}
+
+
+class Commune(NamedTuple):
+    code: str
+    libelle: str
+    aot: str
+    taux_aot: float
+    taux_syndicat: float
+    taux_total: float
+    coef: float
+    taux_transport: float
+
+
+_SEPARATORS_RE = re.compile(r"[\s\-'’]+")
+
+
+def normalize_code(value) -> str:
+    """
+    Normalise un code commune une seule fois : "01005", "1005.0" et 1005.0
+    donnent tous "1005" ; les codes corses sont mis en majuscules ("2a004" -> "2A004").
+    """
+    code = str(value).strip().upper()
+    if code.endswith(".0"):
+        code = code[:-2]
+    return code.lstrip("0")
+
+
+def display_code(code: str) -> str:
+    """Code INSEE sur 5 caractères ("1005" -> "01005")."""
+    return code.zfill(5)
+
+
+def fold_text(text: str) -> str:
+    """Clé de recherche : sans accents, en minuscules, séparateurs réduits à une espace."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _SEPARATORS_RE.sub(" ", stripped.lower()).strip()
+
+
+class SortedKeys:
+    """
+    Sorted (key, position) pairs scanned by prefix with bisect. ``keys`` may be
+    any sequence of strings, e.g. a column mapped from the artifact cache.
+    """
+
+    __slots__ = ("keys", "positions")
+
+    def __init__(self, keys: Sequence[str], positions: Sequence[int]):
+        self.keys = keys
+        self.positions = positions
+
+    @classmethod
+    def build(cls, entries: List[Tuple[str, int]]) -> "SortedKeys":
+        entries.sort()
+        return cls([key for key, _ in entries], array("q", (position for _, position in entries)))
+
+    def prefixed(self, prefix: str) -> Iterator[int]:
+        start = bisect.bisect_left(self.keys, prefix)
+        for i in range(start, len(self.keys)):
+            if not self.keys[i].startswith(prefix):
+                return
+            yield self.positions[i]
+
+
+class CodeLookup:
+    """
+    Code -> position through an open-addressing hash table stored as a plain
+    array (crc32 keys, linear probing): unlike a dict it can live in the pages
+    mapped from the artifact cache and be shared by every worker.
+    """
+
+    __slots__ = ("codes", "table", "mask")
+
+    def __init__(self, codes: Sequence[str], table: Sequence[int]):
+        self.codes = codes
+        self.table = table
+        self.mask = len(table) - 1
+
+    @classmethod
+    def build(cls, codes: Sequence[str]) -> "CodeLookup":
+        size = 1
+        while size < 2 * len(codes):
+            size *= 2
+        table = array("q", [-1]) * size
+        for position, code in enumerate(codes):
+            slot = zlib.crc32(code.encode("utf-8")) & (size - 1)
+            while table[slot] >= 0:
+                slot = (slot + 1) & (size - 1)
+            table[slot] = position
+        return cls(codes, table)
+
+    def get(self, code: str, default=None):
+        table, mask = self.table, self.mask
+        slot = zlib.crc32(code.encode("utf-8")) & mask
+        while True:
+            position = table[slot]
+            if position < 0:
+                return default
+            if self.codes[position] == code:
+                return position
+            slot = (slot + 1) & mask
+
+    def __contains__(self, code: str) -> bool:
+        return self.get(code) is not None
+
+
+class CommuneIndex:
+    """Compact, read-only index of the transport sheet keyed by normalised code."""
+
+    def __init__(self):
+        # Listes pendant la lecture de la feuille ; colonnes mappées depuis le
+        # cache d'artefacts (partagées entre workers) une fois chargé
+        self.codes: Sequence[str] = []
+        self.labels: Dict[str, Sequence[str]] = {name: [] for name in LABEL_COLUMNS.values()}
+        self.rates: Dict[str, Sequence[float]] = {name: array("d") for name in RATE_COLUMNS.values()}
+        self._positions: Union[Dict[str, int], CodeLookup] = {}
+        self._search: Optional[Tuple[SortedKeys, SortedKeys, SortedKeys]] = None
+        self._search_lock = threading.Lock()
+
+    def _append(self, code: str, labels: Dict[str, str], rates: Dict[str, float]) -> None:
+        if code in self._positions:
+            # VLOOKUP renvoie la première occurrence : on ignore les doublons
+            return
+        self._positions[code] = len(self.codes)
+        self.codes.append(code)
+        for name, column in self.labels.items():
+            column.append(labels.get(name, ""))
+        for name, column in self.rates.items():
+            column.append(rates.get(name, 0.0))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __contains__(self, code) -> bool:
+        return normalize_code(code) in self._positions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.codes)
+
+    def get(self, code) -> Optional[Commune]:
+        position = self._positions.get(normalize_code(code))
+        if position is None:
+            return None
+        return self._commune(position)
+
+    def _search_keys(self) -> Tuple[SortedKeys, SortedKeys, SortedKeys]:
+        """Sorted codes, names and name words, built on the first search."""
+        if self._search is None:
+            with self._search_lock:
+                if self._search is None:
+                    start_time = time.time()
+                    codes, names, words = [], [], []
+                    for position, (code, label) in enumerate(zip(self.codes, self.labels["libelle"])):
+                        codes.append((display_code(code).lower(), position))
+                        name = fold_text(label)
+                        names.append((name, position))
+                        # Chaque mot après le premier ("denis" pour "Saint-Denis")
+                        words.extend((name[match.end():], position) for match in re.finditer(" ", name))
+                    self._search = (SortedKeys.build(codes), SortedKeys.build(names), SortedKeys.build(words))
+                    logger.info("Built commune search index (%d codes, %d words) in %.3f seconds",
+                                len(codes), len(words), time.time() - start_time)
+        return self._search
+
+    def warm(self) -> int:
+        """
+        Build the search index and read every code once (pages of a mapped
+        artifact are loaded now, not on the first requests); returns the count.
+        """
+        self._search_keys()
+        return sum(1 for code in self.codes if self._positions.get(code) is not None)
+
+    def search(self, query: str, limit: int = 10) -> List[Commune]:
+        """
+        Top ``limit`` communes for a code or name prefix: exact code first, then
+        code prefixes, name prefixes and word prefixes (alphabetical within each).
+        """
+        key = fold_text(query)
+        if not key or limit <= 0:
+            return []
+        codes, names, words = self._search_keys()
+        found: Dict[int, None] = {}
+        exact = self._positions.get(normalize_code(key))
+        if exact is not None:
+            found[exact] = None
+        for keys in (codes, names, words):
+            for position in keys.prefixed(key):
+                if len(found) >= limit:
+                    break
+                found.setdefault(position, None)
+        return [self._commune(position) for position in found]
+
+    def _commune(self, position: int) -> Commune:
+        return Commune(
+            self.codes[position],
+            *(self.labels[name][position] for name in LABEL_COLUMNS.values()),
+            *(self.rates[name][position] for name in RATE_COLUMNS.values()),
+        )
+
+
+def _read_string_table(archive: zipfile.ZipFile) -> List[str]:
+    """Shared strings via expat (plus rapide qu'ElementTree, aucun arbre construit)."""
+    path = shared_strings_path(archive)
+    strings: List[str] = []
+    if not path:
+        return strings
+    parts: List[str] = []
+    state = {"text": False, "phonetic": 0}
+
+    def start(name, attributes):
+        if name == "si":
+            parts.clear()
+        elif name == "rPh":
+            state["phonetic"] += 1
+        elif name == "t" and not state["phonetic"]:
+            state["text"] = True
+
+    def end(name):
+        if name == "si":
+            strings.append("".join(parts))
+        elif name == "rPh":
+            state["phonetic"] -= 1
+        elif name == "t":
+            state["text"] = False
+
+    def data(text):
+        if state["text"]:
+            parts.append(text)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler, parser.EndElementHandler, parser.CharacterDataHandler = start, end, data
+    with archive.open(path) as stream:
+        parser.ParseFile(stream)
+    return strings
+
+
+def load_commune_index(path: str, sheet_name: str = DEFAULT_TRANSPORT_SHEET) -> CommuneIndex:
+    """Stream ``sheet_name`` out of the workbook at ``path`` and build its index."""
+    start_time = time.time()
+    index = CommuneIndex()
+    wanted = {CODE_COLUMN, *LABEL_COLUMNS, *RATE_COLUMNS}
+    with zipfile.ZipFile(path) as archive:
+        sheet_path = next((sheet_path for name, sheet_path, _ in workbook_sheets(archive) if name == sheet_name), None)
+        if sheet_path is None:
+            raise KeyError(f"Transport sheet '{sheet_name}' not found in {path}")
+        shared_strings = _read_string_table(archive)
+
+        # Etat du parseur : une seule ligne est gardée en mémoire à la fois
+        row: Dict[str, str] = {}
+        cell = {"column": None, "shared": False}
+        parts: List[str] = []
+        header_found = False
+
+        def start(name, attributes):
+            if name == "c":
+                column = attributes["r"].rstrip("0123456789")
+                cell["column"] = column if column in wanted else None
+                cell["shared"] = attributes.get("t") == "s"
+            elif name == "v" and cell["column"]:
+                parts.clear()
+            elif name == "row":
+                row.clear()
+
+        def data(text):
+            if cell["column"]:
+                parts.append(text)
+
+        def end(name):
+            nonlocal header_found
+            if name == "v" and cell["column"]:
+                text = "".join(parts)
+                row[cell["column"]] = shared_strings[int(text)] if cell["shared"] else text
+            elif name == "c":
+                cell["column"] = None
+            elif name == "row":
+                code = row.get(CODE_COLUMN)
+                if code is None:
+                    return
+                if not header_found:
+                    header_found = code.strip().lower() == "code commune"
+                    return
+                index._append(
+                    normalize_code(code),
+                    {label: row.get(column, "") for column, label in LABEL_COLUMNS.items()},
+                    {rate: _to_float(row.get(column)) for column, rate in RATE_COLUMNS.items()},
+                )
+
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler, parser.EndElementHandler, parser.CharacterDataHandler = start, end, data
+        with archive.open(sheet_path) as stream:
+            parser.ParseFile(stream)
+
+    logger.info("Indexed %d commune codes from '%s' in %.2f seconds", len(index), sheet_name, time.time() - start_time)
+    return index
+
+
+def _to_float(text: Optional[str]) -> float:
+    try:
+        return float(text) if text is not None else 0.0
+    except ValueError:
+        return 0.0
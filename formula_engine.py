@@ -0,0 +1,1115 @@
+"""
+Moteur de calcul natif pour les classeurs Portalia.
+
+Lit les formules directement dans le fichier .xlsm (xl/worksheets/*.xml et
+xl/calcChain.xml), les compile en fonctions Python et évalue le classeur sans
+lancer Excel. Seul le sous-ensemble de fonctions Excel utilisé par les
+templates Portalia est supporté (IF, AND, SUM, VLOOKUP, ...).
+"""
+import logging
+import re
+import time
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Nombre de lignes d'une colonne complète (A:A) dans Excel
+MAX_ROW = 1048576
+
+# A incrémenter quand la compilation change (fonctions supportées...) : invalide les artefacts en cache
+ENGINE_VERSION = 3
+
+
+class FormulaError(Exception):
+    """Raised when a formula cannot be parsed or compiled."""
+
+
+class ExcelError:
+    """Excel error value (#N/A, #VALUE!, ...) that propagates through arithmetic."""
+
+    __slots__ = ("code",)
+
+    def __init__(self, code: str):
+        self.code = code
+
+    def __repr__(self):
+        return self.code
+
+    def __str__(self):
+        return self.code
+
+    def _propagate(self, *args):
+        return self
+
+    __add__ = __radd__ = __sub__ = __rsub__ = _propagate
+    __mul__ = __rmul__ = __truediv__ = __rtruediv__ = _propagate
+    __pow__ = __rpow__ = __neg__ = __pos__ = _propagate
+
+    def __bool__(self):
+        raise TypeError(self.code)
+
+
+ERRORS = {code: ExcelError(code) for code in (
+    "#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A",
+)}
+
+
+def is_error(value: Any) -> bool:
+    return isinstance(value, ExcelError)
+
+
+class EmptyCell(float):
+    """Value of a cell without content: 0 in arithmetic, "" as text, equal to both."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return "EMPTY"
+
+
+EMPTY = EmptyCell(0.0)
+
+
+def is_empty(value: Any) -> bool:
+    return isinstance(value, EmptyCell)
+
+
+# ---------------------------------------------------------------------------
+# Adresses de cellules
+# ---------------------------------------------------------------------------
+
+_CELL_RE = re.compile(r"^\$?([A-Za-z]{1,3})\$?(\d+)$")
+
+
+def column_index(letters: str) -> int:
+    """Convert column letters ("A", "AB") to a 1-based index."""
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + (ord(char) - 64)
+    return index
+
+
+def column_letters(index: int) -> str:
+    """Convert a 1-based column index to letters."""
+    letters = ""
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def split_address(address: str) -> Tuple[int, int]:
+    """Split "B12" into (row, column) -> (12, 2)."""
+    match = _CELL_RE.match(address.strip())
+    if not match:
+        raise FormulaError(f"Invalid cell address: {address}")
+    return int(match.group(2)), column_index(match.group(1))
+
+
+def make_address(row: int, col: int) -> str:
+    return f"{column_letters(col)}{row}"
+
+
+# ---------------------------------------------------------------------------
+# Tokenizer / parser
+# ---------------------------------------------------------------------------
+
+_SHEET_PREFIX = r"(?:'(?:[^']|'')+'|[A-Za-z_][\w\.]*)!"
+_CELL_PART = r"\$?[A-Za-z]{1,3}\$?\d+"
+_COL_PART = r"\$?[A-Za-z]{1,3}"
+_ROW_PART = r"\$?\d+"
+
+_TOKEN_RE = re.compile(
+    r"(?P<ws>\s+)"
+    r"|(?P<str>\"(?:[^\"]|\"\")*\")"
+    rf"|(?P<err>(?:{_SHEET_PREFIX})?#(?:NULL!|DIV/0!|VALUE!|REF!|NAME\?|NUM!|N/A))"
+    r"|(?P<func>[A-Za-z_][\w\.]*(?=\())"
+    rf"|(?P<ref>(?:{_SHEET_PREFIX})?(?:{_CELL_PART}(?::{_CELL_PART})?|{_COL_PART}:{_COL_PART}|{_ROW_PART}:{_ROW_PART})(?![\w\(\[!]))"
+    r"|(?P<table>[A-Za-z_][\w\.]*\[(?:[^\[\]]|\[[^\]]*\])*\])"
+    r"|(?P<bool>(?:TRUE|FALSE)(?![\w\(]))"
+    r"|(?P<name>[A-Za-z_\\][\w\.]*)"
+    r"|(?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+    r"|(?P<op><>|<=|>=|[-+*/^&=<>%(),])"
+)
+
+
+def tokenize(formula: str) -> List[Tuple[str, str]]:
+    tokens = []
+    pos = 0
+    while pos < len(formula):
+        match = _TOKEN_RE.match(formula, pos)
+        if not match:
+            raise FormulaError(f"Unexpected character at {pos} in formula: {formula}")
+        kind = match.lastgroup
+        if kind != "ws":
+            tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+def _split_sheet(text: str) -> Tuple[Optional[str], str]:
+    if "!" not in text:
+        return None, text
+    sheet, ref = text.rsplit("!", 1)
+    if sheet.startswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    return sheet, ref
+
+
+class _Parser:
+    """Recursive descent parser producing a tuple based AST.
+
+    Nodes: ("num", x), ("str", s), ("bool", b), ("err", code),
+    ("ref", sheet, row, col), ("range", sheet, r1, c1, r2, c2),
+    ("call", NAME, [args]), ("bin", op, a, b), ("neg", a), ("pct", a).
+    """
+
+    _COMPARISONS = ("=", "<>", "<", ">", "<=", ">=")
+
+    def __init__(self, formula: str, sheet: str, offset: Tuple[int, int], resolver):
+        self.tokens = tokenize(formula)
+        self.pos = 0
+        self.sheet = sheet
+        self.offset = offset
+        self.resolver = resolver
+
+    def parse(self):
+        node = self._comparison()
+        if self.pos != len(self.tokens):
+            raise FormulaError(f"Unexpected token {self.tokens[self.pos]}")
+        return node
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _take(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _expect(self, value):
+        kind, text = self._take()
+        if text != value:
+            raise FormulaError(f"Expected '{value}', got '{text}'")
+
+    def _binary(self, operators, next_level):
+        node = next_level()
+        while self._peek()[0] == "op" and self._peek()[1] in operators:
+            op = self._take()[1]
+            node = ("bin", op, node, next_level())
+        return node
+
+    def _comparison(self):
+        return self._binary(self._COMPARISONS, self._concat)
+
+    def _concat(self):
+        return self._binary(("&",), self._additive)
+
+    def _additive(self):
+        return self._binary(("+", "-"), self._multiplicative)
+
+    def _multiplicative(self):
+        return self._binary(("*", "/"), self._power)
+
+    def _power(self):
+        return self._binary(("^",), self._unary)
+
+    def _unary(self):
+        kind, text = self._peek()
+        if kind == "op" and text in ("-", "+"):
+            self._take()
+            operand = self._unary()
+            return ("neg", operand) if text == "-" else operand
+        return self._percent()
+
+    def _percent(self):
+        node = self._primary()
+        while self._peek() == ("op", "%"):
+            self._take()
+            node = ("pct", node)
+        return node
+
+    def _primary(self):
+        kind, text = self._take()
+        if kind == "num":
+            return ("num", float(text))
+        if kind == "str":
+            return ("str", text[1:-1].replace('""', '"'))
+        if kind == "bool":
+            return ("bool", text == "TRUE")
+        if kind == "err":
+            return ("err", _split_sheet(text)[1])
+        if kind == "ref":
+            return self._reference(text)
+        if kind == "table":
+            return self.resolver.table_reference(text)
+        if kind == "name":
+            return self.resolver.defined_name(text)
+        if kind == "func":
+            return self._call(text.upper())
+        if kind == "op" and text == "(":
+            node = self._comparison()
+            self._expect(")")
+            return node
+        raise FormulaError(f"Unexpected token '{text}'")
+
+    def _call(self, name):
+        self._expect("(")
+        args = []
+        if self._peek() == ("op", ")"):
+            self._take()
+            return ("call", name, args)
+        while True:
+            if self._peek() in (("op", ","), ("op", ")")):
+                args.append(("empty",))
+            else:
+                args.append(self._comparison())
+            kind, text = self._take()
+            if text == ")":
+                return ("call", name, args)
+            if text != ",":
+                raise FormulaError(f"Expected ',' or ')' in {name}(), got '{text}'")
+
+    def _shift(self, part: str, is_row: bool) -> int:
+        absolute = part.startswith("$")
+        part = part.lstrip("$")
+        value = int(part) if is_row else column_index(part)
+        if not absolute:
+            value += self.offset[0] if is_row else self.offset[1]
+        return value
+
+    def _reference(self, text):
+        sheet, ref = _split_sheet(text)
+        sheet = sheet or self.sheet
+        first, _, last = ref.partition(":")
+        if not last:
+            row, col = self._cell(first)
+            return ("ref", sheet, row, col)
+        if re.match(r"^\$?[A-Za-z]+$", first):
+            return ("range", sheet, 1, self._shift(first, False), MAX_ROW, self._shift(last, False))
+        if re.match(r"^\$?\d+$", first):
+            return ("range", sheet, self._shift(first, True), 1, self._shift(last, True), 16384)
+        r1, c1 = self._cell(first)
+        r2, c2 = self._cell(last)
+        return ("range", sheet, min(r1, r2), min(c1, c2), max(r1, r2), max(c1, c2))
+
+    def _cell(self, part):
+        match = re.match(r"^(\$?[A-Za-z]+)(\$?\d+)$", part)
+        return self._shift(match.group(2), True), self._shift(match.group(1), False)
+
+
+# ---------------------------------------------------------------------------
+# Fonctions Excel (mode scalaire)
+# ---------------------------------------------------------------------------
+
+def _lookup_key(value: Any) -> Any:
+    """
+    Normalise a value for exact-match lookups (Excel compares text
+    case-insensitively); None for an empty cell, which matches nothing.
+    """
+    if is_empty(value):
+        return None
+    if isinstance(value, bool):
+        return ("b", value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        return value.lower()
+    return value
+
+
+def _eq(a, b):
+    if is_error(a):
+        return a
+    if is_error(b):
+        return b
+    # Cellule vide : égale à 0, à FALSE et à ""
+    if is_empty(a) or is_empty(b):
+        other = b if is_empty(a) else a
+        return other == "" if isinstance(other, str) else other == 0
+    if isinstance(a, str) and isinstance(b, str):
+        return a.lower() == b.lower()
+    # Types différents (texte, nombre, booléen) : jamais égaux, TRUE <> 1 ; 1 = 1.0
+    if isinstance(a, str) != isinstance(b, str) or isinstance(a, bool) != isinstance(b, bool):
+        return False
+    return a == b
+
+
+def _ne(a, b):
+    result = _eq(a, b)
+    return result if is_error(result) else not result
+
+
+def _concat(a, b):
+    if is_error(a):
+        return a
+    if is_error(b):
+        return b
+    return _text(a) + _text(b)
+
+
+def _text(value):
+    if is_empty(value):
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _truth(value):
+    if is_error(value):
+        raise TypeError(value.code)
+    if isinstance(value, str):
+        raise TypeError("#VALUE!")
+    return bool(value)
+
+
+def _flatten(args):
+    for arg in args:
+        if isinstance(arg, BoundRange):
+            yield from arg.values()
+        else:
+            yield arg
+
+
+def _numbers(args):
+    for value in _flatten(args):
+        if is_error(value):
+            raise TypeError(value.code)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield value
+
+
+def fn_sum(*args):
+    return sum(_numbers(args))
+
+
+def fn_min(*args):
+    return min(_numbers(args), default=0)
+
+
+def fn_max(*args):
+    return max(_numbers(args), default=0)
+
+
+def fn_and(*args):
+    return all(_truth(value) for value in _flatten(args))
+
+
+def fn_or(*args):
+    return any(_truth(value) for value in _flatten(args))
+
+
+def fn_not(value):
+    return not _truth(value)
+
+
+def fn_abs(value):
+    return abs(value)
+
+
+def fn_round(value, digits=0):
+    # Excel arrondit "au plus loin de zéro", contrairement à round() en Python
+    factor = 10 ** int(digits)
+    scaled = abs(value) * factor
+    rounded = int(scaled + 0.5 + 1e-9) / factor
+    return rounded if value >= 0 else -rounded
+
+
+def _lookup_order(value: Any) -> Optional[Tuple[int, Any]]:
+    """
+    Type rank and comparable value for approximate lookups: numbers compare
+    by value whatever their Python type, text case-insensitively; empty cells
+    and errors are skipped (None).
+    """
+    if is_empty(value) or is_error(value):
+        return None
+    if isinstance(value, bool):
+        return (2, value)
+    if isinstance(value, (int, float)):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value.lower())
+    return None
+
+
+def fn_vlookup(key, table, col, approximate=True):
+    if is_error(key):
+        return key
+    if not isinstance(table, BoundRange):
+        return ERRORS["#REF!"]
+    col = int(col)
+    if col < 1 or col > table.width:
+        return ERRORS["#REF!"]
+    if approximate is None or not approximate:
+        return table.lookup(key, col)
+    return table.approximate_lookup(key, col)
+
+
+def fn_concatenate(*args):
+    for value in args:
+        if is_error(value):
+            return value
+    return "".join(_text(value) for value in args)
+
+
+FUNCTIONS: Dict[str, Callable] = {
+    "SUM": fn_sum,
+    "MIN": fn_min,
+    "MAX": fn_max,
+    "AND": fn_and,
+    "OR": fn_or,
+    "NOT": fn_not,
+    "ABS": fn_abs,
+    "ROUND": fn_round,
+    "VLOOKUP": fn_vlookup,
+    "CONCATENATE": fn_concatenate,
+}
+
+
+# ---------------------------------------------------------------------------
+# Plages
+# ---------------------------------------------------------------------------
+
+class CellRange:
+    """A rectangular range resolved against the loaded cells of one sheet."""
+
+    def __init__(self, model: "WorkbookModel", sheet: str, r1: int, c1: int, r2: int, c2: int):
+        self.model = model
+        self.sheet = sheet
+        self.r1, self.c1 = r1, c1
+        self.r2 = min(r2, model.max_row(sheet))
+        self.c2 = c2
+        self.width = c2 - c1 + 1
+        self._index: Optional[Dict[Any, int]] = None
+
+    def cell_ids(self) -> List[int]:
+        """Ids of the non-empty cells of the range, row by row."""
+        cells = self.model._cells
+        ids = []
+        for row in self.model.rows(self.sheet, self.r1, self.r2):
+            for col in range(self.c1, self.c2 + 1):
+                cell_id = cells.get((self.sheet, row, col))
+                if cell_id is not None:
+                    ids.append(cell_id)
+        return ids
+
+    def key_index(self) -> Dict[Any, int]:
+        """Hash index of the first column (first occurrence wins, like VLOOKUP)."""
+        if self._index is None:
+            model = self.model
+            index: Dict[Any, int] = {}
+            for row in model.rows(self.sheet, self.r1, self.r2):
+                cell_id = model._cells.get((self.sheet, row, self.c1))
+                if cell_id is None:
+                    continue
+                key = _lookup_key(model._values[cell_id])
+                if key is not None and key not in index:
+                    index[key] = row
+            self._index = index
+        return self._index
+
+    def __call__(self, values: List[Any]) -> "BoundRange":
+        return BoundRange(self, values)
+
+
+class BoundRange:
+    """A CellRange bound to the value vector of one evaluation."""
+
+    __slots__ = ("range", "values_vector", "width")
+
+    def __init__(self, cell_range: CellRange, values: List[Any]):
+        self.range = cell_range
+        self.values_vector = values
+        self.width = cell_range.width
+
+    def values(self):
+        values = self.values_vector
+        return [values[cell_id] for cell_id in self.range.cell_ids()]
+
+    def _value_at(self, row: int, col: int):
+        cell_id = self.range.model._cells.get((self.range.sheet, row, self.range.c1 + col - 1))
+        if cell_id is None:
+            return EMPTY
+        return self.values_vector[cell_id]
+
+    def lookup(self, key, col):
+        row = self.range.key_index().get(_lookup_key(key))
+        if row is None:
+            return ERRORS["#N/A"]
+        return self._value_at(row, col)
+
+    def approximate_lookup(self, key, col):
+        key = _lookup_order(key)
+        if key is None:
+            return ERRORS["#N/A"]
+        found = None
+        for row in self.range.model.rows(self.range.sheet, self.range.r1, self.range.r2):
+            candidate = _lookup_order(self._value_at(row, 1))
+            if candidate is None or candidate[0] != key[0]:
+                continue
+            if candidate[1] <= key[1]:
+                found = row
+            elif found is not None:
+                break
+        if found is None:
+            return ERRORS["#N/A"]
+        return self._value_at(found, col)
+
+
+# ---------------------------------------------------------------------------
+# Compilation
+# ---------------------------------------------------------------------------
+
+_BINARY_OPERATORS = {"+": "+", "-": "-", "*": "*", "/": "/", "^": "**", "<": "<", ">": ">", "<=": "<=", ">=": ">="}
+# En mode vectoriel, les comparaisons passent par des fonctions (erreurs ligne par ligne)
+_COMPARISONS = {"<": "_lt", ">": "_gt", "<=": "_le", ">=": "_ge"}
+
+
+class _Compiler:
+    """Translate an AST into a Python expression over the value vector ``v``."""
+
+    def __init__(self, model: "WorkbookModel", vector: bool = False):
+        self.model = model
+        self.vector = vector
+        self.dependencies: set = set()
+
+    def expression(self, node) -> str:
+        kind = node[0]
+        if kind == "num":
+            return repr(node[1])
+        if kind == "str":
+            return repr(node[1])
+        if kind == "bool":
+            return repr(node[1])
+        if kind == "err":
+            return f"_ERR[{node[1]!r}]"
+        if kind == "empty":
+            return "None"
+        if kind == "ref":
+            cell_id = self.model._ensure_cell(node[1], node[2], node[3])
+            self.dependencies.add(cell_id)
+            return f"v[{cell_id}]"
+        if kind == "range":
+            range_id = self.model._register_range(*node[1:])
+            self.dependencies.update(self.model._ranges[range_id].cell_ids())
+            return f"R[{range_id}](v)"
+        if kind == "neg":
+            return f"(-{self.expression(node[1])})"
+        if kind == "pct":
+            return f"({self.expression(node[1])}/100.0)"
+        if kind == "bin":
+            op, left, right = node[1], self.expression(node[2]), self.expression(node[3])
+            if op == "=":
+                return f"_eq({left}, {right})"
+            if op == "<>":
+                return f"_ne({left}, {right})"
+            if op == "&":
+                return f"_concat({left}, {right})"
+            if self.vector and op in _COMPARISONS:
+                return f"{_COMPARISONS[op]}({left}, {right})"
+            return f"({left} {_BINARY_OPERATORS[op]} {right})"
+        if kind == "call":
+            return self._call(node[1], node[2])
+        raise FormulaError(f"Unsupported node {kind}")
+
+    def _call(self, name, args):
+        if name == "IF":
+            condition = self.expression(args[0])
+            when_true = self.expression(args[1]) if len(args) > 1 else "True"
+            when_false = self.expression(args[2]) if len(args) > 2 else "False"
+            if self.vector:
+                # Mode vectoriel : la condition peut être un tableau, les branches sont différées
+                return f"_if({condition}, lambda: {when_true}, lambda: {when_false})"
+            return f"({when_true} if _truth({condition}) else {when_false})"
+        if name == "IFERROR":
+            return f"_iferror({self.expression(args[0])}, {self.expression(args[1])})"
+        if name not in FUNCTIONS:
+            logger.warning("Unsupported Excel function %s, evaluating to #NAME?", name)
+            return "_ERR['#NAME?']"
+        return f"_F[{name!r}]({', '.join(self.expression(arg) for arg in args)})"
+
+
+def _iferror(value, fallback):
+    return fallback if is_error(value) else value
+
+
+# ---------------------------------------------------------------------------
+# Lecture du classeur
+# ---------------------------------------------------------------------------
+
+def read_shared_strings(archive: zipfile.ZipFile, path: Optional[str] = None) -> List[str]:
+    """Stream xl/sharedStrings.xml into a list indexed like the ``t="s"`` cells."""
+    path = path or shared_strings_path(archive)
+    if not path or path not in archive.namelist():
+        return []
+    strings = []
+    with archive.open(path) as stream:
+        for event, element in ET.iterparse(stream):
+            if element.tag == NS_MAIN + "si":
+                # Ignore les annotations phonétiques (rPh), seul le texte compte
+                parts = [t.text or "" for t in element.findall(NS_MAIN + "t")]
+                parts += [t.text or "" for t in element.findall(f"{NS_MAIN}r/{NS_MAIN}t")]
+                strings.append("".join(parts))
+                element.clear()
+    return strings
+
+
+def _relationships(archive: zipfile.ZipFile, path: str) -> Dict[str, str]:
+    rels_path = posixpath.join(posixpath.dirname(path), "_rels", posixpath.basename(path) + ".rels")
+    if rels_path not in archive.namelist():
+        return {}
+    targets = {}
+    for rel in ET.fromstring(archive.read(rels_path)).iter(NS_PKG_REL + "Relationship"):
+        target = rel.get("Target")
+        if rel.get("TargetMode") == "External":
+            continue
+        if target.startswith("/"):
+            resolved = target.lstrip("/")
+        else:
+            resolved = posixpath.normpath(posixpath.join(posixpath.dirname(path), target))
+        targets[rel.get("Id")] = resolved
+    return targets
+
+
+def workbook_sheets(archive: zipfile.ZipFile) -> List[Tuple[str, str, str]]:
+    """(name, xml path, sheetId) of every worksheet, in workbook order."""
+    workbook_rels = _relationships(archive, "xl/workbook.xml")
+    workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+    return [(sheet.get("name"), workbook_rels[sheet.get(NS_REL + "id")], sheet.get("sheetId"))
+            for sheet in workbook.iter(NS_MAIN + "sheet")]
+
+
+def shared_strings_path(archive: zipfile.ZipFile) -> Optional[str]:
+    workbook_rels = _relationships(archive, "xl/workbook.xml")
+    return next((target for target in workbook_rels.values() if target.endswith("sharedStrings.xml")), None)
+
+
+def _cell_value(cell: ET.Element, shared_strings: List[str]) -> Any:
+    cell_type = cell.get("t")
+    value = cell.find(NS_MAIN + "v")
+    if cell_type == "inlineStr":
+        return "".join(t.text or "" for t in cell.iter(NS_MAIN + "t"))
+    if value is None:
+        return None
+    text = value.text
+    if text is None:
+        return "" if cell_type == "str" else None
+    if cell_type == "s":
+        return shared_strings[int(text)]
+    if cell_type == "str":
+        return text
+    if cell_type == "b":
+        return text == "1"
+    if cell_type == "e":
+        return ERRORS.get(text, ExcelError(text))
+    return float(text)
+
+
+class WorkbookModel:
+    """In-memory, Excel-free model of a workbook with compiled formulas."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sheet_names: List[str] = []
+        self._values: List[Any] = []
+        self._cells: Dict[Tuple[str, int, int], int] = {}
+        self._addresses: List[Tuple[str, int, int]] = []
+        self._sheet_rows: Dict[str, List[int]] = {}
+        self._formulas: Dict[int, str] = {}
+        self._formula_offsets: Dict[int, Tuple[int, int]] = {}
+        self._sources: Dict[int, str] = {}
+        self._functions: Dict[int, Callable] = {}
+        self._vector_functions: Dict[int, Callable] = {}
+        self._code = None
+        self._dependencies: Dict[int, Tuple[int, ...]] = {}
+        self._ranges: List[CellRange] = []
+        self._range_keys: Dict[Tuple, int] = {}
+        self._tables: Dict[str, Tuple[str, int, int, int, int, int]] = {}
+        self._names: Dict[str, str] = {}
+        self._calc_chain: List[int] = []
+        self._order: List[int] = []
+        # Cellules d'entrée déclarées et formules constantes pré-calculées (fold_constants)
+        self._inputs: Optional[frozenset] = None
+        self._folded: frozenset = frozenset()
+        self._plans: Dict[Tuple[frozenset, bool], List[int]] = {}
+        self._cones: Dict[Tuple[frozenset, int], List[int]] = {}
+        self._namespace = {
+            "_ERR": ERRORS,
+            "_F": FUNCTIONS,
+            "_eq": _eq,
+            "_ne": _ne,
+            "_concat": _concat,
+            "_truth": _truth,
+            "_iferror": _iferror,
+            "R": self._ranges,
+        }
+
+    # -- construction -----------------------------------------------------
+
+    def _ensure_cell(self, sheet: str, row: int, col: int, value: Any = EMPTY) -> int:
+        key = (sheet, row, col)
+        cell_id = self._cells.get(key)
+        if cell_id is None:
+            cell_id = len(self._values)
+            self._cells[key] = cell_id
+            self._addresses.append(key)
+            self._values.append(value)
+        return cell_id
+
+    def _register_range(self, sheet, r1, c1, r2, c2) -> int:
+        key = (sheet, r1, c1, r2, c2)
+        range_id = self._range_keys.get(key)
+        if range_id is None:
+            range_id = len(self._ranges)
+            self._ranges.append(CellRange(self, sheet, r1, c1, r2, c2))
+            self._range_keys[key] = range_id
+        return range_id
+
+    def max_row(self, sheet: str) -> int:
+        rows = self._sheet_rows.get(sheet)
+        return rows[-1] if rows else 0
+
+    def rows(self, sheet: str, first: int, last: int) -> List[int]:
+        """Populated rows of ``sheet`` between ``first`` and ``last`` (inclusive)."""
+        rows = self._sheet_rows.get(sheet, [])
+        return rows[bisect_left(rows, first):bisect_right(rows, last)]
+
+    def _compile(self, code=None):
+        """
+        Turn the generated Python sources into functions. All formulas are
+        compiled as a single module so the code object can be cached (marshal).
+        """
+        cell_ids = sorted(self._sources)
+        if code is None:
+            body = ",\n".join(f"lambda v: {self._sources[cell_id]}" for cell_id in cell_ids)
+            code = compile(f"_FUNCTIONS = (\n{body},\n)", f"<formulas {self.path}>", "exec")
+        namespace = dict(self._namespace)
+        exec(code, namespace)
+        self._functions = dict(zip(cell_ids, namespace["_FUNCTIONS"]))
+        self._code = code
+        return code
+
+    # Resolver hooks used by the parser
+    def table_reference(self, text: str):
+        name, _, specifier = text.partition("[")
+        specifier = specifier[:-1].strip()
+        table = self._tables.get(name.lower())
+        if table is None:
+            return ("err", "#REF!")
+        sheet, r1, c1, r2, c2, header_rows = table
+        if specifier.lower() == "[#all]" or specifier.lower() == "#all":
+            return ("range", sheet, r1, c1, r2, c2)
+        if specifier == "" or specifier.lower() in ("#data", "[#data]"):
+            return ("range", sheet, r1 + header_rows, c1, r2, c2)
+        raise FormulaError(f"Unsupported structured reference: {text}")
+
+    def defined_name(self, text: str):
+        definition = self._names.get(text.lower())
+        if definition is None:
+            return ("err", "#NAME?")
+        return _Parser(definition, self.sheet_names[0], (0, 0), self)._comparison()
+
+    # -- accès public -----------------------------------------------------
+
+    def cell_id(self, sheet: str, address: str) -> int:
+        row, col = split_address(address)
+        return self._ensure_cell(sheet, row, col)
+
+    def get_value(self, sheet: str, address: str) -> Any:
+        """Value stored in the template (cached result for formula cells)."""
+        row, col = split_address(address)
+        cell_id = self._cells.get((sheet, row, col))
+        return None if cell_id is None else self._values[cell_id]
+
+    def formula(self, sheet: str, address: str) -> Optional[str]:
+        row, col = split_address(address)
+        cell_id = self._cells.get((sheet, row, col))
+        return self._formulas.get(cell_id)
+
+    @property
+    def formula_count(self) -> int:
+        return len(self._functions)
+
+    def _plan(self, targets: Iterable[int], folded: bool = True) -> List[int]:
+        """
+        Formula cells needed to compute ``targets``, in evaluation order;
+        constant-folded cells are left out unless ``folded`` is False.
+        """
+        key = frozenset(targets)
+        plan = self._plans.get((key, folded))
+        if plan is None:
+            needed = set()
+            stack = list(key)
+            while stack:
+                cell_id = stack.pop()
+                if cell_id in needed:
+                    continue
+                needed.add(cell_id)
+                stack.extend(self._dependencies.get(cell_id, ()))
+            skipped = self._folded if folded else frozenset()
+            plan = [cell_id for cell_id in self._order if cell_id in needed and cell_id not in skipped]
+            self._plans[(key, folded)] = plan
+        return plan
+
+    def _foldable(self, inputs: Iterable[int]) -> bool:
+        """Folded values stay valid only if every written cell is a declared input."""
+        return self._inputs is None or self._inputs.issuperset(inputs)
+
+    def fold_constants(self, inputs: Iterable[Tuple[str, str]]) -> int:
+        """
+        Declare the cells a simulation may write and evaluate once, at load
+        time, every formula that does not depend on them (rate tables...):
+        per-request plans then only hold the dirty cone of the inputs.
+        Returns the number of folded formulas.
+        """
+        start_time = time.time()
+        input_ids = frozenset(self.cell_id(*key) for key in inputs)
+        dirty = set(input_ids)
+        for cell_id in self._order:
+            if any(dependency in dirty for dependency in self._dependencies[cell_id]):
+                dirty.add(cell_id)
+        constant = [cell_id for cell_id in self._order if cell_id not in dirty]
+        values = list(self._values)
+        self._execute(values, constant, ())
+        for cell_id in constant:
+            self._values[cell_id] = values[cell_id]
+        self._inputs, self._folded = input_ids, frozenset(constant)
+        self._plans.clear()
+        self._cones.clear()
+        logger.info("Folded %d constant formulas of %s (%d depend on the inputs) in %.2f seconds",
+                    len(constant), self.path, self.formula_count - len(constant), time.time() - start_time)
+        return len(constant)
+
+    @property
+    def folded_count(self) -> int:
+        return len(self._folded)
+
+    def evaluate(self, inputs: Dict[Tuple[str, str], Any], outputs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Any]:
+        """
+        Evaluate the workbook with ``inputs`` written into the given cells and
+        return the values of ``outputs``. Both are keyed by (sheet, address).
+        """
+        values = self.run({self.cell_id(*key): value for key, value in inputs.items()},
+                          [self.cell_id(*key) for key in outputs])
+        return {key: values[self.cell_id(*key)] for key in outputs}
+
+    def run(self, inputs: Dict[int, Any], targets: List[int]) -> List[Any]:
+        """Low-level evaluation over cell ids; returns the full value vector."""
+        values = list(self._values)
+        for cell_id, value in inputs.items():
+            values[cell_id] = value
+        self._execute(values, self._plan(targets, self._foldable(inputs)), inputs)
+        return values
+
+    def _execute(self, values: List[Any], cells: List[int], fixed) -> int:
+        """Evaluate ``cells`` in order (except ``fixed`` ones); returns how many were computed."""
+        functions = self._functions
+        computed = 0
+        for cell_id in cells:
+            if cell_id in fixed:
+                continue
+            computed += 1
+            try:
+                values[cell_id] = functions[cell_id](values)
+            except ZeroDivisionError:
+                values[cell_id] = ERRORS["#DIV/0!"]
+            except TypeError as e:
+                values[cell_id] = ERRORS.get(str(e), ERRORS["#VALUE!"])
+            except Exception:
+                values[cell_id] = ERRORS["#VALUE!"]
+        return computed
+
+    def parse(self, cell_id: int):
+        """AST of the formula of ``cell_id`` (shared formulas are re-shifted)."""
+        sheet, _, _ = self._addresses[cell_id]
+        return _Parser(self._formulas[cell_id], sheet, self._formula_offsets.get(cell_id, (0, 0)), self).parse()
+
+    def _cone(self, targets: frozenset, cell_id) -> List[int]:
+        """
+        Cells of the plan for ``targets`` that depend (transitively) on
+        ``cell_id`` (or on any cell of a frozenset of ids).
+        """
+        key = (targets, cell_id)
+        cone = self._cones.get(key)
+        if cone is None:
+            dirty = set(cell_id) if isinstance(cell_id, frozenset) else {cell_id}
+            cone = []
+            # Plan complet : une cellule hors des entrées déclarées peut alimenter des formules pliées
+            for candidate in self._plan(targets, folded=False):
+                if any(dependency in dirty for dependency in self._dependencies[candidate]):
+                    dirty.add(candidate)
+                    cone.append(candidate)
+            self._cones[key] = cone
+        return cone
+
+    def scenario(self, inputs: Dict[Tuple[str, str], Any], targets: Iterable[Tuple[str, str]]) -> "Scenario":
+        """Start a what-if evaluation that can then be updated cell by cell."""
+        return Scenario(self, {self.cell_id(*key): value for key, value in inputs.items()},
+                        [self.cell_id(*key) for key in targets])
+
+    def batch(self, inputs: Dict[Tuple[str, str], Any], targets: Iterable[Tuple[str, str]],
+              size: Optional[int] = None) -> "BatchScenario":
+        """
+        Vectorised what-if evaluation: each input is either a scalar or a
+        column of values (one per row), see ``vector_engine.BatchScenario``.
+        ``size`` is the number of rows when every input may be a scalar.
+        """
+        from vector_engine import BatchScenario
+        return BatchScenario(self, {self.cell_id(*key): value for key, value in inputs.items()},
+                             [self.cell_id(*key) for key in targets], size)
+
+
+class Scenario:
+    """
+    Mutable evaluation state used for repeated what-if runs (goal seek):
+    changing one cell only recomputes the formulas that depend on it.
+    ``recomputed`` counts the formula evaluations done so far.
+    """
+
+    def __init__(self, model: WorkbookModel, inputs: Dict[int, Any], targets: List[int]):
+        self.model = model
+        self.targets = frozenset(targets)
+        self.fixed = set(inputs)
+        self.values = list(model._values)
+        for cell_id, value in inputs.items():
+            self.values[cell_id] = value
+        self.recomputed = model._execute(self.values, model._plan(self.targets, model._foldable(inputs)), self.fixed)
+
+    def get(self, cell_id: int) -> Any:
+        return self.values[cell_id]
+
+    def set(self, cell_id: int, value: Any) -> None:
+        self.values[cell_id] = value
+        self.fixed.add(cell_id)
+        self.recomputed += self.model._execute(self.values, self.model._cone(self.targets, cell_id), self.fixed)
+
+
+def load_workbook_model(path: str) -> WorkbookModel:
+    """Read ``path`` (.xlsx/.xlsm) and compile all of its formulas."""
+    start_time = time.time()
+    model = WorkbookModel(path)
+    with zipfile.ZipFile(path) as archive:
+        workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+        sheets = workbook_sheets(archive)
+        sheet_ids = {sheet_id: name for name, _, sheet_id in sheets}
+        model.sheet_names = [name for name, _, _ in sheets]
+
+        for defined_name in workbook.iter(NS_MAIN + "definedName"):
+            if defined_name.get("localSheetId") is None and defined_name.text:
+                model._names[defined_name.get("name").lower()] = defined_name.text
+
+        shared_strings = read_shared_strings(archive)
+
+        raw_formulas: List[Tuple[str, int, int, str, Tuple[int, int]]] = []
+        for name, sheet_path, _ in sheets:
+            _read_sheet(archive, model, name, sheet_path, shared_strings, raw_formulas)
+            for table_path in _relationships(archive, sheet_path).values():
+                if "/tables/" in table_path:
+                    _read_table(archive, model, name, table_path)
+
+        for sheet_rows in model._sheet_rows.values():
+            sheet_rows.sort()
+
+        for sheet, row, col, text, offset in raw_formulas:
+            cell_id = model._cells[(sheet, row, col)]
+            compiler = _Compiler(model)
+            try:
+                ast = _Parser(text, sheet, offset, model).parse()
+                source = compiler.expression(ast)
+            except FormulaError as e:
+                logger.warning("Cannot compile %s!%s (%s): %s", sheet, make_address(row, col), text, e)
+                source = "_ERR['#NAME?']"
+            model._formulas[cell_id] = text
+            if offset != (0, 0):
+                model._formula_offsets[cell_id] = offset
+            model._sources[cell_id] = source
+            model._dependencies[cell_id] = tuple(compiler.dependencies)
+        model._compile()
+
+        if "xl/calcChain.xml" in archive.namelist():
+            current_sheet = None
+            for entry in ET.fromstring(archive.read("xl/calcChain.xml")).iter(NS_MAIN + "c"):
+                current_sheet = sheet_ids.get(entry.get("i"), current_sheet) if entry.get("i") else current_sheet
+                row, col = split_address(entry.get("r"))
+                cell_id = model._cells.get((current_sheet, row, col))
+                if cell_id in model._functions:
+                    model._calc_chain.append(cell_id)
+
+    model._order = _evaluation_order(model)
+    logger.info("Compiled %s formulas from %s in %.2f seconds", model.formula_count, path, time.time() - start_time)
+    return model
+
+
+def _read_sheet(archive, model, sheet, path, shared_strings, raw_formulas):
+    shared_masters: Dict[str, Tuple[str, int, int]] = {}
+    rows = model._sheet_rows.setdefault(sheet, [])
+    with archive.open(path) as stream:
+        for event, element in ET.iterparse(stream):
+            if element.tag == NS_MAIN + "row":
+                rows.append(int(element.get("r")))
+                for cell in element.iter(NS_MAIN + "c"):
+                    row, col = split_address(cell.get("r"))
+                    value = _cell_value(cell, shared_strings)
+                    formula = cell.find(NS_MAIN + "f")
+                    if formula is None and value is None:
+                        continue
+                    cell_id = model._ensure_cell(sheet, row, col, 0.0 if value is None else value)
+                    model._values[cell_id] = 0.0 if value is None else value
+                    if formula is None:
+                        continue
+                    if formula.get("t") == "shared":
+                        index = formula.get("si")
+                        if formula.text:
+                            shared_masters[index] = (formula.text, row, col)
+                        master_text, master_row, master_col = shared_masters[index]
+                        raw_formulas.append((sheet, row, col, master_text, (row - master_row, col - master_col)))
+                    elif formula.text and formula.get("t") != "dataTable":
+                        raw_formulas.append((sheet, row, col, formula.text, (0, 0)))
+                element.clear()
+
+
+def _read_table(archive, model, sheet, path):
+    table = ET.fromstring(archive.read(path))
+    first, _, last = table.get("ref").partition(":")
+    r1, c1 = split_address(first)
+    r2, c2 = split_address(last)
+    header_rows = int(table.get("headerRowCount", "1"))
+    for attribute in ("name", "displayName"):
+        if table.get(attribute):
+            model._tables[table.get(attribute).lower()] = (sheet, r1, c1, r2, c2, header_rows)
+
+
+def _evaluation_order(model: WorkbookModel) -> List[int]:
+    """Topological order of the formula cells, seeded with the calcChain order."""
+    order: List[int] = []
+    state: Dict[int, int] = {}
+    chained = set(model._calc_chain)
+    seeds = model._calc_chain + [cell_id for cell_id in model._functions if cell_id not in chained]
+    for seed in seeds:
+        if seed in state:
+            continue
+        stack = [(seed, iter(model._dependencies.get(seed, ())))]
+        state[seed] = 1
+        while stack:
+            cell_id, dependencies = stack[-1]
+            for dependency in dependencies:
+                if dependency in model._functions and dependency not in state:
+                    state[dependency] = 1
+                    stack.append((dependency, iter(model._dependencies.get(dependency, ()))))
+                    break
+            else:
+                stack.pop()
+                state[cell_id] = 2
+                order.append(cell_id)
+    return order
@@ -0,0 +1,62 @@
+"""
+Cache HTTP des simulations : validateurs et compression.
+
+Une réponse ``/convert`` ne dépend que des paramètres normalisés et du
+template : l'ETag (fort) est le hash de la clé de cache, calculable avant
+tout calcul. Un client ou un CDN qui renvoie cet ETag dans ``If-None-Match``
+reçoit un 304 sans qu'aucune évaluation ne soit planifiée.
+
+Les réponses volumineuses (batch) sont compressées en gzip ; ``/convert``
+(quelques centaines d'octets) ne l'est jamais, si bien qu'un même ETag désigne
+toujours les mêmes octets. Les flux NDJSON/CSV (grille, fichier) ne le sont
+pas non plus : ``GZipMiddleware`` accumule les blocs dans son compresseur
+sans les vider, le client ne recevrait plus rien avant la fin du calcul.
+"""
+import hashlib
+from typing import Hashable, Iterable, Optional
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Incrémenté quand le format des réponses change : les anciens ETag ne correspondent plus
+RESPONSE_VERSION = "1"
+
+
+def etag_for(key: Hashable) -> str:
+    """Strong ETag (quoted) of a normalised cache key; stable across processes and restarts."""
+    digest = hashlib.sha256(f"{RESPONSE_VERSION}:{key!r}".encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    ``If-None-Match`` check (weak comparison, RFC 9110 13.1.2): ``*`` or any
+    listed tag equal to ``etag``, ``W/`` prefixes ignored.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+class CompressLargeResponses:
+    """``GZipMiddleware`` limited to some path prefixes (responses below ``minimum_size`` stay as is)."""
+
+    def __init__(self, app: ASGIApp, paths: Iterable[str], minimum_size: int = 1024, compresslevel: int = 6):
+        self.app = app
+        self.paths = tuple(paths)
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(self.paths):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
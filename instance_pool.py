@@ -0,0 +1,235 @@
+"""
+Pool générique d'instances préchauffées (classeurs ouverts, sessions...).
+
+Le pool garde jusqu'à ``size`` instances créées par ``factory`` et les prête
+une à une. Après chaque prêt, l'instance est réinitialisée (``reset``) puis
+remise dans le pool, sauf si elle a servi ``max_uses`` fois, si elle a
+échoué ou si son prêt a dépassé ``lease_timeout`` : elle est alors fermée et
+remplacée. Une instance qui échoue au contrôle de santé (``healthy``) au
+moment du prêt est remplacée de la même façon.
+
+Les instances doivent fournir ``reset()``, ``healthy()`` et ``close()``.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator
+
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseTimeout(Exception):
+    """Raised when no instance became available within the acquire timeout."""
+
+
+class PoolClosed(Exception):
+    """Raised when leasing from a closed pool."""
+
+
+class _Instance:
+    __slots__ = ("id", "session", "uses", "leased_at", "expired", "failed")
+
+    def __init__(self, instance_id: int, session: Any):
+        self.id = instance_id
+        self.session = session
+        self.uses = 0
+        self.leased_at = 0.0
+        self.expired = False
+        self.failed = False
+
+
+class InstancePool:
+    """Thread-safe pool of reusable instances with recycling and health checks."""
+
+    def __init__(self, factory: Callable[[], Any], size: int = 2, max_uses: int = 200,
+                 acquire_timeout: float = 30.0, lease_timeout: float = 120.0, name: str = "pool"):
+        if size < 1:
+            raise ValueError("Instance pool size must be at least 1")
+        self.factory = factory
+        self.size = size
+        self.max_uses = max_uses
+        self.acquire_timeout = acquire_timeout
+        self.lease_timeout = lease_timeout
+        self.name = name
+        self._idle: Deque[_Instance] = deque()
+        self._leased: Dict[int, _Instance] = {}
+        self._opening = 0
+        self._closed = False
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self.created = 0
+        self.recycled = 0
+        self.unhealthy = 0
+        self.failures = 0
+        self.expired_leases = 0
+        self.acquire_timeouts = 0
+
+    # -- cycle de vie des instances ---------------------------------------
+
+    def _create(self) -> _Instance:
+        """Open a new instance for a slot already reserved in ``_opening``."""
+        try:
+            session = self.factory()
+        except BaseException:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opening -= 1
+            self.created += 1
+            return _Instance(next(self._ids), session)
+
+    def _close(self, instance: _Instance, reason: str) -> None:
+        logger.info("%s: closing instance %s after %s uses (%s)", self.name, instance.id, instance.uses, reason)
+        try:
+            instance.session.close()
+        except Exception as e:
+            logger.error("%s: error closing instance %s: %s", self.name, instance.id, e)
+
+    def warm(self) -> None:
+        """Open instances until the pool is full (startup, before the first request)."""
+        while True:
+            with self._condition:
+                if self._closed or len(self._idle) + len(self._leased) + self._opening >= self.size:
+                    return
+                self._opening += 1
+            instance = self._create()
+            with self._condition:
+                self._idle.append(instance)
+                self._condition.notify()
+
+    def _expire_leases(self) -> None:
+        """Give up on leases held longer than lease_timeout (called with the lock held)."""
+        if not self.lease_timeout:
+            return
+        now = time.monotonic()
+        for instance in list(self._leased.values()):
+            if now - instance.leased_at > self.lease_timeout:
+                # La place est libérée ; l'instance sera fermée quand (et si) elle revient
+                instance.expired = True
+                del self._leased[instance.id]
+                self.expired_leases += 1
+                logger.warning("%s: lease of instance %s expired after %ss", self.name, instance.id, self.lease_timeout)
+
+    # -- prêt -------------------------------------------------------------
+
+    def _acquire(self) -> _Instance:
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            candidate = None
+            with self._condition:
+                while candidate is None:
+                    if self._closed:
+                        raise PoolClosed(f"{self.name} is closed")
+                    self._expire_leases()
+                    if self._idle:
+                        candidate = self._idle.popleft()
+                        candidate.leased_at = time.monotonic()
+                        self._leased[candidate.id] = candidate
+                    elif len(self._leased) + self._opening < self.size:
+                        self._opening += 1
+                        break
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.acquire_timeouts += 1
+                            raise LeaseTimeout(f"No {self.name} instance available within {self.acquire_timeout}s")
+                        self._condition.wait(remaining)
+            if candidate is None:
+                # Ouverture hors verrou (plusieurs secondes pour Excel)
+                candidate = self._create()
+                with self._condition:
+                    candidate.leased_at = time.monotonic()
+                    self._leased[candidate.id] = candidate
+                return candidate
+            if self._is_healthy(candidate):
+                return candidate
+            with self._condition:
+                self._leased.pop(candidate.id, None)
+                self.unhealthy += 1
+                self._condition.notify()
+            self._close(candidate, "failed health check")
+
+    def _is_healthy(self, instance: _Instance) -> bool:
+        try:
+            return bool(instance.session.healthy())
+        except Exception:
+            return False
+
+    def _release(self, instance: _Instance) -> None:
+        instance.uses += 1
+        reason = None
+        if instance.expired:
+            reason = "lease expired"
+        elif instance.failed:
+            reason = "evaluation failed"
+        elif self.max_uses and instance.uses >= self.max_uses:
+            reason = "max uses reached"
+        else:
+            try:
+                instance.session.reset()
+            except Exception as e:
+                logger.warning("%s: cannot reset instance %s: %s", self.name, instance.id, e)
+                reason = "reset failed"
+        with self._condition:
+            if not instance.expired:
+                self._leased.pop(instance.id, None)
+            if reason is None and self._closed:
+                reason = "pool closed"
+            if reason is None:
+                self._idle.append(instance)
+            else:
+                self.recycled += 1
+                self.failures += instance.failed
+            self._condition.notify()
+        if reason is not None:
+            self._close(instance, reason)
+
+    @contextmanager
+    def lease(self) -> Iterator[Any]:
+        """Borrow an instance for the duration of the block."""
+        with span("lease_wait"):
+            instance = self._acquire()
+        try:
+            yield instance.session
+        except BaseException:
+            instance.failed = True
+            raise
+        finally:
+            self._release(instance)
+
+    # -- administration ---------------------------------------------------
+
+    def close(self) -> None:
+        """Close idle instances now; leased ones are closed when released."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._condition.notify_all()
+        for instance in idle:
+            self._close(instance, "pool closed")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "leased": len(self._leased),
+                "opening": self._opening,
+                "max_uses": self.max_uses,
+                "acquire_timeout_seconds": self.acquire_timeout,
+                "lease_timeout_seconds": self.lease_timeout,
+                "created": self.created,
+                "recycled": self.recycled,
+                "unhealthy": self.unhealthy,
+                "failures": self.failures,
+                "expired_leases": self.expired_leases,
+                "acquire_timeouts": self.acquire_timeouts,
+                "closed": self._closed,
+            }
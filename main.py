@@ -1,19 +1,65 @@
-from fastapi import FastAPI, HTTPException, Query
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from starlette.datastructures import UploadFile
+import itertools
+import json
+import math
 import os
-import tempfile
-import shutil
-from typing import Optional, Dict, List
+from urllib.parse import parse_qsl
+from typing import Optional, Dict, List, Tuple, Union
 import logging
 import sys
 import time
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+from artifact_cache import ArtifactCache
+from backends import BackendUnavailable, CalculationBackend, NativeBackend, PooledBackend, create_backend
+from cell_mapping import GOAL_SEEK_CHANGING, GOAL_SEEK_TARGET, build_inputs
+from communes import Commune, CommuneIndex, display_code, normalize_code
+from formula_engine import WorkbookModel, is_error
+from http_cache import CompressLargeResponses, etag_for, etag_matches
+from metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, ProfileStore, mark, span, tracing
+from result_cache import MISSING, ResultCache, canonical_number
+from shadow import ShadowRunner
+from single_flight import SingleFlight
+from solver import SolverError, goal_seek_batch, solve_tjm
+from structured_logging import parse_sample_rates, request_context, request_id_from, setup_logging
+from templates import CALCULATION_SHEET, TEMPLATE_SHEET, Template, TemplateNotFound, TemplateRegistry
+from uploads import UploadError, csv_text, read_upload
+from warmup import Warmup
+from worker_pool import PoolSaturated, PoolTimeout, WorkerPool
+
+# Configure logging : écriture par un thread dédié (file bornée), JSON par défaut
+# (PORTALIA_LOG_FORMAT=text pour l'ancien format), échantillonnage par niveau
+# (PORTALIA_LOG_SAMPLING="DEBUG=0.01,INFO=0.1"), une ligne de synthèse par requête
+LOGGING = setup_logging(
+    level=os.environ.get("PORTALIA_LOG_LEVEL", "INFO"),
+    json_format=os.environ.get("PORTALIA_LOG_FORMAT", "json").lower() == "json",
+    sample_rates=parse_sample_rates(os.environ.get("PORTALIA_LOG_SAMPLING", "")),
+    queue_size=int(os.environ.get("PORTALIA_LOG_QUEUE_SIZE", "10000")),
+    exempt=("portalia.requests",),
+)
 logger = logging.getLogger(__name__)
+request_logger = logging.getLogger("portalia.requests")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Préchauffage en arrière-plan (templates, index des communes, scénarios
+    # fréquents) : /health/ready répond 200 une fois terminé
+    WARMUP.start()
+    TEMPLATE_REGISTRY.start_watching(TEMPLATE_POLL_SECONDS)
+    yield
+    WARMUP.stop()
+    TEMPLATE_REGISTRY.stop_watching()
+    if SHADOW is not None:
+        SHADOW.shutdown()
+    WORKER_POOL.shutdown()
+    if isinstance(BACKEND, PooledBackend):
+        BACKEND.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -24,11 +70,158 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Path to the Excel template - mise à jour pour 2025
+# Compression gzip des réponses /convert/batch au-delà de PORTALIA_GZIP_MIN_SIZE octets ; /convert/grid et
+# /convert/upload sont diffusés au fil du calcul et GZipMiddleware retiendrait leurs blocs, ils ne sont pas compressés
+GZIP_MIN_SIZE = int(os.environ.get("PORTALIA_GZIP_MIN_SIZE", "1024"))
+app.add_middleware(
+    CompressLargeResponses,
+    paths=("/convert/batch",),
+    minimum_size=GZIP_MIN_SIZE,
+)
+
+# En-tête Cache-Control des réponses /convert et /fallback-convert (accompagnées d'un ETag)
+CACHE_CONTROL = os.environ.get("PORTALIA_CACHE_CONTROL", "public, max-age=300")
+
+# Path to the Excel template - mise à jour pour 2025 (template par défaut, les autres .xlsm restent disponibles)
 EXCEL_TEMPLATE_PATH = "PORTALIA MC2 CONSULTANTS 2025 V012025.xlsm"
 
-# Cache pour les codes communes pour éviter de relire le fichier Excel à chaque fois
-COMMUNE_CODES_CACHE: Dict[str, List[str]] = {}
+# Backend de calcul : "native" (moteur Python, sans Excel), "excel" (xlwings) ou "fake" (tests)
+CALCULATION_BACKEND = os.environ.get("PORTALIA_BACKEND", "native").lower()
+NATIVE_BACKEND = NativeBackend()
+BACKEND = NATIVE_BACKEND if CALCULATION_BACKEND == "native" else create_backend(CALCULATION_BACKEND)
+
+# Instances préchauffées du backend (classeurs Excel ouverts et réutilisés) ; 0 = une instance par requête
+WARM_INSTANCES = int(os.environ.get("PORTALIA_WARM_INSTANCES", "0"))
+if WARM_INSTANCES > 0:
+    BACKEND = PooledBackend(
+        BACKEND,
+        size=WARM_INSTANCES,
+        max_uses=int(os.environ.get("PORTALIA_INSTANCE_MAX_USES", "200")),
+        acquire_timeout=float(os.environ.get("PORTALIA_LEASE_TIMEOUT", "30")),
+        lease_timeout=float(os.environ.get("PORTALIA_MAX_LEASE_SECONDS", "120")),
+    )
+
+# Artefacts (index communes, modèle compilé) persistés sur disque par hash SHA-256 du template
+ARTIFACT_CACHE = ArtifactCache()
+
+# Templates .xlsm du répertoire (un par millésime), avec leur index des communes ;
+# la feuille tauxTransport de chaque template est détectée automatiquement
+TEMPLATE_REGISTRY = TemplateRegistry(".", default=EXCEL_TEMPLATE_PATH, artifact_cache=ARTIFACT_CACHE)
+
+# Intervalle de surveillance des fichiers templates (0 pour désactiver le rechargement à chaud)
+TEMPLATE_POLL_SECONDS = float(os.environ.get("PORTALIA_TEMPLATE_POLL_SECONDS", "5"))
+
+# Cache LRU des réponses de /convert (taille 0 pour le désactiver, TTL 0 pour ne jamais expirer)
+RESULT_CACHE = ResultCache(
+    max_entries=int(os.environ.get("PORTALIA_RESULT_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.environ.get("PORTALIA_RESULT_CACHE_TTL", "3600")),
+)
+
+# /convert identiques simultanés regroupés sur un seul calcul (0 pour désactiver)
+CONVERT_FLIGHTS = SingleFlight(
+    enabled=os.environ.get("PORTALIA_COALESCE", "1").lower() in ('true', 't', 'yes', 'y', '1'),
+)
+
+# Mode shadow : un échantillon des /convert est rejoué en arrière-plan avec le
+# backend de référence (PORTALIA_SHADOW_BACKEND=excel ; vide pour désactiver),
+# écarts dans /metrics et entrées divergentes ajoutées au corpus de régression
+SHADOW_BACKEND = os.environ.get("PORTALIA_SHADOW_BACKEND", "").lower()
+SHADOW_ABS_TOLERANCE = float(os.environ.get("PORTALIA_SHADOW_ABS_TOLERANCE", "0.01"))
+SHADOW_REL_TOLERANCE = float(os.environ.get("PORTALIA_SHADOW_REL_TOLERANCE", "1e-6"))
+SHADOW = None
+if SHADOW_BACKEND:
+    SHADOW = ShadowRunner(
+        reference=lambda parameters: shadow_evaluate(SHADOW_REFERENCE, parameters),
+        reference_name=SHADOW_BACKEND,
+        sample_rate=float(os.environ.get("PORTALIA_SHADOW_SAMPLE", "0.05")),
+        corpus_path=os.environ.get("PORTALIA_SHADOW_CORPUS", os.path.join(".portalia_shadow", "corpus.jsonl")),
+        abs_tolerance=SHADOW_ABS_TOLERANCE,
+        rel_tolerance=SHADOW_REL_TOLERANCE,
+    )
+    SHADOW_REFERENCE = create_backend(SHADOW_BACKEND)
+
+# Pool borné pour les calculs bloquants ("thread" ou "process") : au-delà de
+# workers + file d'attente, les requêtes reçoivent 503 avec Retry-After
+WORKER_POOL = WorkerPool(
+    kind=os.environ.get("PORTALIA_POOL_KIND", "thread").lower(),
+    max_workers=int(os.environ.get("PORTALIA_POOL_WORKERS", "4")),
+    max_queue=int(os.environ.get("PORTALIA_POOL_QUEUE", "32")),
+    timeout=float(os.environ.get("PORTALIA_REQUEST_TIMEOUT", "30")),
+)
+
+# Profil par échantillonnage d'une requête : en-tête "X-Portalia-Profile: 1", résultat
+# consultable sur /admin/profiles/{id} (id renvoyé dans l'en-tête X-Portalia-Profile-Id)
+PROFILE_HEADER = "X-Portalia-Profile"
+PROFILING_ENABLED = os.environ.get("PORTALIA_PROFILING", "1").lower() in ('true', 't', 'yes', 'y', '1')
+PROFILES = ProfileStore()
+
+# Scénarios évalués au démarrage (requêtes /convert séparées par ";"), dont les
+# résultats sont placés dans le cache de résultats
+WARMUP_SCENARIOS = os.environ.get(
+    "PORTALIA_WARMUP_SCENARIOS",
+    "tjm=500&jours_travailles=18&contract_type=CDI;"
+    "tjm=600&jours_travailles=20&contract_type=CDI&ticket_restaurant=true&mutuelle=true",
+)
+
+# Identifiant de requête repris du client (ou généré) et renvoyé dans la réponse
+REQUEST_ID_HEADER = "X-Request-ID"
+
+
+def request_outcome(status_code: int, events: List[str]) -> str:
+    if status_code == 304:
+        return "not_modified"
+    if status_code >= 500:
+        return "error"
+    if status_code >= 400:
+        return "rejected"
+    return "fallback" if "fallback" in events else "ok"
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Trace par requête : durée de chaque étape (en-tête Server-Timing), métriques
+    /metrics, profil optionnel, et un enregistrement de synthèse (identifiant
+    X-Request-ID, étapes, issue) dans le journal.
+    """
+    profile = PROFILING_ENABLED and request.headers.get(PROFILE_HEADER, "").lower() in ('true', 't', 'yes', 'y', '1')
+    request_id = request_id_from(request.headers.get(REQUEST_ID_HEADER))
+    start_time = time.perf_counter()
+    with request_context(request_id), tracing(profile) as trace:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - start_time
+    response.headers[REQUEST_ID_HEADER] = request_id
+    
+    # Libellé = chemin de la route (pas l'URL brute) pour borner la cardinalité
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    REQUEST_SECONDS.observe(elapsed, method=request.method, path=path)
+    REQUESTS.inc(method=request.method, path=path, status=response.status_code)
+    trace.record()
+    
+    timings = trace.timings()
+    if timings:
+        response.headers["Server-Timing"] = ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
+    if "cells_recomputed" in trace.counts:
+        response.headers["X-Portalia-Cells-Recomputed"] = str(int(trace.counts["cells_recomputed"]))
+    if trace.profile_result is not None:
+        profile_id = PROFILES.add({"path": request.url.path, "query": request.url.query,
+                                   "elapsed_seconds": elapsed, "timings": timings, **trace.profile_result})
+        response.headers["X-Portalia-Profile-Id"] = profile_id
+    if request_logger.isEnabledFor(logging.INFO):
+        request_logger.info(
+            "%s %s %d in %.1f ms", request.method, request.url.path, response.status_code, elapsed * 1000,
+            extra={
+                "request_id": request_id,
+                "method": request.method,
+                "route": path,
+                "status": response.status_code,
+                "outcome": request_outcome(response.status_code, trace.events),
+                "duration_ms": round(elapsed * 1000, 3),
+                "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()},
+                "events": trace.events,
+                "counts": trace.counts,
+            })
+    return response
 
 @app.get("/")
 def read_root():
@@ -53,67 +246,90 @@ def get_excel_info():
     }
     return info
 
-def is_commune_code_valid(code_commune: str, transport_sheet) -> bool:
+def get_template(template: Optional[str] = None, year: Optional[int] = None) -> Template:
+    """Template choisi par nom de fichier ou millésime (par défaut : EXCEL_TEMPLATE_PATH)."""
+    try:
+        return TEMPLATE_REGISTRY.get(template, year)
+    except TemplateNotFound as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+def get_commune_index(selected: Optional[Template] = None) -> CommuneIndex:
+    """Index des codes communes du template (lu une seule fois, sans Excel)."""
+    return (selected or get_template()).communes
+
+def is_commune_code_valid(code_commune: str, selected: Optional[Template] = None) -> bool:
     """
-    Vérifier si le code commune est valide en utilisant un cache et une recherche optimisée.
+    Vérifier si le code commune est valide : les codes sont normalisés une fois
+    au chargement, la recherche est une simple consultation de dictionnaire.
     """
-    # Format the cache key based on sheet name or other identifier
-    cache_key = "transport_codes"
-    
-    # Check if communes are already cached
-    if cache_key not in COMMUNE_CODES_CACHE:
-        try:
-            # This is the first time, load all codes at once and cache them
-            logger.info("Loading commune codes into cache")
-            start_time = time.time()
-            
-            # Get the used range
-            used_range = transport_sheet.used_range
-            last_row = used_range.last_cell.row
-            
-            # Read codes in chunks for better performance
-            codes_list = []
-            chunk_size = 100
-            
-            for start_row in range(2, last_row + 1, chunk_size):
-                end_row = min(start_row + chunk_size - 1, last_row)
-                cell_range = f"A{start_row}:A{end_row}"
-                
-                # Read the chunk of values
-                chunk_values = transport_sheet.range(cell_range).value
-                
-                # Handle single value case
-                if not isinstance(chunk_values, list):
-                    chunk_values = [chunk_values]
-                
-                # Process the values from the chunk
-                for value in chunk_values:
-                    if value is not None:
-                        normalized_code = str(value).strip()
-                        codes_list.append(normalized_code)
-            
-            COMMUNE_CODES_CACHE[cache_key] = codes_list
-            logger.info(f"Cached {len(codes_list)} commune codes in {time.time() - start_time:.2f} seconds")
-        except Exception as e:
-            logger.error(f"Error loading commune codes into cache: {str(e)}")
-            return False
-    
-    # Now check if the provided code is in the cached list
-    normalized_user_code = str(code_commune).strip().lstrip('0')
-    
-    # Direct lookup first (faster)
-    if normalized_user_code in COMMUNE_CODES_CACHE[cache_key]:
-        return True
-    
-    # Check with split (for codes with decimal points)
-    for code in COMMUNE_CODES_CACHE[cache_key]:
-        if normalized_user_code == code.split('.')[0]:
-            return True
-    
-    return False
+    try:
+        return code_commune in get_commune_index(selected)
+    except Exception as e:
+        logger.error(f"Error loading commune codes into cache: {str(e)}")
+        return False
+
+def convert_cache_key(
+    template_hash: str,
+    tjm: float,
+    jours_travailles: int,
+    contract_type: Optional[str],
+    frais_fonctionnement: Optional[float],
+    frais_gestion: Optional[float],
+    provision_negocier: Optional[float],
+    ticket_restaurant: bool,
+    mutuelle: bool,
+    code_commune: Optional[str]
+):
+    """
+    Clé de cache d'une simulation : paramètres normalisés (flottants arrondis,
+    booléens déjà convertis, code commune normalisé) + hash du template et
+    backend, pour qu'un nouveau template n'utilise jamais d'anciens résultats.
+    valeur_j9 n'intervient pas dans le calcul et n'en fait donc pas partie.
+    """
+    return (
+        template_hash,
+        CALCULATION_BACKEND,
+        canonical_number(tjm),
+        int(jours_travailles),
+        contract_type,
+        canonical_number(frais_fonctionnement),
+        canonical_number(frais_gestion),
+        canonical_number(provision_negocier),
+        bool(ticket_restaurant),
+        bool(mutuelle),
+        normalize_code(code_commune) if code_commune else None,
+    )
+
+async def run_blocking(function, *args, **kwargs):
+    """Exécute un calcul bloquant dans WORKER_POOL (503 si le pool est saturé, 504 après le délai)."""
+    try:
+        return await WORKER_POOL.run(function, *args, **kwargs)
+    except PoolSaturated as e:
+        logger.warning("Worker pool saturated, request rejected (retry after %ss)", e.retry_after)
+        raise HTTPException(status_code=503, detail="Server busy, please retry later",
+                            headers={"Retry-After": str(e.retry_after)})
+    except PoolTimeout as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=504, detail=str(e))
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Réponse 304 si le client possède déjà la représentation ``etag`` (If-None-Match)."""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        mark("not_modified")
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    return None
+
+def set_validators(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+# Sans jour travaillé, le GoalSeek B12 -> J4 n'a pas de solution
+JOURS_TRAVAILLES_ERROR = "jours_travailles must be greater than 0"
 
 @app.get("/convert")
 async def convert(
+    request: Request,
+    response: Response,
     tjm: Optional[float] = Query(None),
     jours_travailles: Optional[int] = Query(None),
     contract_type: Optional[str] = Query(None),
@@ -123,14 +339,15 @@ async def convert(
     ticket_restaurant: Optional[str] = Query(None),
     mutuelle: Optional[str] = Query(None),
     code_commune: Optional[str] = Query(None),
-    valeur_j9: Optional[str] = Query(None)
+    valeur_j9: Optional[str] = Query(None),
+    year: Optional[int] = Query(None),
+    template: Optional[str] = Query(None)
 ):
-    # Log the received parameters
-    logger.info(f"Received parameters: tjm={tjm}, jours_travailles={jours_travailles}, " +
-                f"contract_type={contract_type}, frais_fonctionnement={frais_fonctionnement}, " +
-                f"frais_gestion={frais_gestion}, provision_negocier={provision_negocier}, " +
-                f"ticket_restaurant={ticket_restaurant}, mutuelle={mutuelle}, code_commune={code_commune}, " +
-                f"valeur_j9={valeur_j9}")
+    # Log the received parameters (formaté seulement si DEBUG est actif)
+    logger.debug("Received parameters: tjm=%s, jours_travailles=%s, contract_type=%s, frais_fonctionnement=%s, "
+                 "frais_gestion=%s, provision_negocier=%s, ticket_restaurant=%s, mutuelle=%s, code_commune=%s, "
+                 "valeur_j9=%s, year=%s, template=%s", tjm, jours_travailles, contract_type, frais_fonctionnement,
+                 frais_gestion, provision_negocier, ticket_restaurant, mutuelle, code_commune, valeur_j9, year, template)
     
     # Convert string boolean parameters to actual booleans
     ticket_restaurant_bool = str_to_bool(ticket_restaurant) if ticket_restaurant is not None else False
@@ -141,418 +358,1000 @@ async def convert(
         error_msg = "TJM and jours_travailles are required"
         logger.error(error_msg)
         raise HTTPException(status_code=400, detail=error_msg)
+    if jours_travailles <= 0:
+        error_msg = JOURS_TRAVAILLES_ERROR
+        logger.error(error_msg)
+        raise HTTPException(status_code=400, detail=error_msg)
+    
+    selected = get_template(template, year)
     
     # Check if Excel file exists
-    if not os.path.exists(EXCEL_TEMPLATE_PATH):
-        error_msg = f"Excel template file not found: {EXCEL_TEMPLATE_PATH}"
+    if not os.path.exists(selected.path):
+        error_msg = f"Excel template file not found: {selected.path}"
         logger.error(error_msg)
         files_in_dir = ", ".join([f for f in os.listdir('.') if f.endswith('.xlsm') or f.endswith('.xlsx')])
         error_msg += f". Available Excel files: {files_in_dir}"
         raise HTTPException(status_code=500, detail=error_msg)
     
-    # Import xlwings here to avoid startup errors if Excel is not available
-    try:
-        import xlwings as xw
-    except ImportError:
-        error_msg = "xlwings module not installed. Please install it with: pip install xlwings"
-        logger.error(error_msg)
-        raise HTTPException(status_code=500, detail=error_msg)
+    cache_key = convert_cache_key(selected.template_hash, tjm, jours_travailles, contract_type, frais_fonctionnement, frais_gestion,
+                                  provision_negocier, ticket_restaurant_bool, mutuelle_bool, code_commune)
+    # Réponse déterminée par la clé : 304 avant toute évaluation si le client l'a déjà
+    etag = etag_for(cache_key)
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    cached = RESULT_CACHE.get(cache_key)
+    if cached is not MISSING:
+        logger.debug("Result served from cache")
+        set_validators(response, etag)
+        return cached
+    
+    async def compute():
+        # Calcul hors de la boucle d'événements ; le template est transmis par son nom (mode process)
+        result = await run_blocking(run_convert, tjm, jours_travailles, contract_type, frais_fonctionnement,
+                                    frais_gestion, provision_negocier, ticket_restaurant_bool, mutuelle_bool,
+                                    code_commune, selected.name)
+        # Seuls les vrais résultats sont mémorisés (pas les erreurs ni les valeurs de repli)
+        if isinstance(result, dict) and "note" not in result:
+            RESULT_CACHE.put(cache_key, result)
+            if SHADOW is not None:
+                SHADOW.submit({
+                    "tjm": tjm,
+                    "jours_travailles": jours_travailles,
+                    "contract_type": contract_type,
+                    "frais_fonctionnement": frais_fonctionnement,
+                    "frais_gestion": frais_gestion,
+                    "provision_negocier": provision_negocier,
+                    "ticket_restaurant": ticket_restaurant_bool,
+                    "mutuelle": mutuelle_bool,
+                    "code_commune": code_commune,
+                    "template": selected.name,
+                }, result)
+        return result
+    
+    # Requêtes identiques simultanées : un seul calcul, partagé
+    result = await CONVERT_FLIGHTS.run(cache_key, compute)
+    if isinstance(result, dict):
+        if "note" in result:
+            # Valeurs de repli : ni validateur ni mise en cache par le client
+            response.headers["Cache-Control"] = "no-store"
+        else:
+            set_validators(response, etag)
+    return result
 
-    try:
-        logger.info(f"Starting Excel processing with TJM={tjm}, jours={jours_travailles}")
-        
-        # Create a temporary copy of the template
-        temp_dir = tempfile.mkdtemp()
-        temp_excel_path = os.path.join(temp_dir, "temp_calculation.xlsm")
-        shutil.copy2(EXCEL_TEMPLATE_PATH, temp_excel_path)
-        logger.info(f"Copied template to {temp_excel_path}")
-        
-        # Open the Excel file with xlwings - with events enabled
-        app_excel = xw.App(visible=False, enable_events=True)
-        app_excel.display_alerts = False
-        app_excel.screen_updating = False
-        
-        # Try to open with specified path
-        try:
-            logger.info(f"Attempting to open Excel file: {temp_excel_path}")
-            wb = app_excel.books.open(temp_excel_path)
-            logger.info("Excel file opened successfully")
-        except Exception as e:
-            logger.error(f"Error opening Excel with absolute path: {str(e)}")
-            return fallback_convert(
-                tjm=tjm,
-                jours_travailles=jours_travailles,
-                contract_type=contract_type,
-                frais_gestion=frais_gestion if frais_gestion is not None else 0,
-                provision_negocier=provision_negocier if provision_negocier is not None else 0,
-                ticket_restaurant=ticket_restaurant_bool,
-                mutuelle=mutuelle_bool
-            )
+def run_convert(
+    tjm: float,
+    jours_travailles: int,
+    contract_type: Optional[str],
+    frais_fonctionnement: Optional[float],
+    frais_gestion: Optional[float],
+    provision_negocier: Optional[float],
+    ticket_restaurant_bool: bool,
+    mutuelle_bool: bool,
+    code_commune: Optional[str],
+    template_name: str
+):
+    """Partie bloquante de /convert (backend configuré), exécutée dans WORKER_POOL."""
+    return convert_with_backend(
+        BACKEND,
+        tjm=tjm,
+        jours_travailles=jours_travailles,
+        contract_type=contract_type,
+        frais_fonctionnement=frais_fonctionnement,
+        frais_gestion=frais_gestion,
+        provision_negocier=provision_negocier,
+        ticket_restaurant=ticket_restaurant_bool,
+        mutuelle=mutuelle_bool,
+        code_commune=code_commune,
+        selected=get_template(template_name)
+    )
 
-        try:
-            # Get all sheet names for debugging
-            sheet_names = [sheet.name for sheet in wb.sheets]
-            logger.info(f"Excel sheets: {sheet_names}")
-            
-            # Look for the calculation sheet - try multiple possible names
-            calculation_sheet_name = "1. Calcul Avec prov"
-            if calculation_sheet_name not in sheet_names:
-                for sheet_name in sheet_names:
-                    if "calcul" in sheet_name.lower():
-                        calculation_sheet_name = sheet_name
-                        logger.info(f"Using alternative calculation sheet: {calculation_sheet_name}")
-                        break
-            
-            # Access the calculation sheet
-            ws = wb.sheets[calculation_sheet_name]
-            
-            # Fill in the data
-            logger.info("Setting values in Excel...")
-            
-            # Initialiser la cellule B4 avec une valeur appropriée pour que GoalSeek fonctionne
-            ws.range("B4").value = "BRUT"
-            logger.info("Initialized cell B4 with value 'BRUT'")
-            
-            # Taux journalier
-            ws.range("J4").value = tjm
-            logger.info(f"Set TJM to {tjm} in cell J4")
-            
-            # Jours travaillés
-            ws.range("J5").value = jours_travailles
-            logger.info(f"Set jours travaillés to {jours_travailles} in cell J5")
-            
-            # Handle contract type
-            if contract_type == "CDI":
-                ws.range("J8").value = 0.02  # Fin de mission
-                ws.range("J9").value = 0.1   # Montant congés payés
-                ws.range("J10").value = 0    # Précarité
-                
-                # Ajouter la provision à négocier si elle est fournie
-                if provision_negocier is not None:
-                    ws.range("J11").value = provision_negocier / 100  # Convertir en format décimal pour Excel
-                    logger.info(f"Set provision à négocier to {provision_negocier/100} in cell J11")
-                
-                logger.info(f"Set contract type to CDI")
-            elif contract_type == "CDD":
-                ws.range("J8").value = 0     # Fin de mission
-                ws.range("J9").value = 0     # Montant congés payés
-                ws.range("J10").value = 0.1  # Précarité
-                logger.info("Set contract type to CDD")
-            
-            # Handle frais de gestion (J7)
-            if frais_gestion is not None:
-                ws.range("J7").value = frais_gestion / 100  # Diviser par 100 pour le format décimal
-                logger.info(f"Set frais de gestion to {frais_gestion/100} in cell J7")
-            
-            # Handle frais de fonctionnement
-            if frais_fonctionnement is not None:
-                ws.range("J12").value = frais_fonctionnement  # Ne pas multiplier par 100
-                logger.info(f"Set frais de fonctionnement to {frais_fonctionnement} in cell J12")
-            
-            # Handle ticket restaurant
-            if ticket_restaurant_bool:
-                ws.range("J21").value = jours_travailles * 11
-                logger.info("Enabled ticket restaurant in cell J21")
-            else:
-                ws.range("J21").value = 0
-                logger.info("Disabled ticket restaurant in cell J21")
-            
-            # Handle mutuelle
-            if mutuelle_bool:
-                ws.range("J17").value = "Oui"
-                logger.info("Set mutuelle to 'Oui' in cell J17")
-            else:
-                ws.range("J17").value = "Non"
-                logger.info("Set mutuelle to 'Non' in cell J17")
-            
-            # Handle code commune avec optimisation
-            if code_commune:
-                try:
-                    # Vérifier d'abord si la feuille tauxTransport existe
-                    transport_sheet_name = "tauxTransport 2025"  # Mise à jour pour 2025
-                    
-                    if transport_sheet_name in sheet_names:
-                        transport_sheet = wb.sheets[transport_sheet_name]
-                        
-                        # Vérifier si le code commune est valide avec la méthode optimisée
-                        start_time = time.time()
-                        
-                        if is_commune_code_valid(code_commune, transport_sheet):
-                            logger.info(f"Code commune '{code_commune}' est valide")
-                            ws.range("J25").value = code_commune
-                            logger.info(f"Code commune appliqué dans cell J25")
-                        else:
-                            logger.warning(f"Code commune '{code_commune}' NON TROUVÉ dans la liste")
-                            
-                            # Lève une exception avec un message personnalisé
-                            from fastapi.responses import JSONResponse
-                            return JSONResponse(
-                                status_code=400,
-                                content={"message": "Le code Commune n'est pas dans la base de données"}
-                            )
-                            
-                        end_time = time.time()
-                        logger.info(f"Temps de vérification du code commune: {end_time - start_time:.2f} secondes")
-                    else:
-                        logger.warning(f"Feuille des taux de transport '{transport_sheet_name}' non trouvée, impossible de vérifier le code commune")
-                except Exception as e:
-                    logger.error(f"Erreur générale lors du traitement du code commune: {str(e)}")
-            
-            # Force calculation
-            logger.info("Forcing Excel calculation...")
-            wb.app.calculate()
-            
-            # Try to run the macro if it exists
-            try:
-                logger.info("Attempting to run macro...")
-                
-                # Implement TJM macro functionality directly to avoid errors
-                ws.range("B12").value = tjm  # Valeur journalière = TJM
-                ws.range("B10").value = tjm * jours_travailles  # Brut annuel = TJM * jours
-                
-                # Then try to run the actual macro - with error handling
-                try:
-                    wb.macro("TJM")()
-                    logger.info("Successfully ran TJM macro")
-                except Exception as e:
-                    logger.warning(f"Error running TJM macro, but values were set directly: {str(e)}")
-                    
-                # Force calculation again to make sure all formulas are updated
-                wb.app.calculate()
-                
-                # Try to run the UpdateTemplate macro if it exists
-                try:
-                    wb.macro("UpdateTemplate")()
-                    logger.info("Successfully ran UpdateTemplate macro")
-                except Exception as e:
-                    logger.warning(f"Error running UpdateTemplate macro: {str(e)}")
-                    # Try other common macro names
-                    for macro_name in ["MAJ", "Calculate"]:
-                        try:
-                            wb.macro(macro_name)()
-                            logger.info(f"Successfully ran {macro_name} macro")
-                            break
-                        except Exception as e2:
-                            logger.warning(f"Error running {macro_name} macro: {str(e2)}")
-                
-                # Force calculation again
-                wb.app.calculate()
-                
-            except Exception as e:
-                logger.warning(f"Error in macro execution section: {str(e)}")
-            
-            # Look for template sheet for results
-            template_sheet_name = "3. Template"
-            if template_sheet_name not in sheet_names:
-                for possible_name in ["Template", "Résultats", "Results"]:
-                    if possible_name in sheet_names:
-                        template_sheet_name = possible_name
-                        logger.info(f"Using alternative template sheet: {template_sheet_name}")
-                        break
-                else:
-                    template_sheet_name = calculation_sheet_name
-                    logger.warning(f"Using calculation sheet as template: {template_sheet_name}")
-            
-            template_sheet = wb.sheets[template_sheet_name]
-            
-            # Debug: print values in key cells from both sheets
-            debug_cells = {
-                "template_sheet.E23": template_sheet.range("E23").value,
-                "template_sheet.E26": template_sheet.range("E26").value,
-                "template_sheet.E31": template_sheet.range("E31").value,
-                "template_sheet.E8": template_sheet.range("E8").value,
-                "calculation_sheet.B5": ws.range("B5").value,
-                "calculation_sheet.B9": ws.range("B9").value,
-                "calculation_sheet.E26": ws.range("E26").value
-            }
-            logger.info(f"Debug cell values: {debug_cells}")
-            
-            # Try to get results from different locations
-            brut_mensuel = None
-            net_mensuel = None
-            frais_gestion_result = None
-            
-            # Try Template E26 (brut mensuel)
-            if template_sheet.range("E26").value is not None:
-                brut_mensuel = template_sheet.range("E26").value
-                logger.info(f"Using E26 from template for brut_mensuel: {brut_mensuel}")
-            # Try Template E31 (net mensuel)
-            if template_sheet.range("E31").value is not None:
-                net_mensuel = template_sheet.range("E31").value
-                logger.info(f"Using E31 from template for net_mensuel: {net_mensuel}")
-            # Try Template E10 (frais gestion)
-            if template_sheet.range("E10").value is not None:
-                frais_gestion_result = template_sheet.range("E10").value
-                logger.info(f"Using E10 from template for frais_gestion: {frais_gestion_result}")
-            
-            # Get ticket and mutuelle contributions
-            ticket_contribution = template_sheet.range("E21").value if ticket_restaurant_bool else 0
-            mutuelle_contribution = template_sheet.range("E16").value if mutuelle_bool else 0
-            
-            # If template values not available, try calculation sheet
-            if brut_mensuel is None:
-                brut_mensuel = ws.range("B5").value
-                logger.info(f"Using B5 from calculation for brut_mensuel: {brut_mensuel}")
-            
-            if net_mensuel is None:
-                net_mensuel = ws.range("B9").value
-                logger.info(f"Using B9 from calculation for net_mensuel: {net_mensuel}")
-            
-            if frais_gestion_result is None:
-                frais_gestion_result = (ws.range("J7").value or 0) * brut_mensuel if brut_mensuel else 0
-                logger.info(f"Calculated frais_gestion: {frais_gestion_result}")
-                
-            # Ensure we have values even if Excel reading fails
-            if not brut_mensuel or brut_mensuel is None:
-                brut_mensuel = tjm * jours_travailles
-                logger.warning(f"Using fallback calculation for brut_mensuel: {brut_mensuel}")
-            
-            if not net_mensuel or net_mensuel is None:
-                net_mensuel = brut_mensuel * 0.75  # Approximation
-                logger.warning(f"Using fallback calculation for net_mensuel: {net_mensuel}")
-            
-            if not frais_gestion_result or frais_gestion_result is None:
-                frais_gestion_result = brut_mensuel * (frais_gestion or 0) / 100
-                logger.warning(f"Using fallback calculation for frais_gestion: {frais_gestion_result}")
-            
-            # Get Provision value
-            provision_result = 0
-            if contract_type == "CDI" and provision_negocier is not None:
-                try:
-                    provision_result = template_sheet.range("E23").value or 0
-                    if not provision_result:
-                        provision_result = brut_mensuel * (provision_negocier / 100)
-                except Exception:
-                    provision_result = brut_mensuel * (provision_negocier / 100)
-            
-            # Construct the result
-            result = {
-                "tjm": tjm,
-                "brut_mensuel": brut_mensuel,
-                "net_mensuel": net_mensuel,
-                "frais_gestion": frais_gestion_result,
-                "provision_negocier": provision_result,
-                "autres_details": {
-                    "ticket_restaurant_contribution": ticket_contribution or (jours_travailles * 5.5 if ticket_restaurant_bool else 0),
-                    "mutuelle_contribution": mutuelle_contribution or (50 if mutuelle_bool else 0),
-                }
-            }
-            
-            logger.info(f"Final result: {result}")
-            return result
-            
-        finally:
-            # Ensure proper cleanup
-            try:
-                logger.info("Cleaning up Excel resources...")
-                wb.save()
-                wb.close()
-                app_excel.quit()
-                shutil.rmtree(temp_dir)
-                logger.info("Excel cleanup completed")
-            except Exception as e:
-                logger.error(f"Error during Excel cleanup: {str(e)}")
+def get_workbook_model(selected: Optional[Template] = None) -> WorkbookModel:
+    """Modèle compilé du template (chargé une seule fois par le registre)."""
+    return (selected or get_template()).model
+
+def build_native_inputs(
+    tjm: float,
+    jours_travailles: int,
+    contract_type: Optional[str],
+    frais_fonctionnement: Optional[float],
+    frais_gestion: Optional[float],
+    provision_negocier: Optional[float],
+    ticket_restaurant: bool,
+    mutuelle: bool,
+    code_commune: Optional[str]
+) -> Dict:
+    """Cellules d'entrée J4-J25 (cf. cell_mapping.INPUT_FIELDS), sous forme {(feuille, cellule): valeur}."""
+    return build_inputs({
+        "tjm": tjm,
+        "jours_travailles": jours_travailles,
+        "contract_type": contract_type,
+        "frais_fonctionnement": frais_fonctionnement,
+        "frais_gestion": frais_gestion,
+        "provision_negocier": provision_negocier,
+        "ticket_restaurant": ticket_restaurant,
+        "mutuelle": mutuelle,
+        "code_commune": code_commune,
+    })
+
+def invalid_commune_response():
+    return JSONResponse(
+        status_code=400,
+        content={"message": "Le code Commune n'est pas dans la base de données"}
+    )
+
+def native_result(
+    values: Dict,
+    tjm: float,
+    jours_travailles: int,
+    contract_type: Optional[str],
+    frais_gestion: Optional[float],
+    provision_negocier: Optional[float],
+    ticket_restaurant: bool,
+    mutuelle: bool
+):
+    """
+    Construit la réponse de /convert à partir des résultats du template, indexés
+    comme Template.output_cells (mêmes replis que le chemin Excel).
+    """
+    values = {output: (None if is_error(value) else value) for output, value in values.items()}
+    brut_mensuel = values["brut_mensuel"] or tjm * jours_travailles
+    net_mensuel = values["net_mensuel"] or brut_mensuel * 0.75  # Approximation
+    frais_gestion_result = values["frais_gestion"] or brut_mensuel * (frais_gestion or 0) / 100
+    
+    provision_result = 0
+    if contract_type == "CDI" and provision_negocier is not None:
+        provision_result = values["provision_negocier"] or brut_mensuel * (provision_negocier / 100)
+    
+    return {
+        "tjm": tjm,
+        "brut_mensuel": brut_mensuel,
+        "net_mensuel": net_mensuel,
+        "frais_gestion": frais_gestion_result,
+        "provision_negocier": provision_result,
+        "autres_details": {
+            "ticket_restaurant_contribution": (values["ticket_restaurant"] if ticket_restaurant else 0) or (jours_travailles * 5.5 if ticket_restaurant else 0),
+            "mutuelle_contribution": (values["mutuelle"] if mutuelle else 0) or (50 if mutuelle else 0),
+        }
+    }
+
+def shadow_evaluate(backend: CalculationBackend, parameters: Dict) -> Dict:
+    """
+    Résultat /convert d'un backend pour le mode shadow : sans repli, une erreur
+    du backend est levée au lieu d'être masquée par des valeurs approchées.
+    """
+    selected = get_template(parameters.get("template"))
+    inputs = build_native_inputs(parameters["tjm"], parameters["jours_travailles"], parameters.get("contract_type"),
+                                 parameters.get("frais_fonctionnement"), parameters.get("frais_gestion"),
+                                 parameters.get("provision_negocier"), parameters.get("ticket_restaurant", False),
+                                 parameters.get("mutuelle", False), parameters.get("code_commune"))
+    values = backend.evaluate(selected, inputs)
+    return native_result(values, parameters["tjm"], parameters["jours_travailles"], parameters.get("contract_type"),
+                         parameters.get("frais_gestion"), parameters.get("provision_negocier"),
+                         parameters.get("ticket_restaurant", False), parameters.get("mutuelle", False))
+
+def convert_with_backend(
+    backend: CalculationBackend,
+    tjm: float,
+    jours_travailles: int,
+    contract_type: Optional[str],
+    frais_fonctionnement: Optional[float],
+    frais_gestion: Optional[float],
+    provision_negocier: Optional[float],
+    ticket_restaurant: bool,
+    mutuelle: bool,
+    code_commune: Optional[str],
+    selected: Optional[Template] = None
+):
+    """
+    Simulation /convert avec un backend : vérification du code commune, cellules
+    d'entrée J4-J25, résultats du template, puis mêmes replis pour tous les backends.
+    """
+    selected = selected or get_template()
+    with span("commune_check"):
+        commune_valid = not code_commune or is_commune_code_valid(code_commune, selected)
+    if not commune_valid:
+        logger.warning("Code commune '%s' NON TROUVÉ dans la liste", code_commune)
+        return invalid_commune_response()
     
+    inputs = build_native_inputs(tjm, jours_travailles, contract_type, frais_fonctionnement,
+                                 frais_gestion, provision_negocier, ticket_restaurant, mutuelle, code_commune)
+    try:
+        values = backend.evaluate(selected, inputs)
+    except BackendUnavailable as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
-        error_msg = f"Excel processing error: {str(e)}"
-        logger.error(error_msg)
+        logger.error("%s backend error: %s", backend.name.capitalize(), e)
         return fallback_convert(
             tjm=tjm,
             jours_travailles=jours_travailles,
             contract_type=contract_type,
             frais_gestion=frais_gestion if frais_gestion is not None else 0,
             provision_negocier=provision_negocier if provision_negocier is not None else 0,
-            ticket_restaurant=ticket_restaurant_bool,
-            mutuelle=mutuelle_bool
+            ticket_restaurant=ticket_restaurant,
+            mutuelle=mutuelle
         )
+    
+    return native_result(values, tjm, jours_travailles, contract_type, frais_gestion,
+                         provision_negocier, ticket_restaurant, mutuelle)
+
+def convert_native(
+    tjm: float,
+    jours_travailles: int,
+    contract_type: Optional[str],
+    frais_fonctionnement: Optional[float],
+    frais_gestion: Optional[float],
+    provision_negocier: Optional[float],
+    ticket_restaurant: bool,
+    mutuelle: bool,
+    code_commune: Optional[str],
+    selected: Optional[Template] = None
+):
+    """Simulation avec le moteur natif : mêmes cellules que le chemin Excel, sans xlwings."""
+    return convert_with_backend(NATIVE_BACKEND, tjm, jours_travailles, contract_type, frais_fonctionnement,
+                                frais_gestion, provision_negocier, ticket_restaurant, mutuelle, code_commune, selected)
+
+# Taille des blocs évalués ensemble par /convert/batch (borne la mémoire des tableaux NumPy)
+BATCH_CHUNK_SIZE = int(os.environ.get("PORTALIA_BATCH_CHUNK_SIZE", "1000"))
+
+class ConvertParameters(BaseModel):
+    """Paramètres d'une simulation, identiques aux paramètres de GET /convert."""
+    tjm: Optional[float] = None
+    jours_travailles: Optional[int] = None
+    contract_type: Optional[str] = None
+    frais_fonctionnement: Optional[float] = None
+    frais_gestion: Optional[float] = None
+    provision_negocier: Optional[float] = None
+    ticket_restaurant: Optional[Union[bool, str]] = None
+    mutuelle: Optional[Union[bool, str]] = None
+    code_commune: Optional[str] = None
+    valeur_j9: Optional[str] = None
+    year: Optional[int] = None
+    template: Optional[str] = None
+
+def evaluate_native_batch(rows: List[Dict], selected: Template) -> List[Dict]:
+    """
+    Evalue un bloc de simulations en une passe : chaque cellule d'entrée devient
+    une colonne NumPy et le GoalSeek B12 -> J4 est résolu pour toutes les lignes
+    à la fois. Renvoie, pour chaque ligne, les résultats du template, ou None
+    si le GoalSeek n'a pas convergé pour cette ligne.
+    """
+    model = get_workbook_model(selected)
+    inputs = [build_native_inputs(**row) for row in rows]
+    columns = {}
+    for key in set().union(*inputs):
+        default = model.get_value(*key)
+        values = [row_inputs.get(key, default) for row_inputs in inputs]
+        # Une entrée identique sur toutes les lignes reste scalaire (évaluée une seule fois)
+        columns[key] = values[0] if all(value == values[0] for value in values) else values
+    
+    template_cells = [(TEMPLATE_SHEET, cell) for cell in selected.output_cells.values()]
+    batch = model.batch(columns, [GOAL_SEEK_TARGET] + template_cells, size=len(rows))
+    seek = goal_seek_batch(batch, model.cell_id(*GOAL_SEEK_TARGET), [row["tjm"] for row in rows],
+                           model.cell_id(*GOAL_SEEK_CHANGING))
+    logger.debug("Batch TJM goal seek: %d rows, %d iterations, %.2f ms",
+                 len(rows), seek.iterations, seek.elapsed_seconds * 1000)
+    
+    outputs = {output: batch.get_column(model.cell_id(TEMPLATE_SHEET, cell)).tolist()
+               for output, cell in selected.output_cells.items()}
+    return [{output: values[index] for output, values in outputs.items()} if seek.converged[index] else None
+            for index in range(len(rows))]
+
+def simulate_rows(rows: List[Dict], selected: Template) -> List[Dict]:
+    """Réponses /convert d'un bloc de lignes (valeurs de repli si le moteur échoue ou ne converge pas)."""
+    try:
+        chunk_values = evaluate_native_batch(rows, selected)
+    except Exception as e:
+        logger.error("Native batch engine error: %s", e)
+        chunk_values = [None] * len(rows)
+    results = []
+    for row, values in zip(rows, chunk_values):
+        if values is None:
+            results.append(fallback_convert(
+                tjm=row["tjm"],
+                jours_travailles=row["jours_travailles"],
+                contract_type=row["contract_type"],
+                frais_gestion=row["frais_gestion"] if row["frais_gestion"] is not None else 0,
+                provision_negocier=row["provision_negocier"] if row["provision_negocier"] is not None else 0,
+                ticket_restaurant=row["ticket_restaurant"],
+                mutuelle=row["mutuelle"]
+            ))
+        else:
+            results.append(native_result(values, row["tjm"], row["jours_travailles"], row["contract_type"],
+                                         row["frais_gestion"], row["provision_negocier"],
+                                         row["ticket_restaurant"], row["mutuelle"]))
+    return results
+
+def simulate_chunk(rows: List[Dict], template_name: str) -> List[Dict]:
+    """Partie bloquante d'un bloc de /convert/grid, exécutée dans WORKER_POOL (template transmis par son nom)."""
+    return simulate_rows(rows, get_template(template_name))
+
+@app.post("/convert/batch")
+async def convert_batch(items: List[ConvertParameters]):
+    """
+    Simulations multiples en un seul appel (moteur natif, évaluation vectorisée).
+    Les résultats sont renvoyés dans l'ordre de la requête ; une ligne invalide
+    (paramètres manquants, code commune inconnu) donne une erreur pour cette
+    ligne uniquement.
+    """
+    return await run_blocking(simulate_batch, items)
+
+def simulate_batch(items: List[ConvertParameters]) -> List[Optional[Dict]]:
+    """Partie bloquante de /convert/batch, exécutée dans WORKER_POOL."""
+    start_time = time.time()
+    results: List[Optional[Dict]] = [None] * len(items)
+    # Lignes valides regroupées par template : {nom: (template, lignes, positions)}
+    groups: Dict[str, tuple] = {}
+    for position, item in enumerate(items):
+        if item.tjm is None or item.jours_travailles is None:
+            results[position] = {"status_code": 400, "message": "TJM and jours_travailles are required"}
+            continue
+        if item.jours_travailles <= 0:
+            results[position] = {"status_code": 400, "message": JOURS_TRAVAILLES_ERROR}
+            continue
+        try:
+            selected = TEMPLATE_REGISTRY.get(item.template, item.year)
+        except TemplateNotFound as e:
+            results[position] = {"status_code": 404, "message": e.args[0]}
+            continue
+        if item.code_commune and not is_commune_code_valid(item.code_commune, selected):
+            results[position] = {"status_code": 400, "message": "Le code Commune n'est pas dans la base de données"}
+            continue
+        _, rows, positions = groups.setdefault(selected.name, (selected, [], []))
+        rows.append({
+            "tjm": item.tjm,
+            "jours_travailles": item.jours_travailles,
+            "contract_type": item.contract_type,
+            "frais_fonctionnement": item.frais_fonctionnement,
+            "frais_gestion": item.frais_gestion,
+            "provision_negocier": item.provision_negocier,
+            "ticket_restaurant": str_to_bool(str(item.ticket_restaurant)) if item.ticket_restaurant is not None else False,
+            "mutuelle": str_to_bool(str(item.mutuelle)) if item.mutuelle is not None else False,
+            "code_commune": item.code_commune,
+        })
+        positions.append(position)
+    
+    for selected, rows, positions in groups.values():
+        for start in range(0, len(rows), BATCH_CHUNK_SIZE):
+            for offset, result in enumerate(simulate_rows(rows[start:start + BATCH_CHUNK_SIZE], selected)):
+                results[positions[start + offset]] = result
+    
+    valid = sum(len(rows) for _, rows, _ in groups.values())
+    logger.info("Batch of %d simulations (%s valid) in %.3f seconds", len(items), valid, time.time() - start_time)
+    return results
+
+# Balayage /convert/grid : nombre maximal de points et taille du premier bloc (premières lignes rapides)
+GRID_MAX_POINTS = int(os.environ.get("PORTALIA_GRID_MAX_POINTS", "100000"))
+GRID_FIRST_CHUNK_SIZE = 64
+
+def finite(text: str) -> float:
+    """float(text), en refusant nan et inf (non représentables en JSON)."""
+    value = float(text)
+    if not math.isfinite(value):
+        raise ValueError(f"Not a finite number: {text}")
+    return value
+
+def parse_grid_range(name: str, spec: Optional[str], integer: bool = False) -> List[Optional[float]]:
+    """
+    Valeurs d'un axe du balayage : "400:800:50" (début:fin:pas, fin incluse),
+    "400,500,650" (liste) ou une valeur unique. Sans valeur, l'axe est [None].
+    """
+    if spec is None or spec.strip() == "":
+        return [None]
+    cast = int if integer else float
+    try:
+        if ":" in spec:
+            start, stop, step = (finite(part) for part in spec.split(":"))
+            if step <= 0 or stop < start:
+                raise ValueError
+            count = int((stop - start) / step + 1e-9) + 1
+            if count > GRID_MAX_POINTS:
+                raise HTTPException(status_code=400, detail=f"Too many values for {name}")
+            return [cast(start + index * step) for index in range(count)]
+        return [cast(finite(part)) for part in spec.split(",")]
+    except (ValueError, OverflowError):
+        raise HTTPException(status_code=400, detail=f"Invalid range for {name}: '{spec}' (expected start:stop:step or a list)")
+
+@app.get("/convert/grid")
+async def convert_grid(
+    tjm: str = Query(...),
+    jours_travailles: str = Query(...),
+    frais_gestion: Optional[str] = Query(None),
+    provision_negocier: Optional[str] = Query(None),
+    contract_type: Optional[str] = Query(None),
+    frais_fonctionnement: Optional[float] = Query(None),
+    ticket_restaurant: Optional[str] = Query(None),
+    mutuelle: Optional[str] = Query(None),
+    code_commune: Optional[str] = Query(None),
+    year: Optional[int] = Query(None),
+    template: Optional[str] = Query(None)
+):
+    """
+    Balayage de sensibilité : produit cartésien des axes tjm x jours_travailles
+    (x frais_gestion x provision_negocier), évalué par blocs vectorisés dans
+    WORKER_POOL et renvoyé en NDJSON (une ligne JSON par point) au fil du calcul.
+    """
+    axes = [
+        parse_grid_range("tjm", tjm),
+        parse_grid_range("jours_travailles", jours_travailles, integer=True),
+        parse_grid_range("frais_gestion", frais_gestion),
+        parse_grid_range("provision_negocier", provision_negocier),
+    ]
+    if any(value is None or value <= 0 for value in axes[1]):
+        raise HTTPException(status_code=400, detail=JOURS_TRAVAILLES_ERROR)
+    total = 1
+    for axis in axes:
+        total *= len(axis)
+    if total > GRID_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Grid has {total} points, maximum is {GRID_MAX_POINTS}")
+    selected = get_template(template, year)
+    if code_commune and not is_commune_code_valid(code_commune, selected):
+        return invalid_commune_response()
+    
+    ticket_restaurant_bool = str_to_bool(ticket_restaurant) if ticket_restaurant is not None else False
+    mutuelle_bool = str_to_bool(mutuelle) if mutuelle is not None else False
+    
+    def rows():
+        for tjm_value, jours_value, frais_value, provision_value in itertools.product(*axes):
+            yield {
+                "tjm": tjm_value,
+                "jours_travailles": jours_value,
+                "contract_type": contract_type,
+                "frais_fonctionnement": frais_fonctionnement,
+                "frais_gestion": frais_value,
+                "provision_negocier": provision_value,
+                "ticket_restaurant": ticket_restaurant_bool,
+                "mutuelle": mutuelle_bool,
+                "code_commune": code_commune,
+            }
+    
+    async def stream():
+        start_time = time.time()
+        points = rows()
+        index = 0
+        chunk_size = GRID_FIRST_CHUNK_SIZE
+        # Un seul bloc en mémoire à la fois : la mémoire ne dépend pas de la taille de la grille
+        while True:
+            chunk = list(itertools.islice(points, chunk_size))
+            if not chunk:
+                break
+            try:
+                results = await run_blocking(simulate_chunk, chunk, selected.name)
+            except HTTPException as e:
+                # Statut déjà envoyé : l'erreur (503, 504) termine le flux sur une dernière ligne
+                yield json.dumps({"index": index, "status_code": e.status_code, "message": e.detail}) + "\n"
+                return
+            lines = []
+            for row, result in zip(chunk, results):
+                line = {"index": index, "jours_travailles": row["jours_travailles"],
+                        "taux_frais_gestion": row["frais_gestion"],
+                        "taux_provision_negocier": row["provision_negocier"]}
+                line.update(result)
+                lines.append(json.dumps(line))
+                index += 1
+            yield "\n".join(lines) + "\n"
+            chunk_size = BATCH_CHUNK_SIZE
+        logger.info("Grid of %d points streamed in %.3f seconds", index, time.time() - start_time)
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# /projection : nombre maximal de mois d'un planning
+PROJECTION_MAX_MONTHS = 120
+
+PROJECTION_SERIES = ("brut_mensuel", "net_mensuel", "frais_gestion", "provision_negocier")
+
+class ProjectionMonth(BaseModel):
+    """Un mois du planning ; tjm, contract_type, frais_gestion et provision_negocier restent en vigueur les mois suivants."""
+    jours_travailles: int
+    month: Optional[str] = None
+    tjm: Optional[float] = None
+    contract_type: Optional[str] = None
+    frais_gestion: Optional[float] = None
+    provision_negocier: Optional[float] = None
+
+class ProjectionRequest(BaseModel):
+    """Valeurs de départ (comme /convert) et planning mois par mois."""
+    months: List[ProjectionMonth]
+    start: Optional[str] = None
+    tjm: Optional[float] = None
+    contract_type: Optional[str] = None
+    frais_fonctionnement: Optional[float] = None
+    frais_gestion: Optional[float] = None
+    provision_negocier: Optional[float] = None
+    ticket_restaurant: Optional[Union[bool, str]] = None
+    mutuelle: Optional[Union[bool, str]] = None
+    code_commune: Optional[str] = None
+    year: Optional[int] = None
+    template: Optional[str] = None
+
+def month_labels(start: Optional[str], months: List[ProjectionMonth]) -> List[str]:
+    """Libellé de chaque mois : celui du planning, sinon compté depuis ``start`` ("2025-01"), sinon 1, 2, 3..."""
+    first = None
+    if start:
+        try:
+            start_year, start_month = (int(part) for part in start.split("-"))
+            if not 1 <= start_month <= 12:
+                raise ValueError
+            first = start_year * 12 + start_month - 1
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid start month '{start}' (expected YYYY-MM)")
+    labels = []
+    for index, month in enumerate(months):
+        if month.month:
+            labels.append(month.month)
+        elif first is not None:
+            labels.append(f"{(first + index) // 12}-{(first + index) % 12 + 1:02d}")
+        else:
+            labels.append(str(index + 1))
+    return labels
+
+@app.post("/projection")
+async def projection(request: ProjectionRequest):
+    """
+    Projection sur plusieurs mois (jours travaillés variables, passage CDI/CDD,
+    changement de TJM) : tous les mois sont évalués en une seule passe
+    vectorisée. Séries mensuelles et cumulées de brut, net, frais de gestion et
+    provision.
+    """
+    if not request.months:
+        raise HTTPException(status_code=400, detail="The schedule has no month")
+    if len(request.months) > PROJECTION_MAX_MONTHS:
+        raise HTTPException(status_code=400, detail=f"Schedule has {len(request.months)} months, "
+                                                    f"maximum is {PROJECTION_MAX_MONTHS}")
+    selected = get_template(request.template, request.year)
+    if request.code_commune and not is_commune_code_valid(request.code_commune, selected):
+        return invalid_commune_response()
+    # Planning validé avant de réserver un worker : une erreur 400 ne coûte pas de place dans WORKER_POOL
+    labels, rows, positions = schedule_rows(request)
+    return await run_blocking(project_schedule, labels, rows, positions, selected.name)
+
+def schedule_rows(request: ProjectionRequest) -> Tuple[List[str], List[Dict], List[int]]:
+    """
+    Libellés et paramètres de chaque mois, et positions des mois à évaluer
+    (au moins un jour travaillé). HTTPException 400 si un mois n'a pas de TJM
+    ou a un nombre de jours négatif.
+    """
+    labels = month_labels(request.start, request.months)
+    current = {
+        "tjm": request.tjm,
+        "contract_type": request.contract_type,
+        "frais_gestion": request.frais_gestion,
+        "provision_negocier": request.provision_negocier,
+    }
+    rows, positions = [], []
+    for index, month in enumerate(request.months):
+        # Une valeur donnée pour un mois s'applique jusqu'au prochain changement
+        for name in current:
+            value = getattr(month, name)
+            if value is not None:
+                current[name] = value
+        if current["tjm"] is None:
+            raise HTTPException(status_code=400, detail=f"No TJM for month {labels[index]}")
+        if month.jours_travailles < 0:
+            raise HTTPException(status_code=400, detail=f"Negative jours_travailles for month {labels[index]}")
+        rows.append({
+            **current,
+            "jours_travailles": month.jours_travailles,
+            "frais_fonctionnement": request.frais_fonctionnement,
+            "ticket_restaurant": str_to_bool(str(request.ticket_restaurant)) if request.ticket_restaurant is not None else False,
+            "mutuelle": str_to_bool(str(request.mutuelle)) if request.mutuelle is not None else False,
+            "code_commune": request.code_commune,
+        })
+        # Mois sans jour travaillé : rien à facturer ni à payer, pas de calcul
+        if month.jours_travailles > 0:
+            positions.append(index)
+    return labels, rows, positions
+
+def project_schedule(labels: List[str], rows: List[Dict], positions: List[int], template_name: str) -> Dict:
+    """Partie bloquante de /projection, exécutée dans WORKER_POOL."""
+    start_time = time.time()
+    selected = get_template(template_name)
+    results: List[Dict] = [{output: 0 for output in PROJECTION_SERIES} for _ in rows]
+    with span("projection"):
+        for position, result in zip(positions, simulate_rows([rows[position] for position in positions], selected)):
+            results[position] = result
+    
+    months = []
+    for label, row, result in zip(labels, rows, results):
+        month = {"month": label, "tjm": row["tjm"], "jours_travailles": row["jours_travailles"],
+                 "contract_type": row["contract_type"]}
+        month.update({output: result[output] for output in PROJECTION_SERIES})
+        if "note" in result:
+            month["note"] = result["note"]
+        months.append(month)
+    series = {output: [month[output] for month in months] for output in PROJECTION_SERIES}
+    cumulative = {output: list(itertools.accumulate(values)) for output, values in series.items()}
+    logger.info("Projection of %d months (%d evaluated) in %.3f seconds",
+                len(months), len(positions), time.time() - start_time)
+    return {
+        "template": selected.name,
+        "months": months,
+        "series": series,
+        "cumulative": cumulative,
+        "totals": {output: values[-1] for output, values in cumulative.items()},
+        "fallback_months": [month["month"] for month in months if "note" in month],
+    }
+
+# /convert/upload : nombre maximal de lignes évaluées par fichier
+UPLOAD_MAX_ROWS = int(os.environ.get("PORTALIA_UPLOAD_MAX_ROWS", "100000"))
+
+UPLOAD_COLUMNS = ["ligne", "tjm", "jours_travailles", "contract_type", "code_commune", "statut",
+                  "brut_mensuel", "net_mensuel", "frais_gestion", "provision_negocier",
+                  "ticket_restaurant_contribution", "mutuelle_contribution", "message"]
+UPLOAD_STATUS_COLUMN = UPLOAD_COLUMNS.index("statut")
+
+def upload_result_row(line: int, record: Dict, result: Optional[Dict]) -> List:
+    """Ligne CSV de résultat : statut "ok", "repli" (valeurs approchées) ou "erreur"."""
+    row = [line, record.get("tjm"), record.get("jours_travailles"), record.get("contract_type"),
+           record.get("code_commune")]
+    if result is None or "status_code" in result:
+        message = result["message"] if result else "Invalid parameters"
+        return row + ["erreur", None, None, None, None, None, None, message]
+    details = result.get("autres_details", {})
+    return row + ["repli" if "note" in result else "ok", result["brut_mensuel"], result["net_mensuel"],
+                  result["frais_gestion"], result["provision_negocier"],
+                  details.get("ticket_restaurant_contribution"), details.get("mutuelle_contribution"),
+                  result.get("note")]
+
+@app.post("/convert/upload")
+async def convert_upload(
+    request: Request,
+    year: Optional[int] = Query(None),
+    template: Optional[str] = Query(None),
+    sheet: Optional[str] = Query(None)
+):
+    """
+    Simulations en masse depuis un fichier CSV ou XLSX (champ multipart "file") :
+    une ligne par simulation, colonnes nommées comme les paramètres de /convert.
+    Le fichier est lu au fil de l'eau, évalué dans WORKER_POOL par blocs de
+    BATCH_CHUNK_SIZE et les résultats sont renvoyés en CSV pendant la lecture
+    (colonne "ligne" : numéro de la ligne dans le fichier envoyé) ; une dernière
+    ligne "#summary" donne le nombre de lignes, de succès, d'erreurs et de lignes
+    vides ignorées. Pool saturé en cours de route : dernière ligne "#error".
+    """
+    # Formulaire lu ici (et non en paramètre) : FastAPI fermerait le fichier
+    # avant la fin de la réponse en streaming. Au-delà de 1 Mo, Starlette le
+    # garde dans un fichier temporaire, pas en mémoire.
+    form = await request.form()
+    upload = form.get("file")
+    if not isinstance(upload, UploadFile):
+        await form.close()
+        raise HTTPException(status_code=400, detail='A CSV or XLSX file is required in the "file" field')
+    try:
+        get_template(template, year)
+        file_format, delimiter, records = read_upload(upload.file, upload.filename, sheet)
+    except UploadError as e:
+        await form.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        await form.close()
+        raise
+    logger.info("Upload %s (%s) received", upload.filename, file_format)
+    
+    async def stream():
+        start_time = time.time()
+        total = errors = fallbacks = skipped = 0
+        truncated = False
+        try:
+            yield csv_text([UPLOAD_COLUMNS], delimiter)
+            while not truncated:
+                chunk = list(itertools.islice(records, BATCH_CHUNK_SIZE))
+                if not chunk:
+                    break
+                present = [(line, record) for line, record in chunk if record is not None]
+                skipped += len(chunk) - len(present)
+                chunk = present
+                if total + len(chunk) > UPLOAD_MAX_ROWS:
+                    chunk, truncated = chunk[:UPLOAD_MAX_ROWS - total], True
+                items, positions = [], []
+                results: List[Optional[Dict]] = [None] * len(chunk)
+                for position, (_, record) in enumerate(chunk):
+                    try:
+                        items.append(ConvertParameters(**{"year": year, "template": template, **record}))
+                        positions.append(position)
+                    except ValidationError as e:
+                        error = e.errors()[0]
+                        field = ".".join(str(part) for part in error["loc"])
+                        results[position] = {"status_code": 400, "message": f"{field}: {error['msg']}"}
+                try:
+                    evaluated = await run_blocking(simulate_batch, items) if items else []
+                except HTTPException as e:
+                    # Statut déjà envoyé : l'erreur (503, 504) termine le fichier sur une ligne "#error"
+                    yield csv_text([["#error", f"status={e.status_code}", f"rows={total}", e.detail]], delimiter)
+                    return
+                for position, result in zip(positions, evaluated):
+                    results[position] = result
+                rows = [upload_result_row(line, record, result) for (line, record), result in zip(chunk, results)]
+                statuses = [row[UPLOAD_STATUS_COLUMN] for row in rows]
+                errors += statuses.count("erreur")
+                fallbacks += statuses.count("repli")
+                total += len(rows)
+                yield csv_text(rows, delimiter)
+                logger.debug("Upload %s: %d rows processed (%d errors)", upload.filename, total, errors)
+            elapsed = time.time() - start_time
+            yield csv_text([["#summary", f"rows={total}", f"ok={total - errors - fallbacks}", f"fallback={fallbacks}",
+                             f"errors={errors}", f"skipped={skipped}", f"truncated={str(truncated).lower()}", f"seconds={elapsed:.3f}"]],
+                           delimiter)
+            logger.info("Upload %s: %d rows in %.2f seconds (%d errors%s)", upload.filename, total, elapsed, errors,
+                        ", truncated" if truncated else "")
+        finally:
+            upload.file.close()
+    
+    name = os.path.splitext(os.path.basename(upload.filename or "simulations"))[0]
+    return StreamingResponse(stream(), media_type="text/csv; charset=utf-8",
+                             headers={"Content-Disposition": f'attachment; filename="{name}_resultats.csv"'})
+
+@app.get("/solve-tjm")
+async def solve_tjm_endpoint(
+    net_mensuel: float = Query(...),
+    jours_travailles: int = Query(...),
+    contract_type: Optional[str] = Query(None),
+    frais_fonctionnement: Optional[float] = Query(None),
+    frais_gestion: Optional[float] = Query(None),
+    provision_negocier: Optional[float] = Query(None),
+    ticket_restaurant: Optional[str] = Query(None),
+    mutuelle: Optional[str] = Query(None),
+    code_commune: Optional[str] = Query(None),
+    year: Optional[int] = Query(None),
+    template: Optional[str] = Query(None)
+):
+    """Mode inverse : TJM nécessaire pour obtenir le net mensuel demandé (Salaire net + Frais + TR)."""
+    ticket_restaurant_bool = str_to_bool(ticket_restaurant) if ticket_restaurant is not None else False
+    mutuelle_bool = str_to_bool(mutuelle) if mutuelle is not None else False
+    
+    if net_mensuel <= 0 or jours_travailles <= 0:
+        raise HTTPException(status_code=400, detail="net_mensuel and jours_travailles must be positive")
+    
+    selected = get_template(template, year)
+    return await run_blocking(run_solve_tjm, net_mensuel, jours_travailles, contract_type, frais_fonctionnement,
+                              frais_gestion, provision_negocier, ticket_restaurant_bool, mutuelle_bool,
+                              code_commune, selected.name)
+
+def run_solve_tjm(
+    net_mensuel: float,
+    jours_travailles: int,
+    contract_type: Optional[str],
+    frais_fonctionnement: Optional[float],
+    frais_gestion: Optional[float],
+    provision_negocier: Optional[float],
+    ticket_restaurant_bool: bool,
+    mutuelle_bool: bool,
+    code_commune: Optional[str],
+    template_name: str
+):
+    """Partie bloquante de /solve-tjm (recherche du TJM), exécutée dans WORKER_POOL."""
+    selected = get_template(template_name)
+    if code_commune and not is_commune_code_valid(code_commune, selected):
+        return invalid_commune_response()
+    
+    model = get_workbook_model(selected)
+    inputs = build_native_inputs(0.0, jours_travailles, contract_type, frais_fonctionnement,
+                                 frais_gestion, provision_negocier, ticket_restaurant_bool, mutuelle_bool, code_commune)
+    
+    try:
+        result, scenario = solve_tjm(model, inputs, CALCULATION_SHEET, net_mensuel,
+                                     (TEMPLATE_SHEET, selected.output_cells["net_mensuel"]), jours_travailles,
+                                     outputs=[(TEMPLATE_SHEET, cell) for cell in selected.output_cells.values()])
+    except SolverError as e:
+        raise HTTPException(status_code=422, detail=f"Impossible de trouver un TJM : {str(e)}")
+    if not result.converged:
+        raise HTTPException(status_code=422, detail=f"Le solveur n'a pas convergé ({result.iterations} itérations)")
+    
+    values = {output: scenario.get(model.cell_id(TEMPLATE_SHEET, cell)) for output, cell in selected.output_cells.items()}
+    return {
+        "net_mensuel_cible": net_mensuel,
+        "tjm": result.value,
+        "simulation": native_result(values, result.value, jours_travailles, contract_type, frais_gestion,
+                                    provision_negocier, ticket_restaurant_bool, mutuelle_bool),
+        "solver": result.to_dict()
+    }
 
 @app.get("/preload-communes")
-async def preload_communes():
+def preload_communes(year: Optional[int] = Query(None), template: Optional[str] = Query(None)):
     """Précharge les codes communes en mémoire pour accélérer les recherches futures"""
     try:
-        # Import xlwings
-        import xlwings as xw
-        
-        # Ouvrir le fichier Excel
         start_time = time.time()
-        app_excel = xw.App(visible=False)
-        app_excel.display_alerts = False
-        
-        wb = app_excel.books.open(EXCEL_TEMPLATE_PATH)
-        logger.info("Excel file opened successfully for preloading communes")
+        TEMPLATE_REGISTRY.reload_changed()
+        index = get_commune_index(TEMPLATE_REGISTRY.get(template, year))
+        end_time = time.time()
+        logger.info(f"Preloaded {len(index)} commune codes in {end_time - start_time:.2f} seconds")
         
-        # Get sheet names
-        sheet_names = [sheet.name for sheet in wb.sheets]
-        
-        # Check for transport sheet
-        transport_sheet_name = "tauxTransport 2025"
-        
-        if transport_sheet_name in sheet_names:
-            transport_sheet = wb.sheets[transport_sheet_name]
-            
-            # Charger les codes communes
-            cache_key = "transport_codes"
-            
-            # Get the used range
-            used_range = transport_sheet.used_range
-            last_row = used_range.last_cell.row
-            
-            # Read codes in chunks for better performance
-            codes_list = []
-            chunk_size = 100
-            
-            for start_row in range(2, last_row + 1, chunk_size):
-                end_row = min(start_row + chunk_size - 1, last_row)
-                cell_range = f"A{start_row}:A{end_row}"
-                
-                # Read the chunk of values
-                chunk_values = transport_sheet.range(cell_range).value
-                
-                # Handle single value case
-                if not isinstance(chunk_values, list):
-                    chunk_values = [chunk_values]
-                
-                # Process the values from the chunk
-                for value in chunk_values:
-                    if value is not None:
-                        normalized_code = str(value).strip()
-                        codes_list.append(normalized_code)
-            
-            COMMUNE_CODES_CACHE[cache_key] = codes_list
-            
-            end_time = time.time()
-            logger.info(f"Preloaded {len(codes_list)} commune codes in {end_time - start_time:.2f} seconds")
-            
-            return {
-                "status": "success", 
-                "count": len(codes_list), 
-                "time_seconds": end_time - start_time,
-                "message": f"Successfully preloaded {len(codes_list)} commune codes"
-            }
-        else:
-            return {"status": "error", "message": f"Transport sheet '{transport_sheet_name}' not found"}
-    
+        return {
+            "status": "success", 
+            "count": len(index), 
+            "time_seconds": end_time - start_time,
+            "message": f"Successfully preloaded {len(index)} commune codes"
+        }
+    except TemplateNotFound as e:
+        return {"status": "error", "message": f"{e.args[0]} (transport sheet not found?)"}
     except Exception as e:
         logger.error(f"Error preloading communes: {str(e)}")
         return {"status": "error", "message": str(e)}
-    
-    finally:
-        # Cleanup
-        if 'wb' in locals() and wb:
-            try:
-                wb.close()
-            except Exception:
-                pass
-        
-        if 'app_excel' in locals() and app_excel:
-            try:
-                app_excel.quit()
-            except Exception:
-                pass
+
+def warm_templates() -> Dict:
+    return {"templates": [template.name for template in TEMPLATE_REGISTRY.templates()]}
+
+def warm_commune_indexes() -> Dict:
+    """Index de recherche construit et tables de codes lues pour chaque template."""
+    return {template.name: template.communes.warm() for template in TEMPLATE_REGISTRY.templates()}
+
+def warm_hot_scenarios() -> Dict:
+    """Évalue WARMUP_SCENARIOS (chemins de calcul chauds) et met leurs résultats en cache."""
+    evaluated = 0
+    for query in WARMUP_SCENARIOS.split(";"):
+        if not query.strip():
+            continue
+        item = ConvertParameters(**dict(parse_qsl(query.strip())))
+        if item.tjm is None or item.jours_travailles is None:
+            raise ValueError(f"Warm-up scenario without tjm and jours_travailles: '{query}'")
+        selected = TEMPLATE_REGISTRY.get(item.template, item.year)
+        ticket_restaurant = str_to_bool(str(item.ticket_restaurant)) if item.ticket_restaurant is not None else False
+        mutuelle = str_to_bool(str(item.mutuelle)) if item.mutuelle is not None else False
+        # Trace jetable : ces calculs n'entrent pas dans les métriques des requêtes
+        with tracing():
+            result = convert_with_backend(BACKEND, item.tjm, item.jours_travailles, item.contract_type,
+                                          item.frais_fonctionnement, item.frais_gestion, item.provision_negocier,
+                                          ticket_restaurant, mutuelle, item.code_commune, selected)
+        if isinstance(result, dict) and "note" not in result:
+            RESULT_CACHE.put(convert_cache_key(selected.template_hash, item.tjm, item.jours_travailles,
+                                               item.contract_type, item.frais_fonctionnement, item.frais_gestion,
+                                               item.provision_negocier, ticket_restaurant, mutuelle,
+                                               item.code_commune), result)
+        evaluated += 1
+    return {"scenarios": evaluated}
+
+def create_warmup() -> Warmup:
+    warmup = Warmup()
+    warmup.add("templates", warm_templates)
+    warmup.add("commune_index", warm_commune_indexes)
+    if isinstance(BACKEND, PooledBackend):
+        # Ouverture des instances du template par défaut avant la première requête
+        warmup.add("backend_instances", lambda: BACKEND.warm(TEMPLATE_REGISTRY.get()), required=False)
+    warmup.add("hot_scenarios", warm_hot_scenarios, required=False)
+    return warmup
+
+WARMUP = create_warmup()
+
+@app.get("/health/live")
+def health_live():
+    """Le processus répond (sans attendre le préchauffage)."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def health_ready():
+    """200 une fois le préchauffage terminé, 503 avant (ou si une étape obligatoire a échoué)."""
+    status = WARMUP.status()
+    if not WARMUP.ready:
+        return JSONResponse(status_code=503, content=status, headers={"Retry-After": "1", "Cache-Control": "no-store"})
+    return JSONResponse(content=status, headers={"Cache-Control": "no-store"})
+
+# Nombre maximal de suggestions renvoyées par /communes/search
+COMMUNE_SEARCH_MAX_LIMIT = 50
+
+def commune_to_dict(commune: Commune) -> Dict:
+    return {**commune._asdict(), "code": display_code(commune.code)}
+
+@app.get("/communes/search")
+def search_communes(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=COMMUNE_SEARCH_MAX_LIMIT),
+    year: Optional[int] = Query(None),
+    template: Optional[str] = Query(None)
+):
+    """
+    Autocomplétion du code commune : préfixe de code INSEE ("920") ou de nom
+    ("nant", "saint den"), sans accents ni casse. Renvoie les meilleures
+    correspondances avec leurs taux de transport, sans lancer de simulation.
+    """
+    index = get_commune_index(get_template(template, year))
+    with span("commune_search"):
+        communes = index.search(q, limit)
+    return {"query": q, "count": len(communes), "results": [commune_to_dict(commune) for commune in communes]}
+
+@app.get("/communes/{code}")
+def get_commune(code: str, year: Optional[int] = Query(None), template: Optional[str] = Query(None)):
+    """Commune et taux de transport d'un code INSEE (404 si le code est inconnu du template)."""
+    commune = get_commune_index(get_template(template, year)).get(code)
+    if commune is None:
+        raise HTTPException(status_code=404, detail="Le code Commune n'est pas dans la base de données")
+    return commune_to_dict(commune)
+
+@app.get("/templates")
+def list_templates():
+    """Templates chargés (millésime, feuille tauxTransport, cellules de résultat) et templates ignorés."""
+    return TEMPLATE_REGISTRY.status()
+
+@app.post("/templates/reload")
+def reload_templates():
+    """Recompile immédiatement les templates modifiés (sans attendre la surveillance)."""
+    changed = TEMPLATE_REGISTRY.reload_changed()
+    return {"status": "success", "reloaded": changed, **TEMPLATE_REGISTRY.status()}
+
+@app.get("/admin/result-cache")
+def result_cache_stats():
+    """Compteurs du cache de résultats (hits, misses, évictions...)."""
+    return RESULT_CACHE.stats()
+
+@app.post("/admin/result-cache/clear")
+def clear_result_cache():
+    """Vide le cache de résultats de /convert."""
+    removed = RESULT_CACHE.clear()
+    logger.info("Result cache cleared (%s entries)", removed)
+    return {"status": "success", "removed": removed, **RESULT_CACHE.stats()}
+
+@app.get("/admin/coalescing")
+def coalescing_stats():
+    """/convert identiques regroupés : calculs lancés, requêtes regroupées, annulations."""
+    return CONVERT_FLIGHTS.stats()
+
+@app.get("/admin/shadow")
+def shadow_status():
+    """Mode shadow : comparaisons effectuées, taux de divergence et écarts par résultat."""
+    if SHADOW is None:
+        return {"enabled": False}
+    return SHADOW.stats()
+
+@app.get("/admin/worker-pool")
+def worker_pool_stats():
+    """Occupation du pool de calcul : file d'attente, temps d'attente et d'exécution, rejets."""
+    return WORKER_POOL.stats()
+
+@app.get("/admin/backend")
+def backend_stats():
+    """Backend de calcul et, s'il est activé, état du pool d'instances préchauffées (par template)."""
+    return {
+        "backend": BACKEND.name,
+        "warm_instances": WARM_INSTANCES,
+        "pools": BACKEND.stats() if isinstance(BACKEND, PooledBackend) else {},
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Métriques au format texte Prometheus : latences par étape et par route, replis, pool, cache."""
+    pool = WORKER_POOL.stats()
+    cache = RESULT_CACHE.stats()
+    flights = CONVERT_FLIGHTS.stats()
+    log = LOGGING.stats()
+    gauges = {
+        "portalia_pool_in_flight": ("Calculations accepted by the worker pool", pool["in_flight"]),
+        "portalia_pool_queue_depth": ("Calculations waiting for a worker", pool["queue_depth"]),
+        "portalia_pool_rejected": ("Calculations rejected because the pool was full", pool["rejected"]),
+        "portalia_pool_timeouts": ("Calculations that exceeded the request timeout", pool["timeouts"]),
+        "portalia_result_cache_size": ("Entries in the /convert result cache", cache["size"]),
+        "portalia_result_cache_hits": ("Result cache hits", cache["hits"]),
+        "portalia_result_cache_misses": ("Result cache misses", cache["misses"]),
+        "portalia_convert_in_flight": ("Distinct /convert calculations in flight", flights["in_flight"]),
+        "portalia_convert_coalesced": ("/convert requests that joined an identical in-flight calculation",
+                                       flights["coalesced"]),
+        "portalia_shadow_divergence_rate": ("Share of shadow replays that diverged from the reference backend",
+                                            SHADOW.divergence_rate if SHADOW is not None else 0),
+        "portalia_ready": ("1 once the warm-up is complete", 1 if WARMUP.ready else 0),
+        "portalia_warmup_seconds": ("Duration of the startup warm-up", WARMUP.status()["seconds"] or 0),
+        "portalia_log_queue_depth": ("Log records waiting for the writer thread", log["queued"]),
+        "portalia_log_dropped": ("Log records dropped because the queue was full", log["dropped"]),
+        "portalia_log_sampled_out": ("Log records skipped by level sampling", log["sampled_out"]),
+    }
+    return PlainTextResponse(REGISTRY.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profiles")
+def list_profiles():
+    """Identifiants des derniers profils enregistrés (requêtes avec l'en-tête X-Portalia-Profile)."""
+    return {"profiles": PROFILES.ids()}
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: str):
+    """Profil d'une requête : fonctions les plus échantillonnées et piles agrégées (format flame graph)."""
+    profile = PROFILES.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Unknown profile '{profile_id}'")
+    return profile
 
 # Fallback endpoint that returns dummy data
 @app.get("/fallback-convert")
-def fallback_convert(
+def fallback_convert_endpoint(
+    request: Request,
+    response: Response,
     tjm: Optional[float] = Query(500),
     jours_travailles: Optional[int] = Query(18),
     contract_type: Optional[str] = Query("CDI"),
@@ -562,6 +1361,28 @@ def fallback_convert(
     mutuelle: Optional[bool] = Query(False)
 ):
     """Fallback endpoint that returns calculated data when Excel fails"""
+    # Calcul indépendant du template : l'ETag ne dépend que des paramètres
+    etag = etag_for(("fallback-convert", canonical_number(tjm), jours_travailles, contract_type,
+                     canonical_number(frais_gestion), canonical_number(provision_negocier),
+                     bool(ticket_restaurant), bool(mutuelle)))
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    set_validators(response, etag)
+    return fallback_convert(tjm, jours_travailles, contract_type, frais_gestion, provision_negocier,
+                            ticket_restaurant, mutuelle)
+
+def fallback_convert(
+    tjm: float = 500,
+    jours_travailles: int = 18,
+    contract_type: Optional[str] = "CDI",
+    frais_gestion: Optional[float] = 0,
+    provision_negocier: Optional[float] = 0,
+    ticket_restaurant: bool = False,
+    mutuelle: bool = False
+):
+    """Approximate /convert result used when the calculation backend fails."""
+    mark("fallback")
     brut_mensuel = tjm * jours_travailles
     frais_gestion_montant = brut_mensuel * (frais_gestion / 100) if frais_gestion else 0
     provision_negocier_montant = brut_mensuel * (provision_negocier / 100) if provision_negocier and contract_type == "CDI" else 0
@@ -0,0 +1,319 @@
+"""
+Mesures de latence par étape et export au format texte Prometheus.
+
+Chaque requête porte une ``Trace`` (contextvar) dans laquelle ``span()``
+enregistre la durée des étapes (copie du template, ouverture du classeur,
+chaque ``calculate()``...) et ``mark()`` les événements (repli sur
+``fallback_convert``). Les traces produites dans le pool de calcul sont
+renvoyées au processus principal, qui alimente les histogrammes et compteurs
+exposés par ``/metrics``. Un profileur par échantillonnage peut être activé
+pour un calcul donné.
+"""
+import collections
+import itertools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name, self.documentation, self.labels = name, documentation, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labels), 0.0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels (seconds)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.documentation, self.labels = name, documentation, tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # {labels: [compteurs par bucket (non cumulés), somme, nombre]}
+        self._values: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(tuple(str(labels.get(name, "")) for name in self.labels))
+        return entry[2] if entry else 0
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in values:
+            for bound, cumulative in zip(self.buckets, itertools.accumulate(counts)):
+                labels = _format_labels(self.labels, key, f'le="{_format_number(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {count}"
+
+
+class MetricsRegistry:
+    """Named metrics rendered together in the Prometheus text format (0.0.4)."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, documentation, labels, buckets))
+
+    def render(self, gauges: Optional[Dict[str, Tuple[str, float]]] = None) -> str:
+        """Text exposition; ``gauges`` maps name -> (documentation, value) for point-in-time values."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for name, (documentation, value) in (gauges or {}).items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "portalia_stage_duration_seconds", "Duration of each calculation stage", ["stage"])
+EVENTS = REGISTRY.counter(
+    "portalia_events_total", "Notable events during calculations (fallback taken...)", ["event"])
+REQUEST_SECONDS = REGISTRY.histogram(
+    "portalia_request_duration_seconds", "HTTP request latency", ["method", "path"])
+REQUESTS = REGISTRY.counter(
+    "portalia_requests_total", "HTTP requests by status code", ["method", "path", "status"])
+WORK = REGISTRY.counter(
+    "portalia_work_total", "Units of work done by calculations (formula cells recomputed...)", ["name"])
+
+
+# -- traces par requête ---------------------------------------------------
+
+class Trace:
+    """Stage durations, events and work counts of one request (or one pooled calculation)."""
+
+    def __init__(self, profile: bool = False):
+        self.profile = profile
+        self.spans: List[Tuple[str, float]] = []
+        self.events: List[str] = []
+        self.counts: Dict[str, float] = {}
+        self.profile_result: Optional[Dict[str, Any]] = None
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.spans.append((stage, seconds))
+
+    def mark(self, event: str) -> None:
+        self.events.append(event)
+
+    def count(self, name: str, amount: float) -> None:
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def extend(self, spans: Iterable[Tuple[str, float]], events: Iterable[str],
+               counts: Optional[Dict[str, float]] = None) -> None:
+        self.spans.extend(spans)
+        self.events.extend(events)
+        for name, amount in (counts or {}).items():
+            self.count(name, amount)
+
+    def timings(self) -> Dict[str, float]:
+        """Total seconds per stage (a stage may run several times, e.g. calculate)."""
+        totals: Dict[str, float] = {}
+        for stage, seconds in self.spans:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def record(self) -> None:
+        """Feed the spans and events into the process-wide metrics."""
+        for stage, seconds in self.spans:
+            STAGE_SECONDS.observe(seconds, stage=stage)
+        for event in self.events:
+            EVENTS.inc(event=event)
+        for name, amount in self.counts.items():
+            WORK.inc(amount, name=name)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("portalia_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def tracing(profile: bool = False):
+    """Bind a fresh Trace to the current context for the duration of the block."""
+    trace = Trace(profile)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage; recorded on the current trace, or directly when there is none."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, elapsed)
+        else:
+            STAGE_SECONDS.observe(elapsed, stage=stage)
+
+
+def mark(event: str) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.mark(event)
+    else:
+        EVENTS.inc(event=event)
+
+
+def count(name: str, amount: float) -> None:
+    """Add ``amount`` units of work (e.g. recomputed cells) to the current trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, amount)
+    else:
+        WORK.inc(amount, name=name)
+
+
+# -- profileur par échantillonnage ----------------------------------------
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread every ``interval`` seconds from a helper
+    thread; ``result()`` gives collapsed stacks (flame graph input) and the
+    functions most often on top of the stack.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks: "collections.Counter[str]" = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = self._elapsed = 0.0
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> "SamplingProfiler":
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._elapsed = time.perf_counter() - self._started
+        return self
+
+    def result(self, top: int = 20) -> Dict[str, Any]:
+        leaves: "collections.Counter[str]" = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "interval_seconds": self.interval,
+            "elapsed_seconds": self._elapsed,
+            "samples": self.samples,
+            "top": [{"frame": frame, "samples": count, "ratio": count / self.samples}
+                    for frame, count in leaves.most_common(top)],
+            "collapsed": [f"{stack} {count}" for stack, count in self.stacks.most_common()],
+        }
+
+
+class ProfileStore:
+    """The last ``max_entries`` request profiles, by profile id."""
+
+    def __init__(self, max_entries: int = 32):
+        self._profiles: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+        self.max_entries = max_entries
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Dict[str, Any]) -> str:
+        with self._lock:
+            profile_id = f"{int(time.time())}-{next(self._ids)}"
+            self._profiles[profile_id] = profile
+            while len(self._profiles) > self.max_entries:
+                self._profiles.popitem(last=False)
+            return profile_id
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        return self._profiles.get(profile_id)
+
+    def ids(self) -> List[str]:
+        return list(self._profiles)
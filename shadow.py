@@ -0,0 +1,262 @@
+"""
+Mode shadow : comparaison différentielle entre le backend servi et un backend de référence.
+
+La réponse vient toujours du backend rapide (``PORTALIA_BACKEND``) ; un
+échantillon des simulations est rejoué en arrière-plan, hors du chemin de la
+réponse, avec le backend de référence (``PORTALIA_SHADOW_BACKEND``, Excel en
+pratique). Les écarts absolus et relatifs de brut_mensuel, net_mensuel,
+frais_gestion et provision_negocier alimentent ``/metrics`` et
+``/admin/shadow`` ; les entrées divergentes sont ajoutées à un corpus JSONL
+rejouable (``python -m shadow``) pour en faire des cas de régression.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from metrics import REGISTRY, tracing
+from structured_logging import current_request_id, request_context
+
+logger = logging.getLogger(__name__)
+
+SHADOW_OUTPUTS = ("brut_mensuel", "net_mensuel", "frais_gestion", "provision_negocier")
+
+ABS_DELTA_BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0, 100.0, 1000.0)
+REL_DELTA_BUCKETS = (1e-9, 1e-6, 1e-4, 1e-3, 1e-2, 0.1, 1.0)
+
+SHADOW_CHECKS = REGISTRY.counter(
+    "portalia_shadow_checks_total", "Shadow replays by outcome (match, mismatch, reference_error, skipped)",
+    ["outcome"])
+SHADOW_ABS_DELTA = REGISTRY.histogram(
+    "portalia_shadow_abs_delta", "Absolute difference between served and reference outputs", ["output"],
+    buckets=ABS_DELTA_BUCKETS)
+SHADOW_REL_DELTA = REGISTRY.histogram(
+    "portalia_shadow_rel_delta", "Relative difference between served and reference outputs", ["output"],
+    buckets=REL_DELTA_BUCKETS)
+
+
+def compare_outputs(served: Dict[str, Any], reference: Dict[str, Any], abs_tolerance: float,
+                    rel_tolerance: float) -> Dict[str, Dict[str, Any]]:
+    """
+    Per-output deltas (relative to the larger of the two values); an output
+    matches when within ``abs_tolerance`` or ``rel_tolerance``.
+    """
+    deltas = {}
+    for output in SHADOW_OUTPUTS:
+        value, expected = served.get(output), reference.get(output)
+        if not isinstance(value, (int, float)) or not isinstance(expected, (int, float)):
+            deltas[output] = {"served": value, "reference": expected, "abs": None, "rel": None,
+                              "match": value == expected}
+            continue
+        absolute = abs(value - expected)
+        # Écart relatif symétrique : borné même quand l'un des deux résultats vaut 0
+        scale = max(abs(value), abs(expected))
+        relative = absolute / scale if scale else 0.0
+        deltas[output] = {"served": value, "reference": expected, "abs": absolute, "rel": relative,
+                          "match": absolute <= abs_tolerance or relative <= rel_tolerance}
+    return deltas
+
+
+class _OutputStats:
+    __slots__ = ("count", "total_abs", "max_abs", "max_rel", "mismatches")
+
+    def __init__(self):
+        self.count, self.total_abs, self.max_abs, self.max_rel, self.mismatches = 0, 0.0, 0.0, 0.0, 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "compared": self.count,
+            "mean_abs": self.total_abs / self.count if self.count else 0.0,
+            "max_abs": self.max_abs,
+            "max_rel": self.max_rel,
+            "mismatches": self.mismatches,
+        }
+
+
+class ShadowRunner:
+    """
+    Replays a sample of served simulations with ``reference(parameters)`` in a
+    single background thread. At most ``max_pending`` replays wait; beyond
+    that, samples are skipped rather than queued.
+    """
+
+    def __init__(self, reference: Callable[[Dict[str, Any]], Dict[str, Any]], reference_name: str,
+                 sample_rate: float = 0.05, corpus_path: Optional[str] = None, abs_tolerance: float = 0.01,
+                 rel_tolerance: float = 1e-6, max_pending: int = 16):
+        self.reference = reference
+        self.reference_name = reference_name
+        self.sample_rate = sample_rate
+        self.corpus_path = corpus_path
+        self.abs_tolerance = abs_tolerance
+        self.rel_tolerance = rel_tolerance
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="portalia-shadow")
+        self._lock = threading.Lock()
+        self._corpus_lock = threading.Lock()
+        self.pending = 0
+        self.checked = 0
+        self.mismatches = 0
+        self.reference_errors = 0
+        self.skipped = 0
+        self.corpus_entries = 0
+        self.outputs = {output: _OutputStats() for output in SHADOW_OUTPUTS}
+
+    def submit(self, parameters: Dict[str, Any], served: Dict[str, Any]) -> bool:
+        """Sample this simulation for a replay; never blocks. Returns True if it was queued."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.skipped += 1
+                SHADOW_CHECKS.inc(outcome="skipped")
+                return False
+            self.pending += 1
+        self._executor.submit(self._check, dict(parameters), served, current_request_id())
+        return True
+
+    def _check(self, parameters: Dict[str, Any], served: Dict[str, Any], request_id: Optional[str]) -> None:
+        try:
+            # Trace jetable : le calcul de référence n'entre pas dans les métriques des requêtes
+            with request_context(request_id), tracing():
+                start_time = time.perf_counter()
+                error = "no result"
+                try:
+                    reference = self.reference(parameters)
+                except Exception as e:
+                    reference, error = None, str(e)
+                elapsed = time.perf_counter() - start_time
+                if not isinstance(reference, dict):
+                    with self._lock:
+                        self.reference_errors += 1
+                    SHADOW_CHECKS.inc(outcome="reference_error")
+                    logger.warning("Shadow %s replay failed: %s", self.reference_name, error)
+                    return
+                self.record(parameters, served, reference, request_id, elapsed)
+        except Exception as e:
+            logger.error("Shadow check error: %s", e)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def record(self, parameters: Dict[str, Any], served: Dict[str, Any], reference: Dict[str, Any],
+               request_id: Optional[str] = None, reference_seconds: float = 0.0) -> Dict[str, Dict[str, Any]]:
+        deltas = compare_outputs(served, reference, self.abs_tolerance, self.rel_tolerance)
+        matched = all(delta["match"] for delta in deltas.values())
+        with self._lock:
+            self.checked += 1
+            if not matched:
+                self.mismatches += 1
+            for output, delta in deltas.items():
+                stats = self.outputs[output]
+                if delta["abs"] is not None:
+                    stats.count += 1
+                    stats.total_abs += delta["abs"]
+                    stats.max_abs = max(stats.max_abs, delta["abs"])
+                    stats.max_rel = max(stats.max_rel, delta["rel"])
+                if not delta["match"]:
+                    stats.mismatches += 1
+        for output, delta in deltas.items():
+            if delta["abs"] is not None:
+                SHADOW_ABS_DELTA.observe(delta["abs"], output=output)
+                SHADOW_REL_DELTA.observe(delta["rel"], output=output)
+        SHADOW_CHECKS.inc(outcome="match" if matched else "mismatch")
+        if not matched:
+            diverging = [output for output, delta in deltas.items() if not delta["match"]]
+            logger.warning("Shadow mismatch against %s on %s", self.reference_name, ", ".join(diverging),
+                           extra={"parameters": parameters, "deltas": deltas})
+            self._persist({
+                "time": time.time(),
+                "request_id": request_id,
+                "reference_backend": self.reference_name,
+                "reference_seconds": reference_seconds,
+                "parameters": parameters,
+                "deltas": deltas,
+            })
+        return deltas
+
+    def _persist(self, entry: Dict[str, Any]) -> None:
+        if not self.corpus_path:
+            return
+        line = json.dumps(entry, default=str, ensure_ascii=False)
+        try:
+            with self._corpus_lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.corpus_path)), exist_ok=True)
+                with open(self.corpus_path, "a", encoding="utf-8") as corpus:
+                    corpus.write(line + "\n")
+                self.corpus_entries += 1
+        except OSError as e:
+            logger.error("Cannot write the shadow corpus %s: %s", self.corpus_path, e)
+
+    @property
+    def divergence_rate(self) -> float:
+        return self.mismatches / self.checked if self.checked else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": True,
+                "reference_backend": self.reference_name,
+                "sample_rate": self.sample_rate,
+                "abs_tolerance": self.abs_tolerance,
+                "rel_tolerance": self.rel_tolerance,
+                "pending": self.pending,
+                "checked": self.checked,
+                "mismatches": self.mismatches,
+                "divergence_rate": self.divergence_rate,
+                "reference_errors": self.reference_errors,
+                "skipped": self.skipped,
+                "corpus_path": self.corpus_path,
+                "corpus_entries": self.corpus_entries,
+                "outputs": {output: stats.to_dict() for output, stats in self.outputs.items()},
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def read_corpus(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as corpus:
+        for line in corpus:
+            if line.strip():
+                yield json.loads(line)
+
+
+# -- rejeu du corpus ---------------------------------------------------------
+
+def main(argv=None) -> int:
+    """Replay the corpus with the served and reference backends; exit code 1 if some entries still diverge."""
+    parser = argparse.ArgumentParser(prog="python -m shadow", description=main.__doc__)
+    parser.add_argument("corpus", nargs="?", default=os.environ.get("PORTALIA_SHADOW_CORPUS",
+                                                                     os.path.join(".portalia_shadow", "corpus.jsonl")))
+    parser.add_argument("--reference", help="reference backend (default: the entry's reference_backend)")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+    import main as app_module
+    from backends import create_backend
+
+    references: Dict[str, Any] = {}
+    replayed = diverging = 0
+    for entry in read_corpus(args.corpus):
+        name = args.reference or entry.get("reference_backend", "excel")
+        if name not in references:
+            references[name] = create_backend(name)
+        parameters = entry["parameters"]
+        served = app_module.shadow_evaluate(app_module.BACKEND, parameters)
+        reference = app_module.shadow_evaluate(references[name], parameters)
+        deltas = compare_outputs(served, reference, app_module.SHADOW_ABS_TOLERANCE, app_module.SHADOW_REL_TOLERANCE)
+        replayed += 1
+        if not all(delta["match"] for delta in deltas.values()):
+            diverging += 1
+            print(json.dumps({"parameters": parameters, "deltas": deltas}, default=str, ensure_ascii=False))
+    print(f"{replayed} entries replayed, {diverging} still diverging", file=sys.stderr)
+    return 1 if diverging else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Regroupement des calculs identiques simultanés (single flight).
+
+Quand plusieurs requêtes identiques arrivent en même temps (double clic,
+nouvel essai du frontend), seule la première lance le calcul ; les suivantes
+attendent le même résultat au lieu d'occuper chacune un worker (et, avec
+Excel, une instance et un répertoire temporaire).
+
+Le calcul partagé tourne dans sa propre tâche : l'annulation d'une requête
+(client déconnecté) ne l'interrompt pas tant qu'une autre requête l'attend ;
+il n'est annulé que lorsque plus personne ne l'attend.
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from metrics import mark
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls sharing a key onto one in-flight computation (one event loop)."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.abandoned = 0
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Result of ``compute()`` for ``key``, shared with every concurrent caller
+        using the same key. Exceptions are propagated to all of them.
+        """
+        if not self.enabled:
+            return await compute()
+        flight = self._flights.get(key)
+        if flight is None:
+            # La tâche hérite du contexte de la première requête (trace, profil)
+            flight = _Flight(asyncio.ensure_future(compute()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._finish(key, flight))
+            with self._lock:
+                self.leaders += 1
+        else:
+            with self._lock:
+                self.coalesced += 1
+            mark("coalesced")
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            with self._lock:
+                self.cancelled += 1
+            if flight.waiters == 1 and not flight.task.done():
+                # Plus personne n'attend ce calcul ; retiré tout de suite pour qu'une requête
+                # arrivant avant _finish lance un nouveau calcul au lieu d'hériter de l'annulation
+                flight.task.cancel()
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                with self._lock:
+                    self.abandoned += 1
+                logger.info("Shared calculation abandoned: every waiting request was cancelled")
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _finish(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if flight.task.cancelled():
+            return
+        # Exception déjà transmise aux requêtes en attente ; évite l'avertissement
+        # "exception was never retrieved" quand toutes ont été annulées
+        flight.task.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled,
+                "abandoned": self.abandoned,
+            }
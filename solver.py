@@ -0,0 +1,263 @@
+"""
+Solveur numérique sur le modèle compilé du classeur.
+
+Remplace la macro VBA ``TJM`` (``Range("B12").GoalSeek Goal:=Range("J4").Value,
+ChangingCell:=Range("B4")``) et permet la recherche inverse : quel TJM donne
+un net mensuel donné.
+"""
+import logging
+import math
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from formula_engine import Scenario, WorkbookModel, is_error
+
+logger = logging.getLogger(__name__)
+
+# Excel s'arrête à 100 itérations / écart de 0.001 ; on peut être bien plus précis ici
+DEFAULT_MAX_ITERATIONS = 100
+DEFAULT_TOLERANCE = 1e-7
+# Encadrement réduit à cette largeur relative : racine située sur un saut de la fonction
+BRACKET_TOLERANCE = 1e-12
+
+
+class SolverError(Exception):
+    """Raised when the objective cannot be evaluated (error value, text...) or the solver does not converge."""
+
+
+def _collapsed(a: float, b: float) -> bool:
+    return abs(b - a) <= BRACKET_TOLERANCE * max(1.0, abs(a), abs(b))
+
+
+@dataclass
+class SolverResult:
+    """
+    ``converged`` is also true when the goal lies inside a jump of the function
+    (thresholds of the template): like Excel's GoalSeek, the closest side of
+    the jump is kept, ``discontinuity`` is set and ``residual`` tells how far
+    from the goal it is.
+    """
+    value: float
+    residual: float
+    iterations: int
+    evaluations: int
+    converged: bool
+    elapsed_seconds: float
+    discontinuity: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def solve(function: Callable[[float], float], x0: float, x1: Optional[float] = None,
+          tolerance: float = DEFAULT_TOLERANCE, max_iterations: int = DEFAULT_MAX_ITERATIONS,
+          bounds: Tuple[float, float] = (-math.inf, math.inf)) -> SolverResult:
+    """
+    Find ``x`` such that ``function(x) == 0`` using secant steps, falling back
+    to bisection as soon as a sign change has been bracketed. A bracket that
+    shrinks to nothing without reaching ``tolerance`` is a jump of the
+    function: the endpoint closest to zero is returned.
+    """
+    start_time = time.perf_counter()
+    lower_bound, upper_bound = bounds
+    evaluations = 0
+
+    def evaluate(x):
+        nonlocal evaluations
+        evaluations += 1
+        return function(x)
+
+    if x1 is None:
+        x1 = x0 * 1.01 if x0 else 1.0
+    f0 = evaluate(x0)
+    if abs(f0) <= tolerance:
+        return SolverResult(x0, f0, 0, evaluations, True, time.perf_counter() - start_time)
+    f1 = evaluate(x1)
+    bracket = (x0, f0, x1, f1) if f0 * f1 < 0 else None
+
+    iterations = 0
+    while abs(f1) > tolerance and iterations < max_iterations:
+        if bracket and _collapsed(bracket[0], bracket[2]):
+            a, fa, b, fb = bracket
+            x1, f1 = (a, fa) if abs(fa) <= abs(fb) else (b, fb)
+            return SolverResult(x1, f1, iterations, evaluations, True, time.perf_counter() - start_time, True)
+        iterations += 1
+        if f1 != f0:
+            x2 = x1 - f1 * (x1 - x0) / (f1 - f0)
+        elif bracket:
+            x2 = (bracket[0] + bracket[2]) / 2
+        else:
+            break
+        if bracket and not min(bracket[0], bracket[2]) < x2 < max(bracket[0], bracket[2]):
+            x2 = (bracket[0] + bracket[2]) / 2
+        x2 = min(max(x2, lower_bound), upper_bound)
+        f2 = evaluate(x2)
+
+        if bracket:
+            a, fa, b, fb = bracket
+            bracket = (a, fa, x2, f2) if fa * f2 < 0 else (x2, f2, b, fb)
+        elif f1 * f2 < 0:
+            bracket = (x1, f1, x2, f2)
+        x0, f0, x1, f1 = x1, f1, x2, f2
+
+    return SolverResult(x1, f1, iterations, evaluations, abs(f1) <= tolerance,
+                        time.perf_counter() - start_time)
+
+
+def _numeric(value: Any, label: str) -> float:
+    if is_error(value) or isinstance(value, (str, bool)) or value is None:
+        raise SolverError(f"{label} evaluated to {value!r}")
+    return float(value)
+
+
+def goal_seek(scenario: Scenario, target: int, goal: float, changing: int,
+              tolerance: float = DEFAULT_TOLERANCE, max_iterations: int = DEFAULT_MAX_ITERATIONS) -> SolverResult:
+    """
+    Equivalent of ``Range(target).GoalSeek Goal:=goal, ChangingCell:=Range(changing)``
+    on a scenario; the scenario is left on the solution. Raises ``SolverError``
+    when it does not converge, rather than returning an approximate value.
+    """
+    def residual(x):
+        scenario.set(changing, x)
+        return _numeric(scenario.get(target), "Goal seek target") - goal
+
+    start = scenario.get(changing)
+    start = start if isinstance(start, (int, float)) and not isinstance(start, bool) and start else 1.0
+    result = solve(residual, start, tolerance=tolerance, max_iterations=max_iterations)
+    scenario.set(changing, result.value)
+    if not result.converged:
+        raise SolverError(f"Goal seek did not converge after {result.iterations} iterations "
+                          f"(residual {result.residual})")
+    if result.discontinuity:
+        logger.debug("Goal seek stopped on a discontinuity, residual %s", result.residual)
+    return result
+
+
+@dataclass
+class BatchSolverResult:
+    """Per-row results of a vectorised goal seek (arrays of the batch size)."""
+    values: np.ndarray
+    residuals: np.ndarray
+    converged: np.ndarray
+    iterations: int
+    evaluations: int
+    elapsed_seconds: float
+
+
+def _numeric_column(values: Any, size: int) -> np.ndarray:
+    """Float column; rows holding an error or text become NaN."""
+    if isinstance(values, np.ndarray) and values.dtype.kind in "fb":
+        return values.astype(float)
+    if not isinstance(values, np.ndarray):
+        values = [values] * size
+    return np.array([float(value) if isinstance(value, (int, float)) else math.nan for value in list(values)])
+
+
+def _collapsed_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.abs(b - a) <= BRACKET_TOLERANCE * np.maximum(1.0, np.maximum(np.abs(a), np.abs(b)))
+
+
+def goal_seek_batch(batch, target: int, goal: np.ndarray, changing: int,
+                    tolerance: float = DEFAULT_TOLERANCE,
+                    max_iterations: int = DEFAULT_MAX_ITERATIONS) -> BatchSolverResult:
+    """
+    Vectorised ``goal_seek`` on a ``BatchScenario``: every row runs the same
+    secant/bisection steps as ``solve`` on NumPy arrays, so one formula
+    evaluation of the batch advances all rows at once. Rows that converged
+    keep their value (the closest side of a jump, as in ``solve``); rows that
+    did not (including rows whose target is an error) are flagged in
+    ``converged`` and must not be used as results.
+    """
+    start_time = time.perf_counter()
+    size = batch.size
+    goal = np.broadcast_to(np.asarray(goal, dtype=float), (size,))
+    evaluations = 0
+
+    def residual(x):
+        nonlocal evaluations
+        evaluations += 1
+        batch.set(changing, x)
+        return _numeric_column(batch.get(target), size) - goal
+
+    x0 = _numeric_column(batch.get(changing), size)
+    x0 = np.where(np.isfinite(x0) & (x0 != 0), x0, 1.0)
+    f0 = residual(x0)
+    x1 = np.where(np.abs(f0) <= tolerance, x0, x0 * 1.01)
+    f1 = residual(x1)
+
+    # Encadrement [a, b] par ligne dès qu'un changement de signe a été observé
+    bracketed = f0 * f1 < 0
+    a, fa, b, fb = x0.copy(), f0.copy(), x1.copy(), f1.copy()
+    active = np.abs(f1) > tolerance
+    iterations = 0
+    with np.errstate(all="ignore"):
+        while iterations < max_iterations and active.any():
+            iterations += 1
+            step = f1 - f0
+            x2 = np.where(step != 0, x1 - f1 * (x1 - x0) / step, (a + b) / 2)
+            outside = bracketed & ~((np.minimum(a, b) < x2) & (x2 < np.maximum(a, b)))
+            x2 = np.where(outside, (a + b) / 2, x2)
+            # Sans pente ni encadrement, la ligne ne peut plus progresser
+            stalled = (step == 0) & ~bracketed
+            active &= ~stalled
+            x2 = np.where(active, x2, x1)
+            f2 = residual(x2)
+
+            left = fa * f2 < 0
+            update = active & bracketed
+            b, fb = np.where(update & left, x2, b), np.where(update & left, f2, fb)
+            a, fa = np.where(update & ~left, x2, a), np.where(update & ~left, f2, fa)
+            new = active & ~bracketed & (f1 * f2 < 0)
+            a, fa = np.where(new, x1, a), np.where(new, f1, fa)
+            b, fb = np.where(new, x2, b), np.where(new, f2, fb)
+            bracketed |= new
+
+            x0, f0 = np.where(active, x1, x0), np.where(active, f1, f0)
+            x1, f1 = x2, f2
+            active &= (np.abs(f1) > tolerance) & ~(bracketed & _collapsed_rows(a, b))
+
+    # Objectif dans un saut : côté le plus proche, comme solve()
+    jump = (np.abs(f1) > tolerance) & bracketed & _collapsed_rows(a, b)
+    left = np.abs(fa) <= np.abs(fb)
+    x1 = np.where(jump, np.where(left, a, b), x1)
+    f1 = np.where(jump, np.where(left, fa, fb), f1)
+    batch.set(changing, x1)
+    converged = (np.abs(f1) <= tolerance) | jump
+    if not converged.all():
+        logger.warning("Batch goal seek: %d/%s rows did not converge", int((~converged).sum()), size)
+    return BatchSolverResult(x1, f1, converged, iterations, evaluations, time.perf_counter() - start_time)
+
+
+def solve_tjm(model: WorkbookModel, inputs: Dict[Tuple[str, str], Any], sheet: str,
+              net_target: float, net_cell: Tuple[str, str], jours_travailles: float,
+              outputs: Iterable[Tuple[str, str]] = (), tolerance: float = 0.005,
+              max_iterations: int = DEFAULT_MAX_ITERATIONS) -> Tuple[SolverResult, Scenario]:
+    """
+    Reverse mode: find the TJM (J4) for which ``net_cell`` equals ``net_target``.
+    Each candidate TJM runs the TJM goal seek (B12 -> J4 by changing B4) first.
+    The returned scenario is left on the solution, with ``outputs`` up to date.
+    """
+    tjm_id = model.cell_id(sheet, "J4")
+    brut_id = model.cell_id(sheet, "B4")
+    daily_id = model.cell_id(sheet, "B12")
+    net_id = model.cell_id(*net_cell)
+    scenario = model.scenario(inputs, [(sheet, "B12"), net_cell] + list(outputs))
+    inner_iterations = 0
+
+    def residual(tjm):
+        nonlocal inner_iterations
+        scenario.set(tjm_id, tjm)
+        inner = goal_seek(scenario, daily_id, tjm, brut_id)
+        inner_iterations += inner.iterations
+        return _numeric(scenario.get(net_id), "Net mensuel") - net_target
+
+    # Le net représente en général la moitié du chiffre d'affaires : bon point de départ
+    start = net_target / max(jours_travailles, 1) * 2
+    result = solve(residual, start, tolerance=tolerance, max_iterations=max_iterations, bounds=(0.0, math.inf))
+    residual(result.value)
+    logger.info("Solved TJM=%.4f in %d iterations (%d goal seek iterations, %.2f ms)", result.value,
+                result.iterations, inner_iterations, result.elapsed_seconds * 1000)
+    return result, scenario
@@ -0,0 +1,203 @@
+"""
+Journalisation structurée, hors du chemin des requêtes.
+
+Les enregistrements sont déposés dans une file bornée (``QueueHandler``) et
+écrits par un thread dédié (``QueueListener``) : une requête ne formate ni
+n'écrit jamais sur stdout elle-même, et la mise en forme (message, JSON) n'a
+lieu que pour les enregistrements réellement écrits. File pleine : les
+enregistrements sont comptés puis abandonnés plutôt que de bloquer.
+
+Chaque enregistrement porte l'identifiant de la requête en cours
+(``X-Request-ID``). Un échantillonnage par niveau (``DEBUG=0.01,INFO=0.1``)
+garde ou écarte toutes les lignes d'une même requête ensemble.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import uuid
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._\-]{1,64}$")
+
+_request_id: ContextVar[Optional[str]] = ContextVar("portalia_request_id", default=None)
+
+# Attributs propres à LogRecord : tout le reste vient de ``extra=`` et part dans le JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def request_id_from(header: Optional[str]) -> str:
+    """Incoming ``X-Request-ID`` when it is a sane token, otherwise a new id."""
+    if header and _REQUEST_ID_RE.match(header):
+        return header
+    return uuid.uuid4().hex[:16]
+
+
+@contextmanager
+def request_context(request_id: Optional[str]):
+    """Bind ``request_id`` to the records logged in this context (and in worker threads it is passed to)."""
+    token = _request_id.set(request_id)
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps each record with the current request id (runs in the logging thread)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = _request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the records of each level (missing levels: all of
+    them). The decision depends on the request id, so a request is logged
+    completely or not at all; loggers in ``exempt`` are never sampled.
+    """
+
+    def __init__(self, rates: Dict[int, float], exempt: Iterable[str] = ()):
+        super().__init__()
+        self.rates = rates
+        self.exempt = tuple(exempt)
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or record.name.startswith(self.exempt):
+            return True
+        request_id = getattr(record, "request_id", None)
+        draw = zlib.crc32(request_id.encode()) / 2 ** 32 if request_id else random.random()
+        if draw < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request_id and the ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """
+    ``QueueHandler`` that leaves formatting to the listener thread and drops
+    records when the queue is full. In a forked worker process (no listener
+    thread there) records go straight to the target handlers.
+    """
+
+    def __init__(self, record_queue: "queue.Queue", targets: List[logging.Handler]):
+        super().__init__(record_queue)
+        self.targets = targets
+        self.pid = os.getpid()
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Même processus : pas besoin de rendre l'enregistrement sérialisable
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if os.getpid() != self.pid:
+            for handler in self.targets:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+            return
+        super().emit(record)
+
+
+class LoggingSetup:
+    """Root handler, listener thread and filters installed by ``setup_logging``."""
+
+    def __init__(self, handler: BackgroundHandler, listener: logging.handlers.QueueListener,
+                 sampling: SamplingFilter):
+        self.handler = handler
+        self.listener = listener
+        self.sampling = sampling
+
+    def stop(self) -> None:
+        """Flush the queue and stop the listener thread."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.handler.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "sampled_out": self.sampling.sampled_out,
+        }
+
+
+def parse_sample_rates(spec: str) -> Dict[int, float]:
+    """``"DEBUG=0.01,INFO=0.1"`` -> ``{10: 0.01, 20: 0.1}``."""
+    rates = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, rate = part.partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Unknown log level '{name.strip()}' in sampling '{spec}'")
+        rates[level] = float(rate)
+    return rates
+
+
+def setup_logging(level: str = "INFO", json_format: bool = True, sample_rates: Optional[Dict[int, float]] = None,
+                  queue_size: int = 10000, exempt: Iterable[str] = ()) -> LoggingSetup:
+    """Route every record through a bounded queue to a stderr handler written by a background thread."""
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+    handler = BackgroundHandler(queue.Queue(queue_size), [stream])
+    sampling = SamplingFilter(sample_rates or {}, exempt)
+    # Filtres exécutés dans le thread de la requête : identifiant lu dans son contexte
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(sampling)
+
+    root = logging.getLogger()
+    for previous in list(root.handlers):
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    listener.start()
+    setup = LoggingSetup(handler, listener, sampling)
+    atexit.register(setup.stop)
+    return setup
@@ -0,0 +1,306 @@
+"""
+Registre des templates .xlsm (un par millésime).
+
+Tous les classeurs .xlsm du répertoire sont découverts (comme dans
+``/get-excel-info``), et chaque template utilisable (avec une feuille
+"tauxTransport...") est chargé en parallèle : modèle compilé, index des
+communes et cellules de résultat du "3. Template". Un thread surveille les
+fichiers et remplace atomiquement un template modifié par sa version
+recompilée ; les requêtes en cours terminent sur l'ancienne version.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from artifact_cache import ArtifactCache, template_hash
+from communes import CommuneIndex, load_commune_index
+from formula_engine import WorkbookModel, load_workbook_model, make_address, workbook_sheets
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_EXTENSION = ".xlsm"
+TRANSPORT_SHEET_PREFIX = "tauxtransport"
+TEMPLATE_SHEET = "3. Template"
+CALCULATION_SHEET = "1. Calcul Avec prov"
+
+# Cellules écrites par une simulation (entrées + cellules de la macro TJM) :
+# tout ce qui n'en dépend pas est calculé une fois au chargement
+INPUT_CELLS = ("J4", "J5", "J7", "J8", "J9", "J10", "J11", "J12", "J17", "J21", "J25")
+GOAL_SEEK_CELLS = ("B4", "B10", "B12")
+
+# Cellules de résultat repérées par leur libellé en colonne B du "3. Template"
+# (la mise en page change d'un millésime à l'autre) : (préfixe, décalage de ligne)
+OUTPUT_LABELS = {
+    "brut_mensuel": ("salaire brut", 0),
+    "net_mensuel": ("salaire net + frais", 0),
+    "frais_gestion": ("frais de gestion", 0),
+    "provision_negocier": ("total des provisions", 0),
+    "mutuelle": ("mutuelle", 1),
+    "ticket_restaurant": ("tickets restaurant", 0),
+}
+# Mise en page du template 2025, utilisée quand un libellé est introuvable
+DEFAULT_OUTPUT_CELLS = {
+    "brut_mensuel": "E26",
+    "net_mensuel": "E31",
+    "frais_gestion": "E10",
+    "provision_negocier": "E23",
+    "mutuelle": "E16",
+    "ticket_restaurant": "E21",
+}
+
+_YEAR_RE = re.compile(r"(?<!\d)(20\d{2})(?!\d)")
+
+
+class TemplateNotFound(KeyError):
+    """Raised when no loaded template matches the requested name or year."""
+
+
+@dataclass
+class Template:
+    name: str
+    path: str
+    year: Optional[int]
+    transport_sheet: str
+    model: WorkbookModel
+    communes: CommuneIndex
+    output_cells: Dict[str, str]
+    template_hash: str
+    signature: Tuple[float, int]
+    loaded_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "year": self.year,
+            "transport_sheet": self.transport_sheet,
+            "communes": len(self.communes),
+            "formulas": self.model.formula_count,
+            "folded_formulas": self.model.folded_count,
+            "output_cells": self.output_cells,
+            "template_hash": self.template_hash,
+            "loaded_at": self.loaded_at,
+        }
+
+
+def template_year(name: str) -> Optional[int]:
+    match = _YEAR_RE.search(name)
+    return int(match.group(1)) if match else None
+
+
+def find_transport_sheet(path: str) -> Optional[str]:
+    """Name of the "tauxTransport ..." sheet of the workbook, if any."""
+    with zipfile.ZipFile(path) as archive:
+        for name, _, _ in workbook_sheets(archive):
+            if name.lower().replace(" ", "").startswith(TRANSPORT_SHEET_PREFIX):
+                return name
+    return None
+
+
+def find_output_cells(model: WorkbookModel, sheet: str = TEMPLATE_SHEET) -> Dict[str, str]:
+    """Locate the result cells (column E) from the labels of column B."""
+    labels = {}
+    for row in model.rows(sheet, 1, 200):
+        value = model.get_value(sheet, make_address(row, 2))
+        if isinstance(value, str):
+            labels.setdefault(row, value.strip().lower())
+    cells = {}
+    for output, (prefix, offset) in OUTPUT_LABELS.items():
+        row = next((row for row, label in sorted(labels.items()) if label.startswith(prefix)), None)
+        cells[output] = make_address(row + offset, 5) if row is not None else DEFAULT_OUTPUT_CELLS[output]
+    return cells
+
+
+def _signature(path: str) -> Tuple[float, int]:
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+class TemplateRegistry:
+    """Loaded templates by file name; ``get`` picks one by name, year or default."""
+
+    def __init__(self, directory: str = ".", default: Optional[str] = None,
+                 artifact_cache: Optional[ArtifactCache] = None, max_workers: int = 4):
+        self.directory = directory
+        self.default = default
+        self.artifact_cache = artifact_cache
+        self.max_workers = max_workers
+        self._templates: Dict[str, Template] = {}
+        self._skipped: Dict[str, Tuple[Tuple[float, int], str]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # Un seul rechargement à la fois (watcher et /admin/templates/reload)
+        self._reload_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # -- chargement -------------------------------------------------------
+
+    def discover(self) -> List[str]:
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.lower().endswith(TEMPLATE_EXTENSION) and not name.startswith("~$"))
+
+    def _build(self, path: str) -> Template:
+        start_time = time.time()
+        signature = _signature(path)
+        transport_sheet = find_transport_sheet(path)
+        if transport_sheet is None:
+            raise LookupError("no tauxTransport sheet")
+        model = communes = None
+        if self.artifact_cache is not None:
+            try:
+                model = self.artifact_cache.workbook_model(path)
+                communes = self.artifact_cache.commune_index(path, transport_sheet)
+                digest = self.artifact_cache.template_key(path)
+            except OSError as e:
+                logger.warning("Artifact cache unavailable for %s, reading the template directly: %s", path, e)
+                model = None
+        if model is None:
+            model, communes, digest = load_workbook_model(path), load_commune_index(path, transport_sheet), template_hash(path)
+        model.fold_constants([(CALCULATION_SHEET, cell) for cell in INPUT_CELLS + GOAL_SEEK_CELLS])
+        template = Template(
+            name=os.path.basename(path),
+            path=path,
+            year=template_year(os.path.basename(path)),
+            transport_sheet=transport_sheet,
+            model=model,
+            communes=communes,
+            output_cells=find_output_cells(model),
+            template_hash=digest,
+            signature=signature,
+        )
+        logger.info("Template %s ready in %.2f seconds", template.name, time.time() - start_time)
+        return template
+
+    def load_all(self) -> None:
+        """Load every template concurrently, then publish them in one swap."""
+        start_time = time.time()
+        paths = self.discover()
+        templates, skipped = {}, {}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(paths)))) as executor:
+            futures = {path: executor.submit(self._build, path) for path in paths}
+            for path, future in futures.items():
+                try:
+                    template = future.result()
+                    templates[template.name] = template
+                except Exception as e:
+                    logger.warning("Skipping template %s: %s", path, e)
+                    skipped[os.path.basename(path)] = (_signature(path), str(e))
+        with self._lock:
+            self._templates, self._skipped, self._loaded = templates, skipped, True
+        logger.info("Loaded %d templates in %.2f seconds (%d skipped)", len(templates), time.time() - start_time,
+                    len(skipped))
+
+    def ensure_loaded(self) -> None:
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.load_all()
+
+    # -- sélection --------------------------------------------------------
+
+    def get(self, template: Optional[str] = None, year: Optional[int] = None) -> Template:
+        self.ensure_loaded()
+        templates = self._templates
+        if template:
+            wanted = template.lower()
+            for name, candidate in templates.items():
+                if wanted in (name.lower(), os.path.splitext(name)[0].lower()):
+                    return candidate
+            raise TemplateNotFound(f"Unknown template '{template}'")
+        if year is not None:
+            candidates = [candidate for candidate in templates.values() if candidate.year == year]
+            if not candidates:
+                raise TemplateNotFound(f"No template for year {year}")
+            # Les copies ("... - Copie.xlsm") ne sont choisies qu'en dernier recours
+            return min(candidates, key=lambda candidate: ("copie" in candidate.name.lower(), candidate.name))
+        if self.default and os.path.basename(self.default) in templates:
+            return templates[os.path.basename(self.default)]
+        if not templates:
+            raise TemplateNotFound("No template loaded")
+        return max(templates.values(), key=lambda candidate: (candidate.year or 0, candidate.name))
+
+    def templates(self) -> List[Template]:
+        self.ensure_loaded()
+        return sorted(self._templates.values(), key=lambda template: template.name)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "templates": [template.to_dict() for template in self.templates()],
+            "skipped": {name: reason for name, (_, reason) in self._skipped.items()},
+            "default": self.get().name if self._templates else None,
+            "watching": self._watcher is not None and self._watcher.is_alive(),
+        }
+
+    # -- rechargement à chaud ---------------------------------------------
+
+    def reload_changed(self) -> List[str]:
+        """
+        Recompile templates whose file changed, appeared or disappeared.
+        Concurrent calls are serialised; ``_lock`` only guards the swaps.
+        """
+        self.ensure_loaded()
+        with self._reload_lock:
+            current = {os.path.basename(path): path for path in self.discover()}
+            known = dict(self._templates)
+            changed = []
+            for name, path in current.items():
+                try:
+                    signature = _signature(path)
+                except OSError:
+                    continue
+                template = known.get(name)
+                if template is not None and template.signature == signature:
+                    continue
+                if template is None and name in self._skipped and self._skipped[name][0] == signature:
+                    continue
+                try:
+                    # Compilation hors de _lock : les requêtes continuent sur l'ancien modèle
+                    replacement = self._build(path)
+                except Exception as e:
+                    logger.warning("Cannot reload template %s: %s", path, e)
+                    with self._lock:
+                        self._skipped[name] = (signature, str(e))
+                    continue
+                with self._lock:
+                    templates = dict(self._templates)
+                    templates[name] = replacement
+                    self._templates = templates
+                    self._skipped.pop(name, None)
+                changed.append(name)
+                logger.info("Template %s reloaded", name)
+            removed = [name for name in known if name not in current]
+            if removed:
+                with self._lock:
+                    self._templates = {name: template for name, template in self._templates.items()
+                                       if name not in removed}
+                logger.info("Templates removed: %s", removed)
+            return changed + removed
+
+    def start_watching(self, interval: float = 5.0) -> None:
+        """Poll the template files every ``interval`` seconds in a daemon thread."""
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+
+        def watch():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload_changed()
+                except Exception as e:
+                    logger.error("Template watcher error: %s", e)
+
+        self._watcher = threading.Thread(target=watch, name="template-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self) -> None:
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=1)
+            self._watcher = None
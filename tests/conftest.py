@@ -0,0 +1,11 @@
+"""
+Configuration commune des tests : les modules et les templates sont à la
+racine du dépôt, cherchés dans le répertoire courant comme en production.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
@@ -0,0 +1,49 @@
+"""Cache d'artefacts : manifeste des templates partagé entre threads, anciennes versions, modèle relu du cache."""
+import json
+import os
+import threading
+
+from artifact_cache import ArtifactCache
+from formula_engine import is_empty
+
+TEMPLATE = "PORTALIA MC2 CONSULTANTS 2025 V012025.xlsm"
+
+
+def read_manifest(root) -> dict:
+    with open(os.path.join(root, "templates.json"), encoding="utf-8") as stream:
+        return json.load(stream)
+
+
+def test_concurrent_manifest_updates_are_all_kept(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    paths = [str(tmp_path / f"template{index}.xlsm") for index in range(16)]
+    threads = [threading.Thread(target=cache._forget_previous_versions, args=(path, f"hash{index}"))
+               for index, path in enumerate(paths)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert read_manifest(tmp_path) == {os.path.abspath(path): f"hash{index}" for index, path in enumerate(paths)}
+    assert sorted(os.listdir(tmp_path)) == ["templates.json"]
+
+
+def test_previous_version_artifacts_removed(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    template = str(tmp_path / "template.xlsm")
+    (tmp_path / "old").mkdir()
+    cache._forget_previous_versions(template, "old")
+    cache._forget_previous_versions(template, "new")
+
+    assert not (tmp_path / "old").exists()
+    assert read_manifest(tmp_path) == {os.path.abspath(template): "new"}
+
+
+def test_model_round_trip_keeps_empty_cells(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    built = cache.workbook_model(TEMPLATE)
+    restored = cache.workbook_model(TEMPLATE)
+
+    assert restored is not built
+    assert [is_empty(value) for value in restored._values] == [is_empty(value) for value in built._values]
+    assert any(is_empty(value) for value in restored._values)
@@ -0,0 +1,95 @@
+"""Index des communes : normalisation des codes, recherche par code ou par nom, /communes/search."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from communes import CodeLookup, CommuneIndex, fold_text, normalize_code
+
+COMMUNES = [
+    ("93066", "Saint-Denis"),
+    ("97411", "Saint-Denis"),
+    ("33393", "Saint-Denis-de-Pile"),
+    ("92050", "Nanterre"),
+    ("44109", "Nantes"),
+    ("2A004", "Ajaccio"),
+    ("1005", "Ambérieux-en-Dombes"),
+]
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def index():
+    index = CommuneIndex()
+    for code, name in COMMUNES:
+        index._append(normalize_code(code), {"libelle": name}, {})
+    return index
+
+
+def codes(communes):
+    return [commune.code for commune in communes]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("01005", "1005"), ("1005.0", "1005"), (1005.0, "1005"), (" 2a004 ", "2A004"), ("92024", "92024"),
+])
+def test_normalize_code(value, expected):
+    assert normalize_code(value) == expected
+
+
+def test_fold_text():
+    assert fold_text("  Île-d'Aix ") == "ile d aix"
+    assert fold_text("SAINT  Denis") == "saint denis"
+
+
+def test_search_by_code_and_name(index):
+    assert codes(index.search("93066")) == ["93066"]
+    assert codes(index.search("2a0")) == ["2A004"]
+    assert codes(index.search("01")) == ["1005"]
+    assert codes(index.search("nant")) == ["92050", "44109"]
+    assert codes(index.search("amberieux")) == ["1005"]
+
+
+def test_search_order_and_limit(index):
+    # Noms commençant par la requête (ordre alphabétique), puis mots suivants ("denis" dans "Saint-Denis")
+    assert codes(index.search("saint-den")) == ["93066", "97411", "33393"]
+    assert codes(index.search("denis")) == ["93066", "97411", "33393"]
+    assert codes(index.search("saint den", limit=2)) == ["93066", "97411"]
+    assert index.search("", limit=5) == [] and index.search("saint", limit=0) == []
+
+
+def test_duplicate_codes_keep_the_first_row(index):
+    index._append("93066", {"libelle": "Doublon"}, {})
+    assert len(index) == len(COMMUNES)
+    assert index.get("93066").libelle == "Saint-Denis"
+
+
+def test_code_lookup_matches_dict():
+    values = [normalize_code(code) for code, _ in COMMUNES]
+    lookup = CodeLookup.build(values)
+
+    assert [lookup.get(code) for code in values] == list(range(len(values)))
+    assert lookup.get("99999") is None and "99999" not in lookup
+
+
+def test_search_endpoint(client):
+    response = client.get("/communes/search", params={"q": "920", "limit": 5}).json()
+
+    assert response["count"] == len(response["results"]) == 5
+    assert all(result["code"].startswith("920") for result in response["results"])
+    named = client.get("/communes/search", params={"q": "saint den"}).json()["results"]
+    assert named[0]["code"] == "93066" and named[0]["libelle"] == "Saint-Denis"
+    assert client.get("/communes/search", params={"q": "ile"}).json()["count"] > 0
+    assert client.get("/communes/search", params={"q": "a", "limit": 0}).status_code == 422
+
+
+def test_commune_endpoint(client):
+    commune = client.get("/communes/92024").json()
+    assert commune["code"] == "92024" and commune["libelle"] == "Clichy"
+    assert commune["taux_transport"] > 0
+    assert client.get("/communes/2a004").json()["code"] == "2A004"
+    assert client.get("/communes/00000").status_code == 404
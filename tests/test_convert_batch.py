@@ -0,0 +1,78 @@
+"""/convert/batch (évaluation vectorisée) donne les mêmes réponses que /convert, ligne par ligne."""
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+ITEMS = 200
+COMMUNES = [None, "92024", "75101", "2A004"]
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def random_items(count: int, seed: int = 12):
+    rng = random.Random(seed)
+    items = []
+    for _ in range(count):
+        item = {
+            "tjm": round(rng.uniform(250, 1200), 2),
+            "jours_travailles": rng.randint(1, 23),
+            "contract_type": rng.choice(["CDI", "CDD", None]),
+            "frais_gestion": rng.choice([None, 5, 8, 10.5]),
+            "provision_negocier": rng.choice([None, 2, 3.5]),
+            "ticket_restaurant": rng.choice([True, False]),
+            "mutuelle": rng.choice([True, False]),
+            "code_commune": rng.choice(COMMUNES),
+        }
+        items.append({name: value for name, value in item.items() if value is not None})
+    return items
+
+
+def flatten(result):
+    flat = {name: value for name, value in result.items() if name != "autres_details"}
+    flat.update(result.get("autres_details", {}))
+    return flat
+
+
+def test_batch_matches_single_convert(client):
+    items = random_items(ITEMS)
+    response = client.post("/convert/batch", json=items)
+    assert response.status_code == 200
+    batch_results = response.json()
+    assert len(batch_results) == len(items)
+
+    for item, batch_result in zip(items, batch_results):
+        single = client.get("/convert", params={name: str(value).lower() if isinstance(value, bool) else value
+                                                for name, value in item.items()})
+        assert single.status_code == 200, item
+        expected = flatten(single.json())
+        actual = flatten(batch_result)
+        assert actual.keys() == expected.keys(), item
+        assert actual == pytest.approx(expected, rel=1e-6, abs=1e-6), item
+
+
+def test_batch_rejects_invalid_rows_only(client):
+    items = [{"tjm": 500, "jours_travailles": 18}, {"tjm": 500}, {"tjm": 500, "jours_travailles": 0},
+             {"tjm": 500, "jours_travailles": 18, "code_commune": "00000"}]
+    results = client.post("/convert/batch", json=items).json()
+
+    assert results[0]["brut_mensuel"] > 0
+    assert [result.get("status_code") for result in results[1:]] == [400, 400, 400]
+
+
+def test_batch_of_identical_rows(client):
+    # Toutes les entrées deviennent scalaires : la taille du lot vient du nombre de lignes
+    item = {"tjm": 500, "jours_travailles": 18, "contract_type": "CDI"}
+    single = client.get("/convert", params=item).json()
+    results = client.post("/convert/batch", json=[item] * 3).json()
+
+    assert len(results) == 3
+    for result in results:
+        assert "note" not in result
+        assert flatten(result) == pytest.approx(flatten(single), rel=1e-6, abs=1e-6)
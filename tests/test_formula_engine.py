@@ -0,0 +1,108 @@
+"""Moteur de formules : égalités et recherches approchées entre types, cellules vides."""
+import zipfile
+from xml.sax.saxutils import escape
+
+import pytest
+
+from formula_engine import EMPTY, ERRORS, _eq, load_workbook_model
+
+WORKBOOK = """<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+          xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Feuil1" sheetId="1" r:id="rId1"/></sheets></workbook>"""
+WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="worksheet" Target="worksheets/sheet1.xml"/></Relationships>"""
+
+# Table de taux (A1:B3) triée, cellules d'entrée en D1/D2, C5 jamais renseignée
+CELLS = {
+    "A1": 0, "B1": "bas", "A2": 10, "B2": "moyen", "A3": 20, "B3": "haut",
+    "D1": 0, "D2": "",
+    "E1": "=VLOOKUP(D1,A1:B3,2)",
+    "E2": "=VLOOKUP(D1,A1:B3,2,FALSE)",
+    "E3": '=IF(C5="","vide","plein")',
+    "E4": "=IF(C5=0,1,2)",
+    "E5": "=IF(D1=D2,1,2)",
+    "E6": '=C5&"x"',
+}
+
+
+def cell_xml(address, value) -> str:
+    if isinstance(value, str) and value.startswith("="):
+        return f'<c r="{address}"><f>{escape(value[1:])}</f></c>'
+    if isinstance(value, str):
+        return f'<c r="{address}" t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+    return f'<c r="{address}"><v>{value}</v></c>'
+
+
+def build_workbook(path, cells) -> str:
+    rows = {}
+    for address, value in cells.items():
+        rows.setdefault(int(address[1:]), []).append(cell_xml(address, value))
+    sheet = ('<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+             + "".join(f'<row r="{row}">{"".join(rows[row])}</row>' for row in sorted(rows))
+             + "</sheetData></worksheet>")
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("xl/workbook.xml", WORKBOOK)
+        archive.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS)
+        archive.writestr("xl/worksheets/sheet1.xml", sheet)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory):
+    return load_workbook_model(build_workbook(tmp_path_factory.mktemp("workbook") / "test.xlsx", CELLS))
+
+
+def evaluate(model, inputs, *outputs):
+    values = model.evaluate({("Feuil1", address): value for address, value in inputs.items()},
+                            [("Feuil1", address) for address in outputs])
+    return [values[("Feuil1", address)] for address in outputs]
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    (1, 1.0, True),
+    (2, 2.5, False),
+    ("Abc", "aBC", True),
+    ("1", 1, False),
+    (True, 1, False),
+    (EMPTY, 0, True),
+    (EMPTY, "", True),
+    (EMPTY, False, True),
+    (EMPTY, "0", False),
+    (EMPTY, 1, False),
+    (EMPTY, EMPTY, True),
+])
+def test_eq(a, b, expected):
+    assert _eq(a, b) is expected
+    assert _eq(b, a) is expected
+
+
+def test_eq_propagates_errors():
+    assert _eq(ERRORS["#N/A"], 1) is ERRORS["#N/A"]
+    assert _eq(EMPTY, ERRORS["#DIV/0!"]) is ERRORS["#DIV/0!"]
+
+
+@pytest.mark.parametrize("key, expected", [(15, "moyen"), (15.5, "moyen"), (20, "haut"), (25, "haut"), (0, "bas")])
+def test_approximate_lookup_compares_numbers_by_value(model, key, expected):
+    # Les valeurs lues dans le classeur sont des float, la clé peut être un int
+    assert evaluate(model, {"D1": key}, "E1") == [expected]
+
+
+def test_approximate_lookup_without_smaller_key(model):
+    assert evaluate(model, {"D1": -1}, "E1") == [ERRORS["#N/A"]]
+    assert evaluate(model, {"D1": "texte"}, "E1") == [ERRORS["#N/A"]]
+
+
+def test_exact_lookup_compares_numbers_by_value(model):
+    assert evaluate(model, {"D1": 10}, "E2") == ["moyen"]
+    assert evaluate(model, {"D1": 15}, "E2") == [ERRORS["#N/A"]]
+
+
+def test_empty_cell_equals_zero_and_empty_text(model):
+    assert evaluate(model, {}, "E3", "E4", "E6") == ["vide", 1, "x"]
+
+
+def test_typed_inputs_compare_by_value(model):
+    assert evaluate(model, {"D1": 3, "D2": 3.0}, "E5") == [1]
+    assert evaluate(model, {"D1": 3, "D2": "3"}, "E5") == [2]
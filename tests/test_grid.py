@@ -0,0 +1,87 @@
+"""/convert/grid : produit cartésien des axes, valeurs de /convert et diffusion NDJSON bloc par bloc."""
+import asyncio
+import json
+from urllib.parse import urlencode
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def grid_lines(client, **params):
+    response = client.get("/convert/grid", params=params)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def stream_chunks(params, headers=()):
+    """Messages http.response.body envoyés par l'application, dans l'ordre (sans client HTTP qui les regroupe)."""
+    scope = {"type": "http", "http_version": "1.1", "method": "GET", "scheme": "http", "path": "/convert/grid",
+             "raw_path": b"/convert/grid", "root_path": "", "query_string": urlencode(params).encode(),
+             "headers": [(name.encode(), value.encode()) for name, value in headers],
+             "client": ("test", 1), "server": ("testserver", 80)}
+    messages = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # Client toujours connecté
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(main.app(scope, receive, send))
+    start = messages[0]
+    return dict((name.decode(), value.decode()) for name, value in start["headers"]), \
+        [message["body"] for message in messages[1:] if message.get("body")]
+
+
+def test_grid_is_the_cartesian_product(client):
+    lines = grid_lines(client, tjm="400:600:100", jours_travailles="10,20", frais_gestion="5,8")
+
+    assert [line["index"] for line in lines] == list(range(12))
+    assert [(line["tjm"], line["jours_travailles"], line["taux_frais_gestion"]) for line in lines[:4]] == \
+        [(400, 10, 5), (400, 10, 8), (400, 20, 5), (400, 20, 8)]
+    assert lines[-1]["tjm"] == 600 and lines[-1]["jours_travailles"] == 20
+    assert all(line["taux_provision_negocier"] is None for line in lines)
+
+
+def test_grid_points_match_convert(client):
+    lines = grid_lines(client, tjm="450,725.5", jours_travailles="18", contract_type="CDI", code_commune="92024")
+    for line in lines:
+        single = client.get("/convert", params={"tjm": line["tjm"], "jours_travailles": 18, "contract_type": "CDI",
+                                                "code_commune": "92024"}).json()
+        for output in ("brut_mensuel", "net_mensuel", "frais_gestion", "provision_negocier"):
+            assert line[output] == pytest.approx(single[output], rel=1e-6, abs=1e-6)
+
+
+@pytest.mark.parametrize("params", [
+    {"tjm": "800:400:50", "jours_travailles": "18"},
+    {"tjm": "400:800:0", "jours_travailles": "18"},
+    {"tjm": "abc", "jours_travailles": "18"},
+    {"tjm": "500", "jours_travailles": "0,18"},
+    {"tjm": "1:1000000:1", "jours_travailles": "18"},
+    {"tjm": "500", "jours_travailles": "18", "code_commune": "00000"},
+])
+def test_invalid_grids_rejected(client, params):
+    assert client.get("/convert/grid", params=params).status_code == 400
+
+
+def test_grid_streamed_chunk_by_chunk(client):
+    # 150 points : un premier bloc de GRID_FIRST_CHUNK_SIZE lignes, puis le reste, même si le client accepte gzip
+    headers, chunks = stream_chunks({"tjm": "400:549:1", "jours_travailles": "18"}, [("accept-encoding", "gzip")])
+
+    assert "content-encoding" not in headers
+    assert len(chunks) == 2
+    assert chunks[0].decode().count("\n") == main.GRID_FIRST_CHUNK_SIZE
+    assert sum(chunk.decode().count("\n") for chunk in chunks) == 150
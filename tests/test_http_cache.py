@@ -0,0 +1,86 @@
+"""ETag, 304 sans évaluation et compression limitée à /convert/batch."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from http_cache import etag_for, etag_matches
+
+PARAMS = {"tjm": 500, "jours_travailles": 18, "code_commune": "92024"}
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def evaluations(monkeypatch):
+    calls = []
+    run_convert = main.run_convert
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return run_convert(*args, **kwargs)
+
+    monkeypatch.setattr(main, "run_convert", counting)
+    main.RESULT_CACHE.clear()
+    return calls
+
+
+def test_etag_matches():
+    etag = etag_for(("key", 1))
+    assert etag == etag_for(("key", 1)) and etag != etag_for(("key", 2))
+    assert etag_matches(f'W/"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag) and not etag_matches('"other"', etag)
+
+
+def test_equivalent_parameters_share_the_etag(client):
+    first = client.get("/convert", params=PARAMS)
+    second = client.get("/convert", params={**PARAMS, "tjm": "500.0"})
+
+    assert first.headers["etag"] == second.headers["etag"]
+    assert first.headers["cache-control"] == main.CACHE_CONTROL
+    assert client.get("/convert", params={**PARAMS, "tjm": 501}).headers["etag"] != first.headers["etag"]
+
+
+def test_not_modified_without_evaluation(client, evaluations):
+    etag = client.get("/convert", params=PARAMS).headers["etag"]
+    main.RESULT_CACHE.clear()
+    evaluated = len(evaluations)
+    response = client.get("/convert", params=PARAMS, headers={"If-None-Match": f'W/"other", {etag}'})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert len(evaluations) == evaluated == 1
+
+
+def test_other_parameters_ignore_the_etag(client):
+    etag = client.get("/convert", params=PARAMS).headers["etag"]
+    response = client.get("/convert", params={**PARAMS, "tjm": 501}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_errors_have_no_etag(client):
+    response = client.get("/convert", params={**PARAMS, "code_commune": "99999"})
+    assert "etag" not in response.headers
+
+
+def test_fallback_convert_not_modified(client):
+    etag = client.get("/fallback-convert", params={"tjm": 600}).headers["etag"]
+    assert client.get("/fallback-convert", params={"tjm": 600}, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_only_batch_is_compressed(client):
+    gzip = {"Accept-Encoding": "gzip"}
+    batch = client.post("/convert/batch", json=[{"tjm": 500 + i, "jours_travailles": 18} for i in range(50)],
+                        headers=gzip)
+    grid = client.get("/convert/grid", params={"tjm": "400:800:10", "jours_travailles": 18}, headers=gzip)
+    single = client.get("/convert", params=PARAMS, headers=gzip)
+
+    assert batch.headers["content-encoding"] == "gzip" and len(batch.json()) == 50
+    # Flux NDJSON : chaque bloc part tel quel, sans passer par le compresseur
+    assert "content-encoding" not in grid.headers and len(grid.text.splitlines()) == 41
+    assert "content-encoding" not in single.headers
@@ -0,0 +1,122 @@
+"""InstancePool avec FakeBackend : recyclage, délais, contrôles de santé et reset entre deux prêts."""
+import threading
+import time
+
+import pytest
+
+from backends import BackendError, FakeBackend
+from instance_pool import InstancePool, LeaseTimeout
+from templates import CALCULATION_SHEET
+
+INPUTS = {(CALCULATION_SHEET, "J4"): 500.0, (CALCULATION_SHEET, "J5"): 18}
+FAILING_INPUTS = {(CALCULATION_SHEET, "J4"): -1.0, (CALCULATION_SHEET, "J5"): 18}
+
+
+def make_pool(backend: FakeBackend, **options) -> InstancePool:
+    # FakeBackend n'utilise pas le template
+    return InstancePool(lambda: backend.open_session(None), name="test pool", **options)
+
+
+def evaluate(pool: InstancePool, inputs=INPUTS):
+    with pool.lease() as session:
+        return session, session.evaluate(inputs)
+
+
+def test_instance_recycled_after_max_uses():
+    backend = FakeBackend()
+    pool = make_pool(backend, size=1, max_uses=3)
+    sessions = [evaluate(pool)[0] for _ in range(7)]
+
+    assert backend.sessions_opened == 3
+    assert [session.uses for session in dict.fromkeys(sessions)] == [3, 3, 1]
+    assert sessions[0].closed and sessions[3].closed and not sessions[6].closed
+    assert pool.stats()["recycled"] == 2
+
+
+def test_reset_between_leases():
+    backend = FakeBackend()
+    pool = make_pool(backend, size=1, max_uses=0)
+    # FakeSession refuse une seconde évaluation sans reset() entre les deux
+    first, _ = evaluate(pool)
+    second, _ = evaluate(pool)
+
+    assert first is second
+    assert second.uses == 2 and not second.dirty
+    assert backend.sessions_opened == 1
+
+
+def test_acquire_timeout_when_every_instance_is_leased():
+    pool = make_pool(FakeBackend(), size=1, acquire_timeout=0.05, lease_timeout=0)
+    with pool.lease():
+        started = time.monotonic()
+        with pytest.raises(LeaseTimeout):
+            with pool.lease():
+                pass
+        assert time.monotonic() - started >= 0.05
+
+    assert pool.stats()["acquire_timeouts"] == 1
+    evaluate(pool)
+
+
+def test_expired_lease_frees_its_slot_and_is_closed_on_return():
+    backend = FakeBackend()
+    pool = make_pool(backend, size=1, acquire_timeout=1.0, lease_timeout=0.05)
+    leased = threading.Event()
+    release = threading.Event()
+    held = []
+
+    def hold():
+        with pool.lease() as session:
+            held.append(session)
+            leased.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    leased.wait(5)
+    time.sleep(0.1)
+    # Le prêt a expiré : une nouvelle instance prend sa place sans attendre
+    replacement, _ = evaluate(pool)
+    release.set()
+    holder.join(5)
+
+    assert replacement is not held[0]
+    assert held[0].closed
+    assert backend.sessions_opened == 2
+    stats = pool.stats()
+    assert stats["expired_leases"] == 1 and stats["leased"] == 0 and stats["idle"] == 1
+
+
+def test_failed_evaluation_evicts_the_instance():
+    backend = FakeBackend(fail_on=lambda inputs: inputs[(CALCULATION_SHEET, "J4")] < 0)
+    pool = make_pool(backend, size=1)
+    with pytest.raises(BackendError):
+        evaluate(pool, FAILING_INPUTS)
+    session, _ = evaluate(pool)
+
+    assert backend.sessions_opened == 2
+    assert session.uses == 1
+    stats = pool.stats()
+    assert stats["failures"] == 1 and stats["recycled"] == 1
+
+
+def test_unhealthy_instance_replaced_at_lease():
+    backend = FakeBackend(unhealthy_after=2)
+    pool = make_pool(backend, size=1, max_uses=0)
+    sessions = [evaluate(pool)[0] for _ in range(5)]
+
+    assert sessions[0] is sessions[1]
+    assert sessions[2] is not sessions[0] and sessions[0].closed
+    assert backend.sessions_opened == 3
+    assert pool.stats()["unhealthy"] == 2
+
+
+def test_closed_pool_closes_idle_and_returning_instances():
+    backend = FakeBackend()
+    pool = make_pool(backend, size=2)
+    pool.warm()
+    with pool.lease() as session:
+        pool.close()
+        assert pool.stats()["idle"] == 0
+    assert session.closed
+    assert pool.stats()["closed"]
@@ -0,0 +1,31 @@
+"""Moteur de formules natif : mêmes valeurs qu'Excel pour toutes les formules des templates."""
+import glob
+import math
+
+import pytest
+
+from formula_engine import is_error, load_workbook_model
+
+TEMPLATE_PATHS = sorted(path for path in glob.glob("*.xlsm") if "copie" not in path.lower())
+
+
+def same_value(computed, cached) -> bool:
+    if is_error(computed) or is_error(cached):
+        return str(computed) == str(cached)
+    numbers = (int, float)
+    if isinstance(computed, numbers) and isinstance(cached, numbers) and not isinstance(computed, bool):
+        return math.isclose(computed, cached, rel_tol=1e-9, abs_tol=1e-6)
+    return computed == cached
+
+
+@pytest.mark.parametrize("path", TEMPLATE_PATHS)
+def test_formulas_match_workbook_cached_values(path):
+    # Sans entrée modifiée, chaque formule doit redonner la valeur enregistrée par Excel
+    model = load_workbook_model(path)
+    cell_ids = sorted(model._functions)
+    values = model.run({}, cell_ids)
+    differences = [(model._addresses[cell_id], values[cell_id], model._values[cell_id])
+                   for cell_id in cell_ids if not same_value(values[cell_id], model._values[cell_id])]
+
+    assert cell_ids
+    assert differences == []
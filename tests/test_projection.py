@@ -0,0 +1,79 @@
+"""/projection : planning mois par mois, valeurs reportées, séries cumulées et validation avant calcul."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+SCHEDULE = {
+    "tjm": 500,
+    "contract_type": "CDI",
+    "start": "2025-11",
+    "months": [
+        {"jours_travailles": 18},
+        {"jours_travailles": 0},
+        {"jours_travailles": 20, "tjm": 550},
+        {"jours_travailles": 15, "contract_type": "CDD"},
+    ],
+}
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def scheduled(monkeypatch):
+    calls = []
+    run_blocking = main.run_blocking
+
+    async def counting(function, *args):
+        calls.append(function.__name__)
+        return await run_blocking(function, *args)
+
+    monkeypatch.setattr(main, "run_blocking", counting)
+    return calls
+
+
+def test_projection_matches_convert_month_by_month(client):
+    projection = client.post("/projection", json=SCHEDULE).json()
+    months = projection["months"]
+
+    assert [month["month"] for month in months] == ["2025-11", "2025-12", "2026-01", "2026-02"]
+    assert [(month["tjm"], month["contract_type"]) for month in months] == \
+        [(500, "CDI"), (500, "CDI"), (550, "CDI"), (550, "CDD")]
+    assert months[1]["net_mensuel"] == 0 and months[1]["brut_mensuel"] == 0
+    for month in months[:1] + months[2:]:
+        single = client.get("/convert", params={"tjm": month["tjm"], "jours_travailles": month["jours_travailles"],
+                                                "contract_type": month["contract_type"]}).json()
+        for output in main.PROJECTION_SERIES:
+            assert month[output] == pytest.approx(single[output], rel=1e-6, abs=1e-6)
+    assert projection["series"]["net_mensuel"] == [month["net_mensuel"] for month in months]
+    assert projection["totals"]["net_mensuel"] == pytest.approx(sum(month["net_mensuel"] for month in months))
+    assert projection["cumulative"]["brut_mensuel"][-1] == projection["totals"]["brut_mensuel"]
+    assert projection["fallback_months"] == []
+
+
+def test_constant_schedule(client, scheduled):
+    projection = client.post("/projection", json={"tjm": 600, "months": [{"jours_travailles": 20}] * 3}).json()
+    assert scheduled == ["project_schedule"]
+    months = projection["months"]
+
+    assert [month["month"] for month in months] == ["1", "2", "3"]
+    assert months[0]["net_mensuel"] > 0 and "note" not in months[0]
+    assert months[0] == {**months[1], "month": "1"} == {**months[2], "month": "1"}
+
+
+@pytest.mark.parametrize("schedule", [
+    {"months": [{"jours_travailles": 18}]},
+    {"months": [{"jours_travailles": 18, "tjm": 500}, {"jours_travailles": -1}]},
+    {"tjm": 500, "start": "2025-13", "months": [{"jours_travailles": 18}]},
+    {"tjm": 500, "months": []},
+    {"tjm": 500, "months": [{"jours_travailles": 18}] * (main.PROJECTION_MAX_MONTHS + 1)},
+])
+def test_invalid_schedules_rejected_before_the_worker_pool(client, scheduled, schedule):
+    response = client.post("/projection", json=schedule)
+
+    assert response.status_code == 400
+    assert scheduled == []
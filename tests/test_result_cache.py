@@ -0,0 +1,105 @@
+"""Cache de résultats : LRU, durée de vie, clés normalisées et service des /convert répétés."""
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from result_cache import MISSING, ResultCache, canonical_number
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        # Le préchauffage met ses propres scénarios en cache : compteurs stables une fois terminé
+        deadline = time.monotonic() + 60
+        while not main.WARMUP.finished and time.monotonic() < deadline:
+            time.sleep(0.05)
+        yield test_client
+
+
+def test_least_recently_used_entry_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["size"] == 2
+    assert stats["hits"] == 3 and stats["misses"] == 1 and stats["hit_ratio"] == 0.75
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = ResultCache(ttl_seconds=10, clock=clock)
+    cache.put("a", 1)
+    clock.now += 9.9
+    assert cache.get("a") == 1
+    clock.now += 0.1
+
+    assert cache.get("a", None) is None
+    assert cache.stats()["expirations"] == 1 and len(cache) == 0
+
+
+def test_ttl_zero_never_expires_and_size_zero_disables():
+    clock = Clock()
+    cache = ResultCache(ttl_seconds=0, clock=clock)
+    cache.put("a", 1)
+    clock.now += 1e9
+    assert cache.get("a") == 1
+
+    disabled = ResultCache(max_entries=0)
+    disabled.put("a", 1)
+    assert disabled.get("a") is MISSING and len(disabled) == 0
+
+
+def test_rewrite_refreshes_the_entry():
+    clock = Clock()
+    cache = ResultCache(max_entries=2, ttl_seconds=10, clock=clock)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    clock.now += 5
+    cache.put("a", 10)
+    cache.put("c", 3)
+    clock.now += 6
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 10
+
+
+def test_canonical_number():
+    assert canonical_number(500) == canonical_number(500.0) == canonical_number(500.0000000001)
+    assert canonical_number(None) is None
+    assert canonical_number(-0.0) == 0.0 and str(canonical_number(-0.0)) == "0.0"
+
+
+def test_repeated_convert_served_from_cache(client):
+    before = client.post("/admin/result-cache/clear").json()
+    params = {"tjm": 512, "jours_travailles": 17, "code_commune": "92024"}
+    first = client.get("/convert", params=params).json()
+    second = client.get("/convert", params={**params, "tjm": "512.0"}).json()
+    stats = client.get("/admin/result-cache").json()
+
+    assert first == second
+    assert stats["size"] == 1
+    assert stats["hits"] - before["hits"] == 1 and stats["misses"] - before["misses"] == 1
+
+    cleared = client.post("/admin/result-cache/clear").json()
+    assert cleared["removed"] == 1 and cleared["size"] == 0
+
+
+def test_fallback_values_not_cached(client):
+    client.post("/admin/result-cache/clear")
+    client.get("/convert", params={"tjm": 500, "jours_travailles": 18, "code_commune": "99999"})
+    assert client.get("/admin/result-cache").json()["size"] == 0
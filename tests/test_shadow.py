@@ -0,0 +1,93 @@
+"""Mode shadow : écarts par sortie, statistiques, corpus des divergences et rejeu en arrière-plan."""
+import time
+
+import pytest
+
+from shadow import SHADOW_OUTPUTS, ShadowRunner, compare_outputs, read_corpus
+
+SERVED = {"brut_mensuel": 5000.0, "net_mensuel": 3900.0, "frais_gestion": 720.0, "provision_negocier": 0.0}
+
+
+def wait_idle(runner: ShadowRunner, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while runner.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert runner.pending == 0
+
+
+def test_compare_outputs():
+    reference = {**SERVED, "brut_mensuel": 5000.005, "net_mensuel": 3910.0, "provision_negocier": "#VALUE!"}
+    deltas = compare_outputs(SERVED, reference, abs_tolerance=0.01, rel_tolerance=1e-6)
+
+    assert set(deltas) == set(SHADOW_OUTPUTS)
+    assert deltas["brut_mensuel"]["match"] and deltas["frais_gestion"]["match"]
+    assert deltas["net_mensuel"]["abs"] == pytest.approx(10.0)
+    assert deltas["net_mensuel"]["rel"] == pytest.approx(10.0 / 3910.0)
+    assert not deltas["net_mensuel"]["match"]
+    # Valeur non numérique : pas d'écart calculable, comparée telle quelle
+    assert deltas["provision_negocier"]["abs"] is None and not deltas["provision_negocier"]["match"]
+
+
+def test_relative_delta_when_one_side_is_zero():
+    deltas = compare_outputs({"net_mensuel": 0.0}, {"net_mensuel": 0.0}, 0.01, 1e-6)
+    assert deltas["net_mensuel"]["rel"] == 0.0 and deltas["net_mensuel"]["match"]
+    deltas = compare_outputs({"net_mensuel": 0.0}, {"net_mensuel": 5.0}, 0.01, 1e-6)
+    assert deltas["net_mensuel"]["rel"] == 1.0
+
+
+def test_record_stats_and_corpus(tmp_path):
+    corpus = tmp_path / "shadow" / "corpus.jsonl"
+    runner = ShadowRunner(lambda parameters: SERVED, "reference", corpus_path=str(corpus))
+    parameters = {"tjm": 500, "jours_travailles": 18}
+    runner.record(parameters, SERVED, SERVED)
+    runner.record(parameters, SERVED, {**SERVED, "net_mensuel": 3950.0}, request_id="abc")
+    stats = runner.stats()
+    runner.shutdown()
+
+    assert stats["checked"] == 2 and stats["mismatches"] == 1
+    assert stats["divergence_rate"] == 0.5
+    assert stats["outputs"]["net_mensuel"]["max_abs"] == pytest.approx(50.0)
+    assert stats["outputs"]["net_mensuel"]["mismatches"] == 1
+    assert stats["outputs"]["brut_mensuel"]["mismatches"] == 0
+    entries = list(read_corpus(str(corpus)))
+    assert stats["corpus_entries"] == len(entries) == 1
+    assert entries[0]["parameters"] == parameters and entries[0]["request_id"] == "abc"
+    assert entries[0]["reference_backend"] == "reference"
+    assert not entries[0]["deltas"]["net_mensuel"]["match"]
+
+
+def test_submit_replays_in_background():
+    replayed = []
+
+    def reference(parameters):
+        replayed.append(parameters)
+        return SERVED
+
+    runner = ShadowRunner(reference, "reference", sample_rate=1.0)
+    assert runner.submit({"tjm": 500}, SERVED)
+    wait_idle(runner)
+    runner.shutdown()
+
+    assert replayed == [{"tjm": 500}]
+    assert runner.stats()["checked"] == 1 and runner.stats()["mismatches"] == 0
+
+
+def test_reference_errors_are_counted():
+    def reference(parameters):
+        raise RuntimeError("Excel unavailable")
+
+    runner = ShadowRunner(reference, "excel", sample_rate=1.0)
+    runner.submit({"tjm": 500}, SERVED)
+    wait_idle(runner)
+    runner.shutdown()
+
+    assert runner.stats()["reference_errors"] == 1 and runner.stats()["checked"] == 0
+
+
+def test_sampling_and_backpressure():
+    assert not ShadowRunner(lambda parameters: SERVED, "reference", sample_rate=0.0).submit({}, SERVED)
+
+    runner = ShadowRunner(lambda parameters: SERVED, "reference", sample_rate=1.0, max_pending=0)
+    assert not runner.submit({}, SERVED)
+    assert runner.stats()["skipped"] == 1
+    runner.shutdown()
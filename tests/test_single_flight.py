@@ -0,0 +1,94 @@
+"""Single flight : calculs identiques simultanés regroupés, annulations et nouvel essai après abandon."""
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class Computation:
+    """compute() comptant ses appels ; chaque appel attend ``release`` avant de rendre son numéro."""
+
+    def __init__(self, error: Exception = None):
+        self.calls = 0
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return call
+
+
+def test_concurrent_calls_share_one_computation():
+    async def scenario():
+        flights = SingleFlight()
+        compute = Computation()
+        waiting = [asyncio.ensure_future(flights.run("key", compute)) for _ in range(5)]
+        other = asyncio.ensure_future(flights.run("other", compute))
+        await asyncio.sleep(0)
+        assert flights.in_flight == 2
+        compute.release.set()
+        return await asyncio.gather(*waiting), await other, flights, compute
+
+    results, other, flights, compute = asyncio.run(scenario())
+
+    assert results == [results[0]] * 5 and other != results[0]
+    assert compute.calls == 2
+    stats = flights.stats()
+    assert stats["leaders"] == 2 and stats["coalesced"] == 4 and stats["in_flight"] == 0
+
+
+def test_exceptions_reach_every_caller():
+    async def scenario():
+        flights = SingleFlight()
+        compute = Computation(error=ValueError("boom"))
+        waiting = [asyncio.ensure_future(flights.run("key", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        compute.release.set()
+        return await asyncio.gather(*waiting, return_exceptions=True), compute
+
+    results, compute = asyncio.run(scenario())
+
+    assert compute.calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def scenario():
+        flights = SingleFlight()
+        compute = Computation()
+        first = asyncio.ensure_future(flights.run("key", compute))
+        second = asyncio.ensure_future(flights.run("key", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        compute.release.set()
+        return first, await second, flights
+
+    first, second, flights = asyncio.run(scenario())
+
+    assert first.cancelled() and second == 1
+    assert flights.stats()["cancelled"] == 1 and flights.stats()["abandoned"] == 0
+
+
+def test_caller_after_abandon_starts_a_new_computation():
+    async def scenario():
+        flights = SingleFlight()
+        compute = Computation()
+        abandoned = asyncio.ensure_future(flights.run("key", compute))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await abandoned
+        # Le calcul abandonné n'est pas encore terminé (_finish pas encore appelé)
+        compute.release.set()
+        return await flights.run("key", compute), flights, compute
+
+    result, flights, compute = asyncio.run(scenario())
+
+    assert result == 2 and compute.calls == 2
+    assert flights.stats()["abandoned"] == 1 and flights.in_flight == 0
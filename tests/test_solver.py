@@ -0,0 +1,127 @@
+"""Solveur (GoalSeek natif, version vectorisée) et mode inverse /solve-tjm."""
+import math
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from backends import NativeBackend
+from cell_mapping import GOAL_SEEK_CHANGING, GOAL_SEEK_TARGET, build_inputs
+from solver import SolverError, goal_seek, goal_seek_batch, solve
+from templates import TemplateRegistry
+
+# Entrées dont le TJM tombe dans un saut de B12(B4) (seuils du template, ex. F12)
+JUMP_SCENARIOS = [(400, 18), (360, 20), (720, 10), (1030, 10)]
+
+
+class FunctionScenario:
+    """Scenario réduit à une fonction : cellule 1 = f(cellule 0)."""
+
+    def __init__(self, function, start=1.0):
+        self.function = function
+        self.values = {0: start}
+
+    def set(self, cell_id, value):
+        self.values[cell_id] = value
+
+    def get(self, cell_id):
+        return self.values[0] if cell_id == 0 else self.function(self.values[0])
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="module")
+def template():
+    registry = TemplateRegistry(".")
+    registry.load_all()
+    return registry.get()
+
+
+def test_solve_smooth_function():
+    result = solve(lambda x: x * x - 2, 1.0)
+
+    assert result.converged and not result.discontinuity
+    assert result.value == pytest.approx(math.sqrt(2), abs=1e-7)
+
+
+def test_solve_stops_on_a_jump_at_the_closest_side():
+    # Aucune valeur n'atteint 0 : la fonction saute de -0.3 à +1 en x = 10
+    result = solve(lambda x: x - 10.3 if x < 10 else x - 9, 1.0)
+
+    assert result.converged and result.discontinuity
+    assert result.value == pytest.approx(10.0, rel=1e-9)
+    assert result.residual == pytest.approx(-0.3, abs=1e-6)
+
+
+def test_goal_seek_raises_when_the_goal_is_unreachable():
+    scenario = FunctionScenario(lambda x: 5.0)
+    with pytest.raises(SolverError):
+        goal_seek(scenario, 1, 10.0, 0)
+
+
+@pytest.mark.parametrize("tjm, jours", JUMP_SCENARIOS)
+def test_goal_seek_accepts_template_discontinuities(template, tjm, jours):
+    model = template.model
+    target, changing = model.cell_id(*GOAL_SEEK_TARGET), model.cell_id(*GOAL_SEEK_CHANGING)
+    inputs = build_inputs({"tjm": tjm, "jours_travailles": jours})
+    scenario = model.scenario(inputs, [GOAL_SEEK_TARGET])
+    result = goal_seek(scenario, target, tjm, changing)
+
+    assert result.converged
+    assert abs(result.residual) < tjm * 0.05
+
+
+def test_goal_seek_batch_matches_goal_seek(template):
+    model = template.model
+    target, changing = model.cell_id(*GOAL_SEEK_TARGET), model.cell_id(*GOAL_SEEK_CHANGING)
+    scenarios = JUMP_SCENARIOS + [(500, 18), (650.5, 21)]
+    columns = {}
+    rows = [build_inputs({"tjm": tjm, "jours_travailles": jours}) for tjm, jours in scenarios]
+    for key in rows[0]:
+        columns[key] = [row[key] for row in rows]
+    batch = model.batch(columns, [GOAL_SEEK_TARGET], size=len(rows))
+    seek = goal_seek_batch(batch, target, np.array([tjm for tjm, _ in scenarios], dtype=float), changing)
+
+    assert seek.converged.all()
+    for index, inputs in enumerate(rows):
+        single = goal_seek(model.scenario(inputs, [GOAL_SEEK_TARGET]), target, scenarios[index][0], changing)
+        assert seek.values[index] == pytest.approx(single.value, rel=1e-9)
+
+
+def test_native_backend_reaches_the_tjm(template):
+    inputs = build_inputs({"tjm": 500, "jours_travailles": 18, "contract_type": "CDI"})
+    values = NativeBackend().evaluate(template, inputs)
+
+    assert values["brut_mensuel"] > 0
+    assert values["net_mensuel"] < values["brut_mensuel"]
+    assert values["frais_gestion"] == pytest.approx(500 * 18 * 0.08)
+
+
+@pytest.mark.parametrize("tjm, jours", JUMP_SCENARIOS)
+def test_convert_does_not_fall_back_on_discontinuities(client, tjm, jours):
+    single = client.get("/convert", params={"tjm": tjm, "jours_travailles": jours}).json()
+    batch = client.post("/convert/batch", json=[{"tjm": tjm, "jours_travailles": jours}, {"tjm": 1, "jours_travailles": 1}])
+
+    assert "note" not in single
+    assert batch.json()[0] == single
+
+
+@pytest.mark.parametrize("net_mensuel, jours", [(4000, 18), (2500, 10), (6200, 21), (9000, 22)])
+def test_solve_tjm_round_trip(client, net_mensuel, jours):
+    response = client.get("/solve-tjm", params={"net_mensuel": net_mensuel, "jours_travailles": jours})
+    assert response.status_code == 200
+    solved = response.json()
+    assert solved["solver"]["converged"]
+
+    check = client.get("/convert", params={"tjm": solved["tjm"], "jours_travailles": jours}).json()
+    assert check["net_mensuel"] == pytest.approx(net_mensuel, abs=0.01 + abs(solved["solver"]["residual"]))
+
+
+def test_solve_tjm_rejects_non_positive_values(client):
+    assert client.get("/solve-tjm", params={"net_mensuel": 4000, "jours_travailles": 0}).status_code == 400
+    assert client.get("/solve-tjm", params={"net_mensuel": -1, "jours_travailles": 18}).status_code == 400
@@ -0,0 +1,114 @@
+"""/convert/upload : lecture CSV/XLSX, numéros de ligne du fichier d'origine et ligne #summary."""
+import csv
+import io
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from uploads import UploadError, normalize_header, read_upload
+
+WORKBOOK = """<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+          xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Simulations" sheetId="1" r:id="rId1"/></sheets></workbook>"""
+WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="worksheet" Target="worksheets/sheet1.xml"/></Relationships>"""
+SHEET = """<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>
+<row r="2"><c r="A2" t="inlineStr"><is><t>TJM</t></is></c><c r="B2" t="inlineStr"><is><t>Jours travaillés</t></is></c>
+<c r="C2" t="inlineStr"><is><t>jours_travailles</t></is></c></row>
+<row r="3"><c r="A3"><v>500</v></c><c r="C3"><v>18</v></c></row>
+<row r="5"><c r="A5"><v>650.5</v></c><c r="C5"><v>20</v></c></row>
+</sheetData></worksheet>"""
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def xlsx_bytes() -> bytes:
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as archive:
+        archive.writestr("xl/workbook.xml", WORKBOOK)
+        archive.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS)
+        archive.writestr("xl/worksheets/sheet1.xml", SHEET)
+    return output.getvalue()
+
+
+def upload(client, content: bytes, filename: str = "simulations.csv", **params):
+    return client.post("/convert/upload", params=params, files={"file": (filename, content)})
+
+
+def result_rows(response, delimiter=","):
+    rows = list(csv.reader(io.StringIO(response.text), delimiter=delimiter))
+    summary = dict(field.split("=", 1) for field in rows[-1][1:])
+    assert rows[0] == main.UPLOAD_COLUMNS and rows[-1][0] == "#summary"
+    return [dict(zip(rows[0], row)) for row in rows[1:-1]], summary
+
+
+def test_normalize_header():
+    assert normalize_header(" Code commune ") == normalize_header("code-commune") == \
+        normalize_header("codeCommune") == "code_commune"
+
+
+def test_csv_keeps_line_numbers_of_the_file(client):
+    content = ("\n"
+               "tjm;jours_travailles;code_commune\n"
+               "500;18;92024\n"
+               "\n"
+               "650,5;20;\n"
+               "500;0;\n"
+               ";;\n"
+               "abc;18;\n").encode()
+    response = upload(client, content)
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="simulations_resultats.csv"'
+    rows, summary = result_rows(response, delimiter=";")
+
+    assert [(row["ligne"], row["statut"]) for row in rows] == \
+        [("3", "ok"), ("5", "ok"), ("6", "erreur"), ("8", "erreur")]
+    assert rows[1]["tjm"] == "650.5"
+    assert summary["rows"] == "4" and summary["ok"] == "2" and summary["errors"] == "2"
+    assert summary["skipped"] == "2" and summary["fallback"] == "0" and summary["truncated"] == "false"
+
+
+def test_upload_results_match_convert(client):
+    rows, _ = result_rows(upload(client, b"tjm,jours_travailles,contract_type\n500,18,CDI\n"))
+    single = client.get("/convert", params={"tjm": 500, "jours_travailles": 18, "contract_type": "CDI"}).json()
+
+    assert float(rows[0]["net_mensuel"]) == pytest.approx(single["net_mensuel"])
+    assert float(rows[0]["brut_mensuel"]) == pytest.approx(single["brut_mensuel"])
+
+
+def test_xlsx_rows_numbered_like_the_sheet(client):
+    response = upload(client, xlsx_bytes(), filename="simulations.xlsx")
+    rows, summary = result_rows(response)
+
+    assert [(row["ligne"], row["tjm"], row["jours_travailles"], row["statut"]) for row in rows] == \
+        [("3", "500", "18", "ok"), ("5", "650.5", "20", "ok")]
+    assert summary["rows"] == "2" and summary["skipped"] == "0"
+
+
+def test_row_limit_truncates_the_file(client, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_MAX_ROWS", 2)
+    _, summary = result_rows(upload(client, b"tjm,jours_travailles\n" + b"500,18\n" * 5))
+    assert summary["rows"] == "2" and summary["truncated"] == "true"
+
+
+@pytest.mark.parametrize("content, filename", [
+    (b"", "simulations.csv"),
+    (b"not a zip", "simulations.xlsx"),
+])
+def test_unreadable_files_rejected(client, content, filename):
+    assert upload(client, content, filename=filename).status_code == 400
+
+
+def test_missing_file_or_sheet_rejected(client):
+    assert client.post("/convert/upload", data={"other": "x"}).status_code == 400
+    assert upload(client, xlsx_bytes(), filename="simulations.xlsx", sheet="Autre").status_code == 400
+    with pytest.raises(UploadError):
+        read_upload(io.BytesIO(b"\n\n"))
@@ -0,0 +1,112 @@
+"""Préchauffage : étapes obligatoires ou facultatives, arrêt, /health/live et /health/ready."""
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from warmup import FAILED, READY, Warmup
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def wait_finished(warmup: Warmup, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not warmup.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert warmup.finished
+
+
+def failing():
+    raise RuntimeError("boom")
+
+
+def test_stages_run_in_order_with_their_details():
+    order = []
+    warmup = Warmup()
+    warmup.add("first", lambda: order.append("first") or {"count": 3})
+    warmup.add("second", lambda: order.append("second"))
+    assert warmup.status()["status"] == "pending"
+    warmup.start()
+    wait_finished(warmup)
+    status = warmup.status()
+
+    assert order == ["first", "second"]
+    assert warmup.ready and status["status"] == READY
+    assert status["stages"]["first"]["detail"] == {"count": 3}
+    assert set(warmup.stage_seconds()) == {"first", "second"}
+
+
+def test_failed_optional_stage_is_skipped():
+    warmup = Warmup()
+    warmup.add("optional", failing, required=False)
+    warmup.add("required", lambda: None)
+    warmup.start()
+    wait_finished(warmup)
+    stages = warmup.status()["stages"]
+
+    assert warmup.ready
+    assert stages["optional"]["status"] == FAILED and stages["optional"]["error"] == "boom"
+    assert stages["required"]["status"] == READY
+
+
+def test_failed_required_stage_leaves_the_worker_not_ready():
+    warmup = Warmup()
+    warmup.add("required", failing)
+    warmup.add("next", lambda: None)
+    warmup.start()
+    wait_finished(warmup)
+
+    assert warmup.finished and not warmup.ready
+    assert warmup.status()["status"] == FAILED
+    # Les étapes suivantes s'exécutent quand même
+    assert warmup.status()["stages"]["next"]["status"] == READY
+
+
+def test_stop_skips_remaining_stages():
+    release = threading.Event()
+    warmup = Warmup()
+    warmup.add("slow", release.wait)
+    warmup.add("skipped", lambda: None)
+    warmup.start()
+    warmup._stop.set()
+    release.set()
+    warmup.stop()
+
+    assert not warmup.finished
+    assert warmup.status()["stages"]["skipped"]["status"] == "pending"
+
+
+def test_readiness_follows_the_warmup(client, monkeypatch):
+    release = threading.Event()
+    warmup = Warmup()
+    warmup.add("templates", lambda: release.wait(5))
+    monkeypatch.setattr(main, "WARMUP", warmup)
+    warmup.start()
+    try:
+        assert client.get("/health/live").status_code == 200
+        waiting = client.get("/health/ready")
+        assert waiting.status_code == 503
+        assert waiting.headers["retry-after"] == "1"
+        assert waiting.json()["stages"]["templates"]["status"] == "running"
+        assert "portalia_ready 0" in client.get("/metrics").text
+    finally:
+        release.set()
+    wait_finished(warmup)
+
+    ready = client.get("/health/ready")
+    assert ready.status_code == 200 and ready.json()["status"] == READY
+    assert "portalia_ready 1" in client.get("/metrics").text
+
+
+def test_application_warmup_stages(client):
+    wait_finished(main.WARMUP, timeout=60)
+    stages = client.get("/health/ready").json()["stages"]
+
+    assert {"templates", "commune_index", "hot_scenarios"} <= set(stages)
+    assert all(stage["status"] == READY for stage in stages.values() if stage["required"])
@@ -0,0 +1,198 @@
+"""
+Lecture incrémentale des fichiers de simulations envoyés à ``/convert/upload``.
+
+Un fichier CSV ou XLSX contient une ligne par simulation ; la première ligne
+donne les noms des paramètres de ``/convert`` (``tjm``, ``jours_travailles``,
+``contract_type``, ``code_commune``...). Les lignes sont produites une à une :
+le CSV est décodé au fil de la lecture, la feuille XLSX est parsée par
+morceaux avec expat, sans construire d'arbre ni charger tout le classeur.
+Chaque ligne garde son numéro dans le fichier d'origine ; les lignes vides
+sont signalées (enregistrement ``None``) plutôt qu'ignorées en silence.
+"""
+import csv
+import io
+import re
+import zipfile
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+from xml.parsers import expat
+
+from formula_engine import column_index, read_shared_strings, shared_strings_path, workbook_sheets
+
+# Taille des morceaux lus dans la feuille (XLSX)
+READ_CHUNK_SIZE = 64 * 1024
+
+CSV_DELIMITERS = ",;\t"
+
+_DECIMAL_COMMA_RE = re.compile(r"^-?\d+,\d+$")
+_HEADER_SEPARATORS_RE = re.compile(r"[\s\-]+")
+_CAMEL_CASE_RE = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+
+class UploadError(ValueError):
+    """The uploaded file cannot be read (unknown format, no header...)."""
+
+
+def normalize_header(name: str) -> str:
+    """"Code commune", "code-commune" et "codeCommune" donnent "code_commune"."""
+    name = _CAMEL_CASE_RE.sub("_", name.strip())
+    return _HEADER_SEPARATORS_RE.sub("_", name).lower()
+
+
+def clean_value(value: Any) -> Any:
+    """Cellule vide -> None ; "500,5" (export Excel français) -> "500.5"."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if not isinstance(value, str):
+        return value
+    value = value.strip()
+    if value == "":
+        return None
+    if _DECIMAL_COMMA_RE.match(value):
+        return value.replace(",", ".")
+    return value
+
+
+Record = Tuple[int, Optional[Dict[str, Any]]]
+
+
+def _records(header: List[Any], rows: Iterator[Tuple[int, List[Any]]]) -> Iterator[Record]:
+    """(line number, record) per data row; a blank row gives (line number, None)."""
+    names = [normalize_header(str(name)) if name is not None else "" for name in header]
+    for line, row in rows:
+        record = {name: clean_value(value) for name, value in zip(names, row) if name}
+        yield line, record if any(value is not None for value in record.values()) else None
+
+
+# -- CSV ----------------------------------------------------------------------
+
+def read_csv(stream: IO[bytes]) -> Tuple[str, Iterator[Record]]:
+    """(delimiter, records) of a CSV file; the delimiter is detected on the header line."""
+    # Décodage incrémental (TextIOWrapper lit le fichier par blocs)
+    lines = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    leading = 0
+    for header_line in lines:
+        if header_line.strip():
+            break
+        leading += 1
+    else:
+        raise UploadError("Empty file")
+    delimiter = max(CSV_DELIMITERS, key=header_line.count)
+    reader = csv.reader(_chain(header_line, lines), delimiter=delimiter)
+    header = next(reader)
+    return delimiter, _records(header, _numbered_rows(reader, leading))
+
+
+def _chain(first: str, rest: Iterator[str]) -> Iterator[str]:
+    yield first
+    yield from rest
+
+
+def _numbered_rows(reader, offset: int) -> Iterator[Tuple[int, List[str]]]:
+    # Numéro de la première ligne physique de l'enregistrement (un champ entre guillemets peut en couvrir plusieurs)
+    previous = reader.line_num
+    for row in reader:
+        yield offset + previous + 1, row
+        previous = reader.line_num
+
+
+# -- XLSX ---------------------------------------------------------------------
+
+def _sheet_rows(archive: zipfile.ZipFile, sheet_path: str,
+                shared_strings: List[str]) -> Iterator[Tuple[int, List[Any]]]:
+    """(row number, values) of the rows of a worksheet, parsed one chunk at a time."""
+    rows: List[Tuple[int, List[Any]]] = []
+    row: Dict[int, Any] = {}
+    cell = {"column": 0, "type": None, "text": False, "row": 0}
+    parts: List[str] = []
+
+    def start(name, attributes):
+        if name == "row":
+            row.clear()
+            number = attributes.get("r", "")
+            cell["row"] = int(number) if number.isdigit() else cell["row"] + 1
+        elif name == "c":
+            reference = attributes.get("r", "")
+            letters = reference.rstrip("0123456789")
+            cell["column"] = column_index(letters) if letters else max(row, default=0) + 1
+            cell["type"] = attributes.get("t")
+            parts.clear()
+        elif name in ("v", "t"):
+            cell["text"] = True
+
+    def end(name):
+        if name in ("v", "t"):
+            cell["text"] = False
+        elif name == "c":
+            text = "".join(parts)
+            cell_type = cell["type"]
+            if cell_type == "s":
+                value = shared_strings[int(text)] if text else None
+            elif cell_type in ("str", "inlineStr"):
+                value = text
+            elif cell_type == "b":
+                value = "true" if text == "1" else "false"
+            elif cell_type == "e" or not text:
+                value = None
+            else:
+                value = float(text)
+            row[cell["column"]] = value
+        elif name == "row":
+            rows.append((cell["row"], [row.get(column) for column in range(1, max(row, default=0) + 1)]))
+
+    def data(text):
+        if cell["text"]:
+            parts.append(text)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler, parser.EndElementHandler, parser.CharacterDataHandler = start, end, data
+    with archive.open(sheet_path) as stream:
+        while True:
+            chunk = stream.read(READ_CHUNK_SIZE)
+            parser.Parse(chunk, not chunk)
+            yield from rows
+            rows.clear()
+            if not chunk:
+                return
+
+
+def read_xlsx(stream: IO[bytes], sheet: Optional[str] = None) -> Iterator[Record]:
+    """Records of the first worksheet (or ``sheet``) of an XLSX/XLSM file."""
+    try:
+        archive = zipfile.ZipFile(stream)
+        sheets = workbook_sheets(archive)
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise UploadError(f"Not a valid XLSX file: {str(e)}")
+    sheet_path = next((path for name, path, _ in sheets if sheet is None or name == sheet), None)
+    if sheet_path is None:
+        raise UploadError(f"Sheet '{sheet}' not found" if sheet else "The workbook has no worksheet")
+    rows = _sheet_rows(archive, sheet_path, read_shared_strings(archive, shared_strings_path(archive)))
+    header = next((values for _, values in rows if any(value is not None for value in values)), None)
+    if header is None:
+        raise UploadError("Empty worksheet")
+    return _records(header, rows)
+
+
+def read_upload(stream: IO[bytes], filename: Optional[str] = None,
+                sheet: Optional[str] = None) -> Tuple[str, str, Iterator[Record]]:
+    """
+    (format, CSV delimiter for the response, (line number, record) pairs) of an uploaded file.
+    XLSX is recognised by its ZIP signature, whatever the file name.
+    """
+    signature = stream.read(4)
+    stream.seek(0)
+    if signature.startswith(b"PK\x03\x04"):
+        return "xlsx", ",", read_xlsx(stream, sheet)
+    if filename and filename.lower().endswith((".xlsx", ".xlsm")):
+        raise UploadError("Not a valid XLSX file")
+    delimiter, records = read_csv(stream)
+    return "csv", delimiter, records
+
+
+def csv_text(rows: List[List[Any]], delimiter: str = ",") -> str:
+    """Rows formatted as CSV text (one response chunk)."""
+    output = io.StringIO()
+    csv.writer(output, delimiter=delimiter, lineterminator="\n").writerows(rows)
+    return output.getvalue()
@@ -0,0 +1,406 @@
+"""
+Evaluation vectorisée (NumPy) du modèle compilé.
+
+Les formules du cône dépendant des entrées sont recompilées avec des
+opérations sur tableaux : chaque cellule contient soit un scalaire (même
+valeur pour toutes les lignes), soit un tableau NumPy d'une valeur par
+ligne. Les tableaux numériques sont en float64 ; dès qu'une ligne contient
+du texte ou une erreur Excel, la colonne passe en dtype object et les
+erreurs se propagent ligne par ligne comme en mode scalaire.
+"""
+import logging
+from functools import reduce
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from formula_engine import (
+    ERRORS, FUNCTIONS, BoundRange, FormulaError, WorkbookModel, _Compiler, _concat, _eq, _iferror, _ne,
+    _truth, fn_abs, fn_round, fn_vlookup, is_error, make_address,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------
+# Colonnes
+# ---------------------------------------------------------------------------
+
+def column(values: Sequence[Any]) -> np.ndarray:
+    """Per-row values as an array: float64 when all numeric, object otherwise."""
+    if isinstance(values, np.ndarray):
+        if values.dtype.kind in "iu":
+            return values.astype(float)
+        if values.dtype.kind in "fbO":
+            return values
+        values = values.tolist()
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return np.array(values, dtype=float)
+    result = np.empty(len(values), dtype=object)
+    result[:] = list(values)
+    return _tidy(result)
+
+
+def is_column(value: Any) -> bool:
+    return isinstance(value, (np.ndarray, list, tuple))
+
+
+def _tidy(result: np.ndarray) -> np.ndarray:
+    """Narrow an object array back to bool/float64 when it holds no text or error."""
+    if result.dtype != object:
+        return result
+    kinds = set(map(type, result.tolist()))
+    if kinds <= {bool}:
+        return result.astype(bool)
+    if kinds <= {int, float}:
+        return result.astype(float)
+    return result
+
+
+def _operand(value: Any) -> Any:
+    """Text and errors become 0-d object arrays so np.where never builds string arrays."""
+    if isinstance(value, (np.ndarray, int, float, bool)):
+        return value
+    operand = np.empty((), dtype=object)
+    operand[()] = value
+    return operand
+
+
+def _numeric(value: Any) -> bool:
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in "fb"
+    return isinstance(value, (int, float))
+
+
+_error_mask = np.frompyfunc(is_error, 1, 1)
+
+
+def errors(values: np.ndarray) -> np.ndarray:
+    """Boolean mask of the rows holding an Excel error."""
+    if values.dtype != object:
+        return np.zeros(values.shape, dtype=bool)
+    return _error_mask(values).astype(bool)
+
+
+def _safe(function: Callable, *args) -> Any:
+    try:
+        return function(*args)
+    except ZeroDivisionError:
+        return ERRORS["#DIV/0!"]
+    except TypeError as e:
+        return ERRORS.get(str(e), ERRORS["#VALUE!"])
+    except Exception:
+        return ERRORS["#VALUE!"]
+
+
+# ---------------------------------------------------------------------------
+# Opérateurs et fonctions Excel (mode vectoriel)
+# ---------------------------------------------------------------------------
+
+def _elementwise(scalar: Callable, numeric: Callable) -> Callable:
+    """Binary operator: NumPy fast path on numbers, per-element fallback otherwise."""
+    fallback = np.frompyfunc(lambda a, b: _safe(scalar, a, b), 2, 1)
+
+    def apply(a, b):
+        if not isinstance(a, np.ndarray) and not isinstance(b, np.ndarray):
+            return scalar(a, b)
+        if numeric is not None and _numeric(a) and _numeric(b):
+            return numeric(a, b)
+        return _tidy(fallback(_operand(a), _operand(b)))
+    return apply
+
+
+def _compare(operator: Callable) -> Callable:
+    def scalar(a, b):
+        if is_error(a):
+            return a
+        if is_error(b):
+            return b
+        return operator(a, b)
+    return scalar
+
+
+_vector_eq = _elementwise(_eq, lambda a, b: a == b)
+_vector_ne = _elementwise(_ne, lambda a, b: a != b)
+_vector_concat = _elementwise(_concat, None)
+_vector_lt = _elementwise(_compare(lambda a, b: a < b), lambda a, b: a < b)
+_vector_gt = _elementwise(_compare(lambda a, b: a > b), lambda a, b: a > b)
+_vector_le = _elementwise(_compare(lambda a, b: a <= b), lambda a, b: a <= b)
+_vector_ge = _elementwise(_compare(lambda a, b: a >= b), lambda a, b: a >= b)
+
+
+def _truth_value(value):
+    if is_error(value):
+        return value
+    if isinstance(value, str):
+        return ERRORS["#VALUE!"]
+    return bool(value)
+
+
+_truth_values = np.frompyfunc(_truth_value, 1, 1)
+
+
+def _branch(thunk: Callable) -> Any:
+    return _operand(_safe(thunk))
+
+
+def _vector_if(condition, when_true: Callable, when_false: Callable):
+    """IF with a per-row condition; a branch is only evaluated if some row needs it."""
+    if not isinstance(condition, np.ndarray):
+        return when_true() if _truth(condition) else when_false()
+    failed = None
+    if condition.dtype == object:
+        truth = _truth_values(condition)
+        failed = errors(truth)
+        mask = np.where(failed, False, truth).astype(bool)
+        if not failed.any():
+            failed = None
+    else:
+        mask = condition.astype(bool)
+    if failed is None and mask.all():
+        return when_true()
+    if failed is None and not mask.any():
+        return when_false()
+    result = np.where(mask, _branch(when_true) if mask.any() else 0.0,
+                      _branch(when_false) if not mask.all() else 0.0)
+    if failed is not None:
+        result = result.astype(object)
+        result[failed] = truth[failed]
+    return _tidy(result) if result.dtype == object else result
+
+
+def _vector_iferror(value, fallback):
+    if not isinstance(value, np.ndarray):
+        return _iferror(value, fallback)
+    failed = errors(value)
+    if not failed.any():
+        return value
+    return _tidy(np.where(failed, _operand(fallback), value))
+
+
+def _flatten(args) -> List[Any]:
+    values = []
+    for arg in args:
+        if isinstance(arg, BoundRange):
+            values.extend(arg.values())
+        else:
+            values.append(arg)
+    return values
+
+
+def _sum_operand(value):
+    """Numbers are summed, text is ignored, errors propagate (like SUM)."""
+    if isinstance(value, np.ndarray):
+        if value.dtype != object:
+            return value
+        return _tidy(_sum_terms(value))
+    if is_error(value):
+        raise TypeError(value.code)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return 0.0
+
+
+_sum_terms = np.frompyfunc(
+    lambda value: value if is_error(value) or (isinstance(value, (int, float)) and not isinstance(value, bool)) else 0.0,
+    1, 1)
+
+
+def fn_sum(*args):
+    return sum((_sum_operand(value) for value in _flatten(args)), 0.0)
+
+
+def _extremum(numeric: Callable, scalar: Callable) -> Callable:
+    per_row = np.frompyfunc(lambda a, b: _safe(scalar, a, b), 2, 1)
+
+    def apply(*args):
+        values = [value for value in _flatten(args) if isinstance(value, np.ndarray) or
+                  (isinstance(value, (int, float)) and not isinstance(value, bool)) or is_error(value)]
+        if not values:
+            return 0
+        if not any(isinstance(value, np.ndarray) for value in values):
+            return scalar(*values)
+        if all(_numeric(value) for value in values):
+            return reduce(numeric, values)
+        return _tidy(reduce(lambda a, b: per_row(_operand(a), _operand(b)), values))
+    return apply
+
+
+def _logical(numeric: Callable, scalar: Callable) -> Callable:
+    def apply(*args):
+        values = _flatten(args)
+        if not any(isinstance(value, np.ndarray) for value in values):
+            return scalar(*values)
+        masks = []
+        for value in values:
+            if isinstance(value, np.ndarray) and value.dtype == object:
+                truth = _truth_values(value)
+                if errors(truth).any():
+                    raise TypeError("#VALUE!")
+                masks.append(truth.astype(bool))
+            elif isinstance(value, np.ndarray):
+                masks.append(value.astype(bool))
+            else:
+                masks.append(_truth(value))
+        return reduce(numeric, masks)
+    return apply
+
+
+def _per_row(scalar: Callable) -> Callable:
+    """Generic vector version of a scalar function: loop over rows only when needed."""
+    def apply(*args):
+        arrays = [arg for arg in args if isinstance(arg, np.ndarray)]
+        if not arrays:
+            return scalar(*args)
+        size = len(arrays[0])
+        return column([_safe(scalar, *(arg[row] if isinstance(arg, np.ndarray) else arg for arg in args))
+                       for row in range(size)])
+    return apply
+
+
+def _unary(numeric: Callable, scalar: Callable) -> Callable:
+    generic = _per_row(scalar)
+
+    def apply(value, *args):
+        if isinstance(value, np.ndarray) and value.dtype.kind == "f" and \
+                not any(isinstance(arg, np.ndarray) for arg in args):
+            return numeric(value, *args)
+        return generic(value, *args)
+    return apply
+
+
+def _round(values: np.ndarray, digits=0) -> np.ndarray:
+    factor = 10.0 ** int(digits)
+    return np.sign(values) * np.floor(np.abs(values) * factor + 0.5 + 1e-9) / factor
+
+
+def fn_vlookup_vector(key, table, col, approximate=True):
+    """VLOOKUP of a column of keys: each distinct key is looked up once."""
+    if not isinstance(key, np.ndarray):
+        return _per_row(fn_vlookup)(key, table, col, approximate)
+    if isinstance(col, np.ndarray) or isinstance(approximate, np.ndarray):
+        return _per_row(fn_vlookup)(key, table, col, approximate)
+    found: Dict[Any, Any] = {}
+    results = []
+    for value in key.tolist():
+        # TRUE, 1 et une cellule vide se confondent dans un dict (1 == True, 0.0 == EMPTY)
+        lookup_key = (type(value), value) if isinstance(value, (str, int, float)) else id(value)
+        if lookup_key not in found:
+            found[lookup_key] = _safe(fn_vlookup, value, table, col, approximate)
+        results.append(found[lookup_key])
+    return column(results)
+
+
+VECTOR_FUNCTIONS: Dict[str, Callable] = {name: _per_row(function) for name, function in FUNCTIONS.items()}
+VECTOR_FUNCTIONS.update({
+    "SUM": fn_sum,
+    "MIN": _extremum(np.minimum, FUNCTIONS["MIN"]),
+    "MAX": _extremum(np.maximum, FUNCTIONS["MAX"]),
+    "AND": _logical(np.logical_and, FUNCTIONS["AND"]),
+    "OR": _logical(np.logical_or, FUNCTIONS["OR"]),
+    "ABS": _unary(np.abs, fn_abs),
+    "ROUND": _unary(_round, fn_round),
+    "VLOOKUP": fn_vlookup_vector,
+})
+
+
+# ---------------------------------------------------------------------------
+# Compilation et évaluation
+# ---------------------------------------------------------------------------
+
+def compile_vector_functions(model: WorkbookModel, cell_ids: Iterable[int]) -> Dict[int, Callable]:
+    """Vector versions of the formulas of ``cell_ids`` (compiled once, cached on the model)."""
+    missing = [cell_id for cell_id in cell_ids if cell_id not in model._vector_functions]
+    if missing:
+        sources = []
+        for cell_id in missing:
+            compiler = _Compiler(model, vector=True)
+            try:
+                sources.append(compiler.expression(model.parse(cell_id)))
+            except FormulaError as e:
+                sheet, row, col = model._addresses[cell_id]
+                logger.warning("Cannot vectorise %s!%s: %s", sheet, make_address(row, col), e)
+                sources.append("_ERR['#NAME?']")
+        body = ",\n".join(f"lambda v: {source}" for source in sources)
+        namespace = dict(model._namespace)
+        namespace.update({
+            "_F": VECTOR_FUNCTIONS,
+            "_eq": _vector_eq,
+            "_ne": _vector_ne,
+            "_concat": _vector_concat,
+            "_lt": _vector_lt,
+            "_gt": _vector_gt,
+            "_le": _vector_le,
+            "_ge": _vector_ge,
+            "_if": _vector_if,
+            "_iferror": _vector_iferror,
+        })
+        exec(compile(f"_FUNCTIONS = (\n{body},\n)", f"<vector formulas {model.path}>", "exec"), namespace)
+        model._vector_functions.update(zip(missing, namespace["_FUNCTIONS"]))
+    return model._vector_functions
+
+
+def _execute(model: WorkbookModel, values: List[Any], cells: List[int], fixed) -> None:
+    functions = compile_vector_functions(model, cells)
+    with np.errstate(all="ignore"):
+        for cell_id in cells:
+            if cell_id in fixed:
+                continue
+            result = _safe(functions[cell_id], values)
+            if isinstance(result, np.generic):
+                result = result.item()
+            elif isinstance(result, np.ndarray) and result.dtype.kind == "f":
+                finite = np.isfinite(result)
+                if not finite.all():
+                    # Division par zéro (inf/nan) : #DIV/0! sur les lignes concernées
+                    result = result.astype(object)
+                    result[~finite] = ERRORS["#DIV/0!"]
+            values[cell_id] = result
+
+
+class BatchScenario:
+    """
+    Vectorised counterpart of ``Scenario``: inputs may be columns (one value
+    per row). Cells that do not depend on a column are evaluated once, in
+    scalar mode; only the dirty cone is evaluated on arrays. ``size`` gives
+    the number of rows when no input is a column (all rows identical).
+    """
+
+    def __init__(self, model: WorkbookModel, inputs: Dict[int, Any], targets: List[int],
+                 size: Optional[int] = None):
+        self.model = model
+        self.targets = frozenset(targets)
+        self.fixed = set(inputs)
+        columns = {cell_id: column(value) for cell_id, value in inputs.items() if is_column(value)}
+        sizes = {len(values) for values in columns.values()}
+        if size is not None:
+            sizes.add(size)
+        if len(sizes) > 1:
+            raise ValueError(f"Input columns have different lengths: {sorted(sizes)}")
+        self.size = sizes.pop() if sizes else 1
+
+        # Passe scalaire (première ligne) pour tout ce qui ne dépend pas des colonnes
+        first_row = {cell_id: (values[0] if cell_id in columns and len(values) else values)
+                     for cell_id, values in inputs.items()}
+        self.values = model.run(first_row, targets)
+        if columns:
+            for cell_id, values in columns.items():
+                self.values[cell_id] = values
+            _execute(model, self.values, model._cone(self.targets, frozenset(columns)), self.fixed)
+
+    def get(self, cell_id: int) -> Any:
+        """Scalar (same for every row) or array of per-row values."""
+        return self.values[cell_id]
+
+    def get_column(self, cell_id: int) -> np.ndarray:
+        value = self.values[cell_id]
+        if isinstance(value, np.ndarray):
+            return value
+        result = np.empty(self.size, dtype=float if _numeric(value) and not isinstance(value, bool) else object)
+        result[:] = value
+        return result
+
+    def set(self, cell_id: int, value: Any) -> None:
+        self.values[cell_id] = column(value) if is_column(value) else value
+        self.fixed.add(cell_id)
+        _execute(self.model, self.values, self.model._cone(self.targets, cell_id), self.fixed)
@@ -0,0 +1,114 @@
+"""
+Préchauffage au démarrage et état de disponibilité du worker.
+
+Les étapes (chargement des templates, index des communes, scénarios
+fréquents...) s'exécutent dans un thread en arrière-plan pendant que le
+serveur accepte déjà les connexions : ``/health/live`` répond tout de suite,
+``/health/ready`` seulement quand les étapes obligatoires sont terminées,
+pour que le répartiteur de charge n'envoie du trafic qu'à un worker chaud.
+La durée de chaque étape est conservée et exposée.
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, READY, FAILED = "pending", "running", "ready", "failed"
+
+
+class WarmupStage:
+    __slots__ = ("name", "required", "status", "seconds", "detail", "error")
+
+    def __init__(self, name: str, required: bool):
+        self.name = name
+        self.required = required
+        self.status = PENDING
+        self.seconds: Optional[float] = None
+        self.detail: Any = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        entry = {"status": self.status, "required": self.required, "seconds": self.seconds}
+        if self.detail is not None:
+            entry["detail"] = self.detail
+        if self.error is not None:
+            entry["error"] = self.error
+        return entry
+
+
+class Warmup:
+    """
+    Ordered warm-up stages run once in a daemon thread. A failed optional stage
+    is logged and skipped; a failed required stage leaves the worker not ready.
+    """
+
+    def __init__(self):
+        self._steps: List[Tuple[WarmupStage, Callable[[], Any]]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def add(self, name: str, step: Callable[[], Any], required: bool = True) -> None:
+        """Append a stage; ``step()`` may return a JSON-friendly detail (counts...)."""
+        self._steps.append((WarmupStage(name, required), step))
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self.run, name="portalia-warmup", daemon=True)
+        self._thread.start()
+
+    def run(self) -> None:
+        for stage, step in self._steps:
+            if self._stop.is_set():
+                return
+            stage.status = RUNNING
+            start_time = time.perf_counter()
+            try:
+                stage.detail = step()
+                stage.status = READY
+            except Exception as e:
+                stage.status, stage.error = FAILED, str(e)
+                log = logger.error if stage.required else logger.warning
+                log("Warm-up stage %s failed: %s", stage.name, e)
+            stage.seconds = time.perf_counter() - start_time
+        self.finished_at = time.time()
+        logger.info("Warm-up %s in %.2f seconds", "complete" if self.ready else "FAILED",
+                    self.finished_at - self.started_at,
+                    extra={"stages_ms": {stage.name: round((stage.seconds or 0) * 1000, 3)
+                                         for stage, _ in self._steps}})
+
+    def stop(self, timeout: float = 1.0) -> None:
+        """Skip the remaining stages (shutdown during warm-up)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def ready(self) -> bool:
+        return self.finished and all(stage.status == READY for stage, _ in self._steps if stage.required)
+
+    def stage_seconds(self) -> Dict[str, float]:
+        return {stage.name: stage.seconds for stage, _ in self._steps if stage.seconds is not None}
+
+    def status(self) -> Dict[str, Any]:
+        if self.ready:
+            state = READY
+        elif self.finished:
+            state = FAILED
+        else:
+            state = RUNNING if self.started_at is not None else PENDING
+        end = self.finished_at or time.time()
+        return {
+            "status": state,
+            "seconds": end - self.started_at if self.started_at is not None else None,
+            "stages": {stage.name: stage.to_dict() for stage, _ in self._steps},
+        }
@@ -0,0 +1,215 @@
+"""
+Pool borné pour les calculs bloquants (moteur natif, Excel/xlwings).
+
+Les endpoints async délèguent le calcul à un pool de threads ou de processus
+au lieu de bloquer la boucle d'événements. Le nombre de calculs en attente est
+borné : au-delà, la requête est refusée immédiatement (503 + Retry-After)
+plutôt que de s'empiler. Chaque calcul a un délai maximal, et le pool expose
+la profondeur de file, les temps d'attente et d'exécution.
+"""
+import asyncio
+import functools
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from metrics import SamplingProfiler, current_trace, tracing
+from structured_logging import current_request_id, request_context
+
+logger = logging.getLogger(__name__)
+
+# Période d'échantillonnage du profileur activé par requête
+PROFILE_INTERVAL = float(os.environ.get("PORTALIA_PROFILE_INTERVAL", "0.005"))
+
+
+class PoolSaturated(Exception):
+    """Raised when the pool and its queue are full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Worker pool saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PoolTimeout(Exception):
+    """Raised when a task exceeds the per-request timeout."""
+
+
+class _RemoteHTTPError:
+    """HTTPException is not picklable: carried back from worker processes in this form."""
+
+    def __init__(self, status_code: int, detail: Any, headers: Optional[Dict[str, str]]):
+        self.status_code, self.detail, self.headers = status_code, detail, headers
+
+
+def _timed_call(function: Callable, args: tuple, kwargs: dict, profile: bool = False,
+                request_id: Optional[str] = None):
+    """
+    Runs in the worker: returns (start time, end time, result, spans, events,
+    counts, profile). The stage spans are collected here and shipped back because a
+    worker process (or thread, for contextvars) does not see the request trace;
+    the request id is passed in for the same reason.
+    """
+    started = time.time()
+    profiler = SamplingProfiler(interval=PROFILE_INTERVAL).start() if profile else None
+    try:
+        with request_context(request_id), tracing() as trace:
+            try:
+                result = function(*args, **kwargs)
+            except HTTPException as e:
+                result = _RemoteHTTPError(e.status_code, e.detail, e.headers)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    profile_result = profiler.result() if profiler is not None else None
+    return started, time.time(), result, trace.spans, trace.events, trace.counts, profile_result
+
+
+class _Stats:
+    """Running count / sum / max of a duration."""
+
+    __slots__ = ("count", "total", "maximum")
+
+    def __init__(self):
+        self.count, self.total, self.maximum = 0, 0.0, 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "average_seconds": self.total / self.count if self.count else 0.0,
+            "max_seconds": self.maximum,
+        }
+
+
+class WorkerPool:
+    """
+    Bounded executor for blocking work. At most ``max_workers`` tasks run and
+    ``max_queue`` wait; further submissions raise ``PoolSaturated``.
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: int = 4, max_queue: int = 32,
+                 timeout: float = 30.0):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown worker pool kind '{kind}' (expected 'thread' or 'process')")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.wait_time = _Stats()
+        self.execution_time = _Stats()
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == "process":
+                        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                            thread_name_prefix="portalia-worker")
+        return self._executor
+
+    @property
+    def running(self) -> int:
+        # L'exécuteur fait tourner au plus max_workers tâches, les autres attendent
+        return min(self.pending, self.max_workers)
+
+    @property
+    def queue_depth(self) -> int:
+        """Tasks accepted but not started yet."""
+        return self.pending - self.running
+
+    def _retry_after(self) -> int:
+        # Estimation : temps pour écouler la file au rythme moyen d'exécution
+        average = self.execution_time.total / self.execution_time.count if self.execution_time.count else 1.0
+        return max(1, math.ceil(average * (self.queue_depth + 1) / self.max_workers))
+
+    async def run(self, function: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Run ``function`` in the pool; raises PoolSaturated or PoolTimeout. The
+        worker's stage spans (and profile, if requested) land on the current trace.
+        """
+        with self._lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PoolSaturated(self._retry_after())
+            self.pending += 1
+        submitted = time.time()
+        trace = current_trace()
+        profile = trace is not None and trace.profile
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(_timed_call, function, args, kwargs, profile, current_request_id()))
+        try:
+            started, finished, result, spans, events, counts, profile_result = await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            # Le calcul ne peut pas être interrompu : la place n'est libérée qu'à sa fin
+            future.add_done_callback(lambda _: self._release())
+            raise PoolTimeout(f"Calculation exceeded {timeout or self.timeout:.1f}s")
+        except asyncio.CancelledError:
+            # Requête abandonnée : le calcul continue, sa place est libérée à la fin
+            future.add_done_callback(lambda _: self._release())
+            raise
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            self._release()
+            raise
+        with self._lock:
+            self.completed += 1
+            self.wait_time.add(max(started - submitted, 0.0))
+            self.execution_time.add(finished - started)
+        self._release()
+        if trace is not None:
+            trace.add("pool_wait", max(started - submitted, 0.0))
+            trace.extend(spans, events, counts)
+            trace.profile_result = profile_result or trace.profile_result
+        if isinstance(result, _RemoteHTTPError):
+            raise HTTPException(status_code=result.status_code, detail=result.detail, headers=result.headers)
+        return result
+
+    def _release(self) -> None:
+        with self._lock:
+            self.pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "timeout_seconds": self.timeout,
+                "in_flight": self.pending,
+                "running": self.running,
+                "queue_depth": self.queue_depth,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "wait_time": self.wait_time.to_dict(),
+                "execution_time": self.execution_time.to_dict(),
+            }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None